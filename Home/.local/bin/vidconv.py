@@ -0,0 +1,5471 @@
+#!/usr/bin/env python3
+"""Unified video/audio converter with SVT-AV1, VP9, H.265, x264 support."""
+
+import argparse
+import asyncio
+import bisect
+import csv
+import ctypes
+import errno
+import fcntl
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import re
+import select
+import shutil
+import signal
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext, suppress
+from functools import lru_cache
+from glob import escape as glob_escape
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable, Final, Iterable, Iterator
+
+
+# ─── Constants ───
+VIDEO_EXTS: Final = frozenset(
+    {".mp4", ".mkv", ".m4v", ".avi", ".mov", ".ts", ".flv", ".wmv", ".webm"}
+)
+AUDIO_EXTS: Final = frozenset({".mp3", ".ogg", ".opus", ".m4a", ".aac", ".wma"})
+PASSTHROUGH_EXTS: Final = frozenset({".wav", ".flac"})
+C_RED: Final = "\033[31m"
+C_GREEN: Final = "\033[32m"
+C_YELLOW: Final = "\033[33m"
+C_CYAN: Final = "\033[36m"
+C_RESET: Final = "\033[0m"
+JOURNAL_NAME: Final = ".vidconv-journal.jsonl"
+JOURNAL_COMPACT: Final = 8 << 20  # bytes before a run without --resume compacts
+# Options that only affect one stream type; dropped when that stream is copied
+VIDEO_OPTS: Final = frozenset(
+    {
+        "-c:v",
+        "-crf",
+        "-b:v",
+        "-preset",
+        "-cpu-used",
+        "-row-mt",
+        "-g",
+        "-pix_fmt",
+        "-svtav1-params",
+        "-x265-params",
+        "-threads",
+        "-tile-columns",
+    }
+)
+AUDIO_OPTS: Final = frozenset({"-c:a", "-b:a", "-ac", "-rematrix_maxval", "-vbr"})
+# Relative bits needed for equal quality (AV1 = 1.0)
+CODEC_COST: Final = {"av1": 1.0, "vp9": 1.3, "hevc": 1.3, "h264": 2.0}
+# Probe codec name each preset encoder produces; only that codec is copied
+ENCODER_CODECS: Final = {
+    "libsvtav1": "av1",
+    "libvpx-vp9": "vp9",
+    "libx265": "hevc",
+    "libx264": "h264",
+}
+# Codecs each output container can hold (None = anything)
+CONTAINER_CODECS: Final[dict[str, frozenset[str] | None]] = {
+    "mkv": None,
+    "webm": frozenset({"av1", "vp9", "vp8", "opus", "vorbis"}),
+    "mp4": frozenset({"av1", "vp9", "hevc", "h264", "opus", "aac", "mp3", "flac"}),
+    "opus": frozenset({"opus"}),
+}
+ROTATE_FILTERS: Final = {
+    90: "transpose=1",
+    180: "transpose=1,transpose=1",
+    270: "transpose=2",
+}
+DEINTERLACE_FILTERS: Final = {
+    "bwdif": "bwdif=mode=send_frame:parity=auto:deint=all",
+    "yadif": "yadif=mode=send_frame:parity=auto:deint=all",
+    "decomb": "yadif=mode=send_field:parity=auto",
+}
+# Rough CPU per megapixel-frame, hqdn3d = 1
+FILTER_COST: Final = {
+    "bwdif": 1.2,
+    "yadif": 0.8,
+    "hqdn3d": 1.0,
+    "nlmeans": 30.0,
+    "deblock": 0.8,
+    "transpose": 0.4,
+    "crop": 0.0,
+    "scale": 1.0,
+    "deband": 1.5,
+    "format": 0.3,
+}
+# Luma PSNR of a frame vs. its spatially denoised self -> denoiser to use.
+# None keeps the light default hqdn3d.
+NOISE_LEVELS: Final = (
+    (46.0, "off", ""),
+    (42.0, None, ""),
+    (38.0, "hqdn3d", "light"),
+    (34.0, "nlmeans", "light"),
+    (0.0, "nlmeans", "medium"),
+)
+NOISE_SAMPLES: Final = 3
+# 8-bit sources below this bits/pixel/frame tend to show banding
+BANDING_BPP: Final = 0.08
+# stderr lines kept per ffmpeg run for failure classification
+STDERR_TAIL: Final = 40
+# First match wins; anything unmatched is treated as transient and retried
+FAILURE_PATTERNS: Final = (
+    ("out of disk", re.compile(r"No space left on device|Disk quota exceeded", re.I)),
+    ("oom-killed", re.compile(r"Cannot allocate memory|out of memory", re.I)),
+    (
+        "encoder missing",
+        re.compile(
+            r"Unknown encoder|Encoder not found|Unrecognized option|Option not found"
+            r"|No such filter|Error (?:initializing|selecting) (?:output stream|an encoder)"
+            r"|Could not find tag for codec",
+            re.I,
+        ),
+    ),
+    (
+        "input corrupt",
+        re.compile(
+            # Only demuxer/decoder wording: a missing output or scratch dir
+            # also says "No such file or directory" and is worth a retry
+            r"Invalid data found when processing input|moov atom not found"
+            r"|could not find codec parameters|Error while decoding"
+            r"|Error opening input|corrupt (?:decoded frame|input packet)|Packet corrupt",
+            re.I,
+        ),
+    ),
+)
+# Directory scanners for find_files(); latency-bound on network mounts
+SCAN_THREADS: Final = 16
+# cropdetect sample points per file for --crop auto
+CROP_SAMPLES: Final = 6
+# bits/pixel/frame of an AV1 encode at CRF 26, halved every +6 CRF
+BPP_CRF26: Final = 0.04
+BENCH_SOURCES: Final = {
+    "testsrc2": "testsrc2=size={w}x{h}:rate=30",
+    "mandelbrot": "mandelbrot=size={w}x{h}:rate=30",
+    "noise": "color=c=gray:size={w}x{h}:rate=30,noise=alls=40:allf=t+u",
+}
+BENCH_SIZES: Final = {"720p": (1280, 720), "1080p": (1920, 1080), "2160p": (3840, 2160)}
+PROBE_CACHE: Final = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "vidconv"
+    / "probe.sqlite"
+)
+# Journals of runs without -o, one per source root (outputs sit beside inputs)
+JOURNAL_DIR: Final = (
+    Path(os.environ.get("XDG_STATE_HOME") or Path.home() / ".local" / "state")
+    / "vidconv"
+)
+
+
+@dataclass(frozen=True, slots=True)
+class Preset:
+    name: str
+    suffix: str
+    params: tuple[tuple[str, str | None], ...]
+    is_video: bool = True
+    ext: str = "mkv"
+    # Appended only when a per-job thread budget is set
+    threads: tuple[tuple[str, str | None], ...] = ()
+
+
+PRESETS: Final = {
+    "av1": Preset(
+        "av1",
+        ".av1-crf{crf}",
+        (
+            ("-c:v", "libsvtav1"),
+            ("-crf", "{crf}"),
+            ("-preset", "{preset}"),
+            ("-g", "{keyint}"),
+            ("-pix_fmt", "{pix_fmt}"),
+            (
+                "-svtav1-params",
+                "tune=0:film-grain={grain}:enable-qm=1:qm-min=0:enable-variance-boost=1:tf-strength=1:sharpness=-2:tile-columns=1:tile-rows=0:enable-dlf=2:scd=1{fast_decode}{lp}",
+            ),
+            ("-c:a", "libopus"),
+            ("-b:a", "{audio_bitrate}"),
+            ("-ac", "{audio_channels}"),
+            ("-rematrix_maxval", "1.0"),
+            ("-vbr", "on"),
+            ("-map_metadata", "0"),
+            ("-sn", None),
+        ),
+        ext="mkv",
+    ),
+    "vp9": Preset(
+        "vp9",
+        ".vp9-crf{crf}",
+        (
+            ("-c:v", "libvpx-vp9"),
+            ("-crf", "{crf}"),
+            ("-b:v", "0"),
+            ("-cpu-used", "{preset}"),
+            ("-row-mt", "1"),
+            ("-g", "{keyint}"),
+            ("-pix_fmt", "{pix_fmt}"),
+            ("-c:a", "libopus"),
+            ("-b:a", "{audio_bitrate}"),
+            ("-ac", "{audio_channels}"),
+            ("-rematrix_maxval", "1.0"),
+            ("-vbr", "on"),
+            ("-map_metadata", "0"),
+            ("-sn", None),
+        ),
+        ext="webm",
+        threads=(("-threads", "{threads}"), ("-tile-columns", "{tile_columns}")),
+    ),
+    "h265": Preset(
+        "h265",
+        ".h265-crf{crf}",
+        (
+            ("-c:v", "libx265"),
+            ("-crf", "{crf}"),
+            ("-preset", "{preset_name}"),
+            ("-x265-params", "log-level=error{pools}"),
+            ("-pix_fmt", "{pix_fmt}"),
+            ("-c:a", "libopus"),
+            ("-b:a", "{audio_bitrate}"),
+            ("-ac", "{audio_channels}"),
+            ("-rematrix_maxval", "1.0"),
+            ("-vbr", "on"),
+            ("-map_metadata", "0"),
+            ("-sn", None),
+        ),
+        ext="mkv",
+    ),
+    "x264": Preset(
+        "x264",
+        ".x264-crf{crf}",
+        (
+            ("-c:v", "libx264"),
+            ("-crf", "{crf}"),
+            ("-preset", "{preset_name}"),
+            ("-c:a", "aac"),
+            ("-b:a", "{audio_bitrate}"),
+            ("-map_metadata", "0"),
+            ("-sn", None),
+        ),
+        ext="mp4",
+        threads=(("-threads", "{threads}"),),
+    ),
+    "opus": Preset(
+        "opus",
+        ".{audio_bitrate}",
+        (
+            ("-c:a", "libopus"),
+            ("-b:a", "{audio_bitrate}"),
+            ("-vbr", "on"),
+        ),
+        False,
+        "opus",
+    ),
+}
+
+
+@dataclass(slots=True)
+class Config:
+    crf: int = 26
+    preset: int = 3
+    preset_name: str = "slow"
+    grain: int = 6
+    audio_bitrate: str = "128k"
+    audio_channels: int = 2
+    max_dim: tuple[int, int] = (1920, 1080)
+    pix_fmt: str = "yuv420p10le"
+    keyint: int = 600
+    fast_decode: bool = False
+    default_denoise: bool = True
+    default_deband: bool = True
+    deinterlace: str | None = None
+    denoise: str | None = None
+    denoise_strength: str = "light"
+    deblock: str | None = None
+    rotate: int = 0
+    crop: str | None = None
+    scale: str | None = None
+    extra: list[str] = field(default_factory=list)
+    dry_run: bool = False
+    skip_existing: bool = True
+    in_place: bool = False
+    abort_larger: bool = False  # implied by in_place
+    abort_margin: float = 0.05
+    probe_cache: Path | None = None
+    passthrough: bool = False
+    threads: int = 0
+    pin: bool = False
+    adaptive: bool = False
+    min_jobs: int = 1
+    mem_budget: int = 0  # bytes of estimated encoder memory in flight; 0 = off
+    order: str = "discovery"
+    lookahead: int = 512
+    chunked: bool = False
+    chunk_split: str = "keyframes"
+    chunk_len: float = 60.0
+    chunk_jobs: int = 1
+    resume: bool = False
+    metrics_out: Path | None = None
+    target_ssim: float | None = None
+    target_psnr: float | None = None
+    crf_range: tuple[int, int] = (18, 45)
+    samples: int = 3
+    sample_len: float = 4.0
+    frame_size: tuple[int, int] | None = None  # probed, set per file
+    auto_filters: bool = True
+    engine: str = "threads"
+    batch: int = 1
+    plan_out: Path | None = None
+    scratch: Path | None = None
+    scratch_budget: int = 0  # bytes; 0 = half the scratch disk's free space
+    dedup: bool = False
+    full_hash: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class Stream:
+    index: int
+    kind: str
+    codec: str
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    bit_rate: int = 0
+    channels: int = 0
+    pix_fmt: str = ""
+    field_order: str = ""
+
+
+@dataclass(frozen=True, slots=True)
+class Probe:
+    duration: float
+    size: int
+    bit_rate: int
+    format_name: str
+    streams: tuple[Stream, ...]
+
+    @property
+    def video(self) -> Stream | None:
+        return next((s for s in self.streams if s.kind == "video"), None)
+
+    @property
+    def audio(self) -> tuple[Stream, ...]:
+        return tuple(s for s in self.streams if s.kind == "audio")
+
+    @property
+    def pixels(self) -> int:
+        v = self.video
+        return v.width * v.height if v else 0
+
+    def describe(self) -> str:
+        parts: list[str] = []
+        if v := self.video:
+            parts.append(f"{v.codec} {v.width}x{v.height} {v.fps:.3g}fps")
+        parts.extend(f"{a.codec} {a.channels}ch" for a in self.audio)
+        m, s = divmod(int(self.duration), 60)
+        h, m = divmod(m, 60)
+        parts.append(f"{h:d}:{m:02d}:{s:02d}")
+        return ", ".join(parts)
+
+
+@dataclass(frozen=True, slots=True)
+class StreamPlan:
+    video: str | None = None
+    audio: str | None = None
+    skip: bool = False
+
+    def describe(self) -> str:
+        return ", ".join(
+            f"{k}: {v}" for k, v in (("video", self.video), ("audio", self.audio)) if v
+        )
+
+
+@dataclass(slots=True)
+class RunResult:
+    ok: bool
+    returncode: int = 0
+    wall: float = 0.0
+    utime: float = 0.0
+    stime: float = 0.0
+    maxrss: int = 0
+    frames: int = 0
+    tool: str = "ffmpeg"
+    attempt: int = 1
+    stderr: str = ""  # tail only, see STDERR_TAIL
+    reason: str = ""
+
+    def __bool__(self) -> bool:
+        return self.ok
+
+    @classmethod
+    def combine(cls, results: list["RunResult"], wall: float) -> "RunResult":
+        return cls(
+            ok=bool(results) and all(results),
+            returncode=next((r.returncode for r in results if not r), 0),
+            wall=wall,
+            utime=sum(r.utime for r in results),
+            stime=sum(r.stime for r in results),
+            # Chunks overlap, so the sum bounds the concurrent peak from above
+            maxrss=sum(r.maxrss for r in results),
+            frames=sum(r.frames for r in results if r.ok),
+            stderr=next((r.stderr for r in results if not r), ""),
+        )
+
+
+@dataclass(slots=True)
+class Stats:
+    processed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    input_bytes: int = 0
+    output_bytes: int = 0
+    failures: list[str] = field(default_factory=list)
+    decisions: Counter[str] = field(default_factory=Counter)
+
+    def merge(self, other: "Stats") -> None:
+        self.processed += other.processed
+        self.skipped += other.skipped
+        self.failed += other.failed
+        self.input_bytes += other.input_bytes
+        self.output_bytes += other.output_bytes
+        self.failures.extend(other.failures)
+        self.decisions.update(other.decisions)
+
+
+def _hms(sec: float) -> str:
+    m, s = divmod(int(sec), 60)
+    h, m = divmod(m, 60)
+    return f"{h:d}:{m:02d}:{s:02d}"
+
+
+def _progress_seconds(fields: dict[str, str]) -> float:
+    # out_time_ms is in microseconds too (long-standing ffmpeg quirk)
+    us = fields.get("out_time_us") or fields.get("out_time_ms") or ""
+    return max(0.0, _num(us) / 1e6) if us.lstrip("-").isdigit() else 0.0
+
+
+ProgressFn = Callable[[dict[str, str], int], None]
+# Per -progress block; returning True asks run_cmd to stop the process
+ProgressHook = Callable[[dict[str, str]], bool | None]
+
+
+@dataclass(slots=True)
+class Task:
+    name: str
+    duration: float
+    # Per sub-process (chunk) state: out_time seconds, fps, speed, bytes
+    parts: dict[int, tuple[float, float, float, int]] = field(default_factory=dict)
+
+    @property
+    def position(self) -> float:
+        return sum(p[0] for p in self.parts.values())
+
+
+class Progress:
+    def __init__(self, tty: bool, interval: float = 1.0) -> None:
+        self.tty = tty
+        self.interval = interval if tty else 60.0
+        self.total_seconds = 0.0
+        self.done_seconds = 0.0
+        self.files_total = 0
+        self.files_done = 0
+        self.discovering = True
+        self._lock = threading.RLock()
+        self._tasks: dict[int, Task] = {}
+        self._ids = itertools.count()
+        self._lines = 0
+        self._start = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def add(self, duration: float) -> None:
+        with self._lock:
+            self.total_seconds += duration
+            self.files_total += 1
+
+    def finish(self, duration: float, encoded: bool = True) -> None:
+        with self._lock:
+            # Skipped files were never work: drop them rather than count them
+            # as done, which would inflate the rate and shorten the ETA
+            if encoded:
+                self.done_seconds += duration
+            else:
+                self.total_seconds -= duration
+            self.files_done += 1
+
+    @contextmanager
+    def task(self, name: str, duration: float) -> Iterator[ProgressFn]:
+        tid = next(self._ids)
+        with self._lock:
+            self._tasks[tid] = Task(name, duration)
+
+        def report(fields: dict[str, str], part: int = 0) -> None:
+            with self._lock:
+                if t := self._tasks.get(tid):
+                    t.parts[part] = (
+                        _progress_seconds(fields),
+                        _num(fields.get("fps"), float),
+                        _num(fields.get("speed", "").rstrip("x"), float),
+                        _num(fields.get("total_size")),
+                    )
+
+        try:
+            yield report
+        finally:
+            with self._lock:
+                self._tasks.pop(tid, None)
+
+    def lines(self) -> list[str]:
+        with self._lock:
+            tasks = list(self._tasks.values())
+            active = sum(t.position for t in tasks)
+            encoded = self.done_seconds + active
+            remaining = max(0.0, self.total_seconds - encoded)
+            files = f"{self.files_done}/{self.files_total}"
+        out = []
+        for n, t in enumerate(tasks, 1):
+            parts = t.parts.values()
+            pct = f"{t.position / t.duration:6.1%}" if t.duration else "     ?"
+            out.append(
+                f" [{n}] {t.name[:36]:<36} {pct} {_hms(t.position)}/{_hms(t.duration)}"
+                f" {sum(p[1] for p in parts):6.1f}fps {sum(p[2] for p in parts):5.2f}x"
+                f" {sum(p[3] for p in parts) / 1e6:8.1f}MB"
+            )
+        elapsed = time.monotonic() - self._start
+        rate = encoded / elapsed if elapsed > 0 else 0.0
+        eta = _hms(remaining / rate) if rate > 0 else "?"
+        more = "+" if self.discovering else ""
+        speed = sum(p[2] for t in tasks for p in t.parts.values())
+        out.append(
+            f" ▶ {files}{more} files  {_hms(encoded)}/{_hms(self.total_seconds)}{more}"
+            f" encoded  {speed:.2f}x  ETA {eta}{more}"
+        )
+        return out
+
+    def _clear(self) -> None:
+        if self._lines:
+            sys.stdout.write(f"\033[{self._lines}F\033[J")
+            self._lines = 0
+
+    def render(self) -> None:
+        with self._lock:
+            lines = self.lines()
+            if self.tty:
+                self._clear()
+                sys.stdout.write("\n".join(lines) + "\n")
+                self._lines = len(lines)
+            else:
+                sys.stdout.write(lines[-1].strip() + "\n")
+            sys.stdout.flush()
+
+    def write(self, text: str, file: Any) -> None:
+        with self._lock:
+            if self.tty:
+                self._clear()
+            print(text, file=file, flush=True)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            if self.tty:
+                self._clear()
+                sys.stdout.flush()
+
+
+class Log:
+    def __init__(self, quiet: bool = False, silent: bool = False) -> None:
+        self.quiet = quiet or silent
+        self.silent = silent
+        self.color = sys.stdout.isatty()
+        self.live: Progress | None = None
+
+    def _c(self, col: str, msg: str) -> str:
+        return f"{col}{msg}{C_RESET}" if self.color else msg
+
+    def _out(self, text: str, file: Any = None) -> None:
+        file = file or sys.stdout
+        if self.live:
+            self.live.write(text, file)
+        else:
+            print(text, file=file)
+
+    def info(self, msg: str) -> None:
+        if not self.quiet:
+            self._out(self._c(C_CYAN, msg))
+
+    def ok(self, msg: str) -> None:
+        if not self.quiet:
+            self._out(self._c(C_GREEN, f"✓ {msg}"))
+
+    def warn(self, msg: str) -> None:
+        if not self.silent:
+            self._out(self._c(C_YELLOW, f"⚠ {msg}"), sys.stderr)
+
+    def err(self, msg: str) -> None:
+        self._out(self._c(C_RED, f"✗ {msg}"), sys.stderr)
+
+    def echo(self, line: str) -> None:
+        # A child's stderr, verbatim, kept above the dashboard
+        if not self.quiet:
+            self._out(line.rstrip("\n"), sys.stderr)
+
+
+class CpuPool:
+    def __init__(self, cpus: list[int], slots: int) -> None:
+        self._q: queue.SimpleQueue[frozenset[int]] = queue.SimpleQueue()
+        size = max(1, len(cpus) // max(1, slots))
+        for i in range(max(1, slots)):
+            self._q.put(frozenset(cpus[i * size : (i + 1) * size] or cpus))
+
+    @contextmanager
+    def slot(self) -> Iterator[frozenset[int]]:
+        cpus = self._q.get()
+        try:
+            yield cpus
+        finally:
+            self._q.put(cpus)
+
+    @asynccontextmanager
+    async def slot_async(self) -> Any:
+        # Wait in a worker thread: a blocking get() on the loop thread would
+        # stall every other job's pipes until a slot came back
+        try:
+            cpus = self._q.get_nowait()
+        except queue.Empty:
+            took = asyncio.ensure_future(asyncio.to_thread(self._q.get))
+            try:
+                cpus = await asyncio.shield(took)
+            except asyncio.CancelledError:
+                # The thread still takes a slot eventually; hand it back
+                took.add_done_callback(lambda f: self._q.put(f.result()))
+                raise
+        try:
+            yield cpus
+        finally:
+            self._q.put(cpus)
+
+
+# ─── Admission ───
+ADAPT_INTERVAL: Final = 10.0  # seconds between load samples
+# PSI avg10 percentages: cpu uses "some", memory/io use "full"
+PRESSURE_HIGH: Final = {"cpu": 60.0, "memory": 5.0, "io": 30.0}
+PRESSURE_LOW: Final = {"cpu": 20.0, "memory": 0.5, "io": 5.0}
+LOAD_HIGH: Final = 1.5  # loadavg per CPU that forces a step down
+IOPRIO_SET: Final = {"x86_64": 251, "aarch64": 30, "riscv64": 30, "i686": 289, "armv7l": 314}
+
+
+class Gate:
+    # Admits encodes in arrival order while the running count fits the limit
+    # and their estimated memory fits the budget; the limit may move
+    def __init__(self, limit: int, mem_budget: int = 0) -> None:
+        self.limit = limit
+        self.mem_budget = mem_budget
+        self.active = 0
+        self.mem = 0
+        self._cond = threading.Condition()
+        self._line: deque[object] = deque()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _wake(self) -> None:
+        self._cond.notify_all()
+        for loop, fut in self._waiters:
+            loop.call_soon_threadsafe(lambda f=fut: f.done() or f.set_result(None))
+        self._waiters.clear()
+
+    def _take(self, mem: int, ticket: object | None) -> bool:
+        if self._line and self._line[0] is not ticket:
+            return False  # someone has been waiting longer
+        # An idle gate always admits, so a job over budget still runs (alone)
+        if self.active and (
+            self.active >= self.limit
+            or (self.mem_budget and self.mem + mem > self.mem_budget)
+        ):
+            return False
+        if ticket is not None:
+            self._line.popleft()
+            self._wake()
+        self.active += 1
+        self.mem += mem
+        return True
+
+    def set_limit(self, limit: int) -> None:
+        with self._cond:
+            self.limit = limit
+            self._wake()
+
+    def release(self, mem: int = 0) -> None:
+        with self._cond:
+            self.active -= 1
+            self.mem -= mem
+            self._wake()
+
+    @contextmanager
+    def slot(self, mem: int = 0) -> Iterator[None]:
+        with self._cond:
+            if not self._take(mem, None):
+                ticket = object()
+                self._line.append(ticket)
+                while not self._take(mem, ticket):
+                    self._cond.wait()
+        try:
+            yield
+        finally:
+            self.release(mem)
+
+    @asynccontextmanager
+    async def slot_async(self, mem: int = 0) -> Any:
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            admitted = self._take(mem, None)
+            ticket = object()
+            if not admitted:
+                self._line.append(ticket)
+        try:
+            while not admitted:
+                with self._cond:
+                    if admitted := self._take(mem, ticket):
+                        break
+                    fut = loop.create_future()
+                    self._waiters.append((loop, fut))
+                await fut
+        except asyncio.CancelledError:
+            with self._cond:
+                with suppress(ValueError):
+                    self._line.remove(ticket)
+                self._wake()
+            raise
+        try:
+            yield
+        finally:
+            self.release(mem)
+
+
+MEM_BASE: Final = 150 << 20  # ffmpeg itself, demuxers, audio
+# Frames an encoder holds at once (lookahead, references, pipeline)
+MEM_FRAMES: Final = {"libsvtav1": 96, "libx265": 64, "libvpx-vp9": 40, "libx264": 48}
+# Filter working sets, in frames at input size
+MEM_FILTER_FRAMES: Final = {"nlmeans": 24, "bwdif": 4, "yadif": 4, "w3fdif": 4}
+MEM_HEADROOM: Final = 1.15  # margin over the worst measured/estimated ratio
+MEM_OOM_GROWTH: Final = 1.5
+MEM_PROBE_FRAMES: Final = 8  # crop/noise probes: decoder queue plus a short filter
+
+
+def frame_mem(cfg: Config, probe: Probe | None) -> float:
+    v = probe.video if probe else None
+    w, h = cfg.frame_size or ((v.width, v.height) if v and v.width else (1920, 1080))
+    return w * h * 1.5 * (2 if "10" in cfg.pix_fmt or "12" in cfg.pix_fmt else 1)
+
+
+def probe_mem(cfg: Config, probe: Probe | None, samples: int) -> int:
+    # The samples decode in parallel
+    return int(MEM_BASE + frame_mem(cfg, probe) * MEM_PROBE_FRAMES) * samples
+
+
+def estimate_mem(preset: Preset, cfg: Config, probe: Probe | None) -> int:
+    if not preset.is_video:
+        return MEM_BASE
+    codec = dict(preset.params).get("-c:v") or ""
+    frame = frame_mem(cfg, probe)
+    frames = MEM_FRAMES.get(codec, 48)
+    if codec == "libsvtav1":
+        frames *= 1 + max(0, 8 - cfg.preset) / 8  # slow presets look further ahead
+    frames += sum(
+        MEM_FILTER_FRAMES.get(f.partition("=")[0], 1)
+        for step in plan_filters(cfg)
+        for f in step.expr.split(",")
+    )
+    return int(MEM_BASE + frame * frames) * (cfg.chunk_jobs if cfg.chunked else 1)
+
+
+class MemModel:
+    # Static estimates, rescaled per job class by what encodes actually used
+    def __init__(self) -> None:
+        self._factor: dict[tuple[Any, ...], float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(preset: Preset, cfg: Config) -> tuple[Any, ...]:
+        denoise = (denoise_filter(cfg) or "").partition("=")[0]
+        return preset.name, cfg.preset, denoise, cfg.chunked
+
+    def estimate(self, preset: Preset, cfg: Config, probe: Probe | None) -> int:
+        factor = self._factor.get(self._key(preset, cfg), 1.0)
+        return int(estimate_mem(preset, cfg, probe) * factor)
+
+    def observe(
+        self, preset: Preset, cfg: Config, probe: Probe | None, res: RunResult
+    ) -> None:
+        key = self._key(preset, cfg)
+        with self._lock:
+            old = self._factor.get(key)
+            if not res and classify_failure(res) == "oom-killed":
+                self._factor[key] = (old or 1.0) * MEM_OOM_GROWTH
+            elif res and res.maxrss and not cfg.chunked:
+                # Chunk results sum RSS over sequential processes; not a peak
+                ratio = res.maxrss / estimate_mem(preset, cfg, probe) * MEM_HEADROOM
+                self._factor[key] = ratio if old is None else max(old, ratio)
+
+
+def read_psi(kind: str) -> dict[str, float]:
+    # {"some": avg10, "full": avg10}; empty without PSI (old kernel, no cgroup2)
+    try:
+        text = Path(f"/proc/pressure/{kind}").read_text()
+    except OSError:
+        return {}
+    out = {}
+    for line in text.splitlines():
+        name, _, rest = line.partition(" ")
+        fields = dict(kv.split("=", 1) for kv in rest.split())
+        with suppress(KeyError, ValueError):
+            out[name] = float(fields["avg10"])
+    return out
+
+
+@dataclass(slots=True)
+class LoadSample:
+    load1: float
+    cpus: int
+    pressure: dict[str, float]  # cpu/memory/io, as used by PRESSURE_*
+
+    def describe(self) -> str:
+        psi = " ".join(f"{k}={v:.1f}" for k, v in self.pressure.items())
+        return f"load {self.load1:.1f}/{self.cpus}" + (f", psi {psi}" if psi else "")
+
+
+def sample_load() -> LoadSample:
+    pressure = {}
+    for kind, line in (("cpu", "some"), ("memory", "full"), ("io", "full")):
+        if (v := read_psi(kind).get(line)) is not None:
+            pressure[kind] = v
+    return LoadSample(os.getloadavg()[0], len(available_cpus()), pressure)
+
+
+def adapt_step(
+    limit: int, lo: int, hi: int, s: LoadSample, job_threads: int
+) -> tuple[int, str]:
+    # One step per sample: shrink on any pressure, grow only when all is calm
+    hot = [k for k, v in s.pressure.items() if v >= PRESSURE_HIGH[k]]
+    if s.load1 >= s.cpus * LOAD_HIGH:
+        hot.append("load")
+    if hot and limit > lo:
+        return limit - 1, f"pressure: {', '.join(hot)}"
+    calm = all(v < PRESSURE_LOW[k] for k, v in s.pressure.items())
+    if not hot and calm and limit < hi and s.load1 + job_threads <= s.cpus:
+        return limit + 1, "idle capacity"
+    return limit, ""
+
+
+class Governor:
+    def __init__(self, gate: Gate, lo: int, hi: int, job_threads: int, log: Log) -> None:
+        self.gate, self.lo, self.hi, self.job_threads, self.log = gate, lo, hi, job_threads, log
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(ADAPT_INTERVAL):
+            s = sample_load()
+            limit, why = adapt_step(self.gate.limit, self.lo, self.hi, s, self.job_threads)
+            if limit != self.gate.limit:
+                self.log.info(
+                    f"Concurrency {self.gate.limit} → {limit} ({why}; {s.describe()})"
+                )
+                self.gate.set_limit(limit)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def initial_jobs(lo: int, hi: int, s: LoadSample, job_threads: int) -> int:
+    free = max(0.0, s.cpus - s.load1)
+    return max(lo, min(hi, int(free // max(1, job_threads))))
+
+
+def set_idle_priority(log: Log) -> None:
+    # Applied to vidconv itself before any thread or child exists, so every
+    # encoder inherits it
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError) as e:
+        log.warn(f"SCHED_IDLE unavailable: {e}")
+    if (nr := IOPRIO_SET.get(os.uname().machine)) is None:
+        log.warn("Idle I/O priority unavailable on this architecture")
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    # ioprio_set(IOPRIO_WHO_PROCESS, self, IOPRIO_CLASS_IDLE << 13)
+    if libc.syscall(nr, 1, 0, 3 << 13) != 0:
+        log.warn(f"ioprio_set failed: {os.strerror(ctypes.get_errno())}")
+
+
+class Journal:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._done: set[tuple[str, str]] = set()
+        self._fh = None
+        self._lockfd: int | None = None
+
+    @contextmanager
+    def _flock(self, mode: int) -> Iterator[None]:
+        # Runs sharing a journal append under a shared lock; compaction
+        # rewrites under an exclusive one. A side file, since the journal
+        # itself is replaced.
+        if self._lockfd is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            lock = self.path.with_name(f".{self.path.name}.lock")
+            self._lockfd = os.open(lock, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        fcntl.flock(self._lockfd, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lockfd, fcntl.LOCK_UN)
+
+    def _latest(self) -> dict[tuple[str, str], dict[str, Any]]:
+        latest: dict[tuple[str, str], dict[str, Any]] = {}
+        try:
+            with self.path.open(encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        rec = json.loads(line)
+                        latest[(rec["inp"], rec["out"])] = rec
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        continue  # torn last line after a crash
+        except FileNotFoundError:
+            pass
+        return latest
+
+    def load(self) -> list[tuple[Path, Path]]:
+        state = {k: rec.get("state") for k, rec in self._latest().items()}
+        self._done = {k for k, v in state.items() if v == "done"}
+        return [(Path(i), Path(o)) for (i, o), v in state.items() if v == "start"]
+
+    def compact(self, force: bool = False) -> None:
+        # One line per done or interrupted file: the journal grows with the
+        # tree, not with the number of runs. Outputs are not stat'ed here;
+        # is_done() checks the ones a run actually asks about.
+        with self._lock:
+            if self._fh:
+                self._fh.close()
+                self._fh = None
+            try:
+                size = self.path.stat().st_size
+            except FileNotFoundError:
+                return
+            if not force and size < JOURNAL_COMPACT:
+                return
+            with self._flock(fcntl.LOCK_EX):
+                keep = [
+                    rec
+                    for rec in self._latest().values()
+                    if rec.get("state") in ("start", "done")
+                ]
+                tmp = self.path.with_name(f".{self.path.name}.part")
+                tmp.write_text(
+                    "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in keep),
+                    encoding="utf-8",
+                )
+                os.replace(tmp, self.path)
+
+    @property
+    def done_count(self) -> int:
+        return len(self._done)
+
+    def is_done(self, inp: Path, out: Path) -> bool:
+        # A done output deleted since is work again
+        return (str(inp), str(out)) in self._done and out.exists()
+
+    def record(self, state: str, inp: Path, out: Path, **extra: Any) -> None:
+        line = json.dumps(
+            {"ts": round(time.time(), 3), "state": state, "inp": str(inp), "out": str(out)}
+            | extra,
+            ensure_ascii=False,
+        )
+        with self._lock, self._flock(fcntl.LOCK_SH):
+            # Another run may have compacted (replaced) the file under us
+            if self._fh is not None and self._replaced(self._fh.fileno()):
+                self._fh.close()
+                self._fh = None
+            if self._fh is None:
+                self._fh = self.path.open("a", encoding="utf-8")
+            self._fh.write(line + "\n")
+            self._fh.flush()
+            if state == "done":
+                os.fsync(self._fh.fileno())
+
+    def _replaced(self, fd: int) -> bool:
+        try:
+            return not os.path.samestat(os.fstat(fd), self.path.stat())
+        except FileNotFoundError:
+            return True
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh:
+                self._fh.close()
+                self._fh = None
+            if self._lockfd is not None:
+                os.close(self._lockfd)
+                self._lockfd = None
+
+
+class Metrics:
+    FIELDS: Final = (
+        "ts",
+        "input",
+        "output",
+        "status",
+        "reason",
+        "preset",
+        "speed",
+        "crf",
+        "tool",
+        "attempt",
+        "wall_s",
+        "user_s",
+        "sys_s",
+        "max_rss_mb",
+        "frames",
+        "fps",
+        "duration_s",
+        "input_bytes",
+        "output_bytes",
+        "ratio",
+    )
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.csv = path.suffix.lower() == ".csv"
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fresh = not path.exists() or path.stat().st_size == 0
+        self._fh = path.open("a", encoding="utf-8", newline="")
+        self._csv = csv.DictWriter(self._fh, fieldnames=self.FIELDS) if self.csv else None
+        if self._csv and fresh:
+            self._csv.writeheader()
+
+    def write(self, rec: dict[str, Any]) -> None:
+        with self._lock:
+            if self._csv:
+                self._csv.writerow({k: rec.get(k, "") for k in self.FIELDS})
+            else:
+                self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._fh.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
+
+def _values(preset: Preset) -> set[str | None]:
+    return {v for _, v in preset.params}
+
+
+def metric_record(
+    inp: Path,
+    out: Path,
+    preset: Preset,
+    cfg: Config,
+    res: RunResult,
+    duration: float,
+    in_sz: int,
+    out_sz: int,
+) -> dict[str, Any]:
+    return {
+        "ts": round(time.time(), 3),
+        "input": str(inp),
+        "output": str(out),
+        "status": "ok" if res else "failed",
+        "reason": res.reason,
+        "preset": preset.name,
+        "speed": cfg.preset_name if "{preset_name}" in _values(preset) else cfg.preset,
+        "crf": cfg.crf,
+        "tool": res.tool,
+        "attempt": res.attempt,
+        "wall_s": round(res.wall, 3),
+        "user_s": round(res.utime, 3),
+        "sys_s": round(res.stime, 3),
+        "max_rss_mb": round(res.maxrss / 1e6, 1),
+        "frames": res.frames,
+        "fps": round(res.frames / res.wall, 2) if res.wall else 0.0,
+        "duration_s": round(duration, 3),
+        "input_bytes": in_sz,
+        "output_bytes": out_sz,
+        "ratio": round(out_sz / in_sz, 4) if in_sz else 0.0,
+    }
+
+
+@lru_cache(maxsize=None)
+def has(cmd: str) -> bool:
+    return shutil.which(cmd) is not None
+
+
+def available_cpus() -> list[int]:
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+    topo = Path("/sys/devices/system/cpu")
+
+    # Order SMT siblings next to each other so each pinned set owns whole cores
+    def key(c: int) -> tuple[int, int, int]:
+        try:
+            pkg = int((topo / f"cpu{c}/topology/physical_package_id").read_text())
+            core = int((topo / f"cpu{c}/topology/core_id").read_text())
+        except (OSError, ValueError):
+            return (0, c, c)
+        return (pkg, core, c)
+
+    return sorted(cpus, key=key)
+
+
+def auto_jobs(preset: Preset, cores: int) -> int:
+    # Video encoders scale to roughly 8 threads per instance before efficiency
+    # drops; audio encoders are single-threaded
+    return max(1, cores // 8) if preset.is_video else cores
+
+
+def parse_jobs(v: str) -> int:
+    if v == "auto":
+        return 0
+    try:
+        n = int(v)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an integer or 'auto': {v!r}")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be >= 1: {n}")
+    return n
+
+
+def parse_count(v: str) -> int:
+    try:
+        n = int(v)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an integer: {v!r}")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be >= 1: {n}")
+    return n
+
+
+def parse_size(v: str) -> int:
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?", v.strip().lower())
+    if not m:
+        raise argparse.ArgumentTypeError(f"expected a size like 20G: {v!r}")
+    return int(float(m[1]) * 1024 ** " kmgt".index(m[2] or " "))
+
+
+class WalkStats:
+    # Stats scan_tree() already paid for, by the path it yielded; canonical means
+    # resolve() would return the same path. Dropped once a run is done with them.
+    def __init__(self) -> None:
+        self._seen: dict[Path, tuple[os.stat_result, bool]] = {}
+
+    def add(self, p: Path, st: os.stat_result, canonical: bool) -> None:
+        self._seen[p] = (st, canonical)
+
+    def get(self, p: Path) -> tuple[os.stat_result, bool] | None:
+        return self._seen.get(p)
+
+    def forget(self, p: Path) -> None:
+        self._seen.pop(p, None)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+def path_stat(p: Path, walk: WalkStats | None = None) -> os.stat_result:
+    hit = walk.get(p) if walk else None
+    return hit[0] if hit else p.stat()
+
+
+def real_path(p: Path, walk: WalkStats | None = None) -> Path:
+    hit = walk.get(p) if walk else None
+    return p if hit and hit[1] else p.resolve()
+
+
+def scan_tree(
+    root: Path,
+    exts: frozenset[str],
+    workers: int = SCAN_THREADS,
+    stats: WalkStats | None = None,
+) -> Iterator[Path]:
+    dirs: queue.SimpleQueue[str | None] = queue.SimpleQueue()
+    # One list per directory keeps queue traffic off the per-file path; bounded
+    # so a slow consumer holds back the scan instead of buffering 1M paths
+    out: queue.Queue[list[Path] | None] = queue.Queue(maxsize=256)
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = 1  # directories queued or being scanned
+    canonical = root == root.resolve()
+
+    def emit(item: list[Path] | None) -> None:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan() -> None:
+        nonlocal pending
+        while (d := dirs.get()) is not None:
+            batch: list[Path] = []
+            try:
+                with os.scandir(d) as it:
+                    for e in it:
+                        # Hidden entries include our own .part outputs and chunk dirs
+                        if stop.is_set() or e.name.startswith("."):
+                            continue
+                        try:
+                            if e.is_dir(follow_symlinks=False):
+                                with lock:
+                                    pending += 1
+                                dirs.put(e.path)
+                            elif os.path.splitext(e.name)[1].lower() in exts:
+                                if not e.is_file():
+                                    continue
+                                f = Path(e.path)
+                                if stats is not None:
+                                    stats.add(
+                                        f, e.stat(), canonical and not e.is_symlink()
+                                    )
+                                batch.append(f)
+                        except OSError:
+                            continue
+            except OSError:
+                pass
+            if batch:
+                emit(batch)
+            with lock:
+                pending -= 1
+                last = pending == 0
+            if last:
+                for _ in range(workers):
+                    dirs.put(None)
+                emit(None)
+
+    dirs.put(str(root))
+    for _ in range(max(1, workers)):
+        threading.Thread(target=scan, daemon=True).start()
+    try:
+        while (batch := out.get()) is not None:
+            yield from batch
+    finally:
+        stop.set()
+
+
+def find_files(
+    root: Path, exts: frozenset[str], stats: WalkStats | None = None
+) -> Iterator[Path]:
+    yield from scan_tree(root, exts, stats=stats)
+
+
+def _num(v: Any, typ: type = int) -> Any:
+    try:
+        return typ(v)
+    except (TypeError, ValueError):
+        return typ()
+
+
+def _rate(v: str | None) -> float:
+    num, _, den = (v or "").partition("/")
+    try:
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def parse_probe(data: dict[str, Any]) -> Probe:
+    fmt = data.get("format", {})
+    streams = []
+    for s in data.get("streams", []):
+        kind = s.get("codec_type", "")
+        if s.get("disposition", {}).get("attached_pic"):
+            kind = "image"
+        streams.append(
+            Stream(
+                index=_num(s.get("index")),
+                kind=kind,
+                codec=s.get("codec_name", ""),
+                width=_num(s.get("width")),
+                height=_num(s.get("height")),
+                fps=_rate(s.get("avg_frame_rate") or s.get("r_frame_rate")),
+                bit_rate=_num(s.get("bit_rate") or s.get("tags", {}).get("BPS")),
+                channels=_num(s.get("channels")),
+                pix_fmt=s.get("pix_fmt", ""),
+                field_order=s.get("field_order", ""),
+            )
+        )
+    return Probe(
+        duration=_num(fmt.get("duration"), float),
+        size=_num(fmt.get("size")),
+        bit_rate=_num(fmt.get("bit_rate")),
+        format_name=fmt.get("format_name", ""),
+        streams=tuple(streams),
+    )
+
+
+def run_ffprobe(inp: Path) -> dict[str, Any] | None:
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+        str(inp),
+    ]
+    try:
+        res = subprocess.run(
+            cmd, capture_output=True, text=True, timeout=120, shell=False
+        )
+    except (subprocess.SubprocessError, OSError):
+        return None
+    if res.returncode != 0:
+        return None
+    try:
+        return json.loads(res.stdout)
+    except json.JSONDecodeError:
+        return None
+
+
+class ProbeCache:
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(path), check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS probe ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,"
+            " ino INTEGER NOT NULL, data TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, ino INTEGER NOT NULL, data TEXT NOT NULL,"
+            " PRIMARY KEY (path, kind))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS encode ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, ino INTEGER NOT NULL)"
+        )
+
+    def get(self, path: Path, st: os.stat_result) -> Probe | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, ino, data FROM probe WHERE path = ?",
+                (str(path),),
+            ).fetchone()
+        if not row or tuple(row[:3]) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+        try:
+            return parse_probe(json.loads(row[3]))
+        except json.JSONDecodeError:
+            return None
+
+    def put(self, path: Path, st: os.stat_result, data: dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    st.st_size,
+                    st.st_mtime_ns,
+                    st.st_ino,
+                    json.dumps(data, separators=(",", ":")),
+                ),
+            )
+
+    def get_analysis(self, path: Path, st: os.stat_result, kind: str) -> Any | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, ino, data FROM analysis"
+                " WHERE path = ? AND kind = ?",
+                (str(path), kind),
+            ).fetchone()
+        if not row or tuple(row[:3]) != (st.st_size, st.st_mtime_ns, st.st_ino):
+            return None
+        return json.loads(row[3])
+
+    def put_analysis(
+        self, path: Path, st: os.stat_result, kind: str, data: Any
+    ) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    kind,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    st.st_ino,
+                    json.dumps(data, separators=(",", ":")),
+                ),
+            )
+
+    def get_encode(self, key: str) -> tuple[Path, tuple[int, int, int]] | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, size, mtime_ns, ino FROM encode WHERE key = ?", (key,)
+            ).fetchone()
+        return (Path(row[0]), tuple(row[1:])) if row else None
+
+    def put_encode(self, key: str, path: Path, st: os.stat_result) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO encode VALUES (?, ?, ?, ?, ?)",
+                (key, str(path), st.st_size, st.st_mtime_ns, st.st_ino),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def cached_analysis(
+    cache: ProbeCache | None,
+    inp: Path,
+    kind: str,
+    compute: Callable[[], Any],
+    walk: WalkStats | None = None,
+) -> Any:
+    try:
+        st = path_stat(inp, walk)
+        path = real_path(inp, walk)
+    except OSError:
+        return compute()
+    if cache and (hit := cache.get_analysis(path, st, kind)) is not None:
+        return hit
+    value = compute()
+    if cache and value is not None:
+        cache.put_analysis(path, st, kind, value)
+    return value
+
+
+# ─── Scratch staging ───
+COPY_CHUNK: Final = 64 << 20
+
+
+def copy_fast(src: Path, dst: Path, stop: threading.Event | None = None) -> int:
+    # In-kernel copy: copy_file_range, else sendfile (cross-fs, NFS, old kernels)
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        with suppress(OSError, AttributeError):
+            os.posix_fadvise(fi.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        use_range = hasattr(os, "copy_file_range")
+        done = 0
+        while True:
+            if stop and stop.is_set():
+                raise InterruptedError(f"staging {src.name} cancelled")
+            if use_range:
+                try:
+                    n = os.copy_file_range(fi.fileno(), fo.fileno(), COPY_CHUNK)
+                except OSError as e:
+                    if done or e.errno not in (
+                        errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP
+                    ):
+                        raise
+                    use_range = False
+                    continue
+            else:
+                n = os.sendfile(fo.fileno(), fi.fileno(), None, COPY_CHUNK)
+            if not n:
+                return done
+            done += n
+
+
+class Stager:
+    # Copies upcoming inputs to local scratch while earlier jobs encode, and
+    # moves finished outputs to their destination off the encode path
+    def __init__(
+        self, root: Path, budget: int, log: Log, walk: WalkStats | None = None
+    ) -> None:
+        root.mkdir(parents=True, exist_ok=True)
+        self.dir = Path(tempfile.mkdtemp(prefix="vidconv-", dir=root))
+        self.budget = budget or shutil.disk_usage(self.dir).free // 2
+        self.used = 0
+        self.log = log
+        self.walk = walk
+        self._n = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        # inp -> future of (staged path, size), or None when read directly
+        self._staged: dict[Path, Future] = {}
+        self._copying: set[Path] = set()
+        self._copier = ThreadPoolExecutor(1, thread_name_prefix="stage")
+        self._mover = ThreadPoolExecutor(1, thread_name_prefix="deliver")
+        # (input, input bytes, output bytes) reported done whose move failed
+        self.lost: list[tuple[Path, int, int]] = []
+
+    def prefetch(self, inp: Path) -> None:
+        with self._cond:
+            if inp not in self._staged and not self._stop.is_set():
+                self._staged[inp] = self._copier.submit(self._copy, inp)
+
+    def _copy(self, inp: Path) -> tuple[Path, int] | None:
+        try:
+            size = path_stat(inp, self.walk).st_size
+        except OSError:
+            return None
+        with self._cond:
+            # Wait for room; give up once the job has started without us
+            while self.used + size > self.budget:
+                if inp not in self._staged or self._stop.is_set() or size > self.budget:
+                    return None
+                self._cond.wait()
+            if inp not in self._staged:
+                return None
+            self.used += size
+            self._copying.add(inp)
+        dst = self.dir / f"{next(self._n)}-{inp.name}"
+        try:
+            copy_fast(inp, dst, self._stop)
+            return dst, size
+        except OSError as e:
+            dst.unlink(missing_ok=True)
+            with self._cond:
+                self.used -= size
+                self._cond.notify_all()
+            if not self._stop.is_set():
+                self.log.warn(f"  Staging {inp.name} failed: {e}")
+            return None
+        finally:
+            with self._cond:
+                self._copying.discard(inp)
+
+    def acquire(self, inp: Path) -> Path:
+        # Path to read: the staged copy (waiting for one in flight), else the source
+        with self._cond:
+            fut = self._staged.get(inp)
+            if fut is None:
+                return inp
+            if inp not in self._copying and not fut.done():
+                del self._staged[inp]
+                fut.cancel()
+                self._cond.notify_all()
+                return inp
+        staged = fut.result()
+        return staged[0] if staged else inp
+
+    def release(self, inp: Path) -> None:
+        with self._cond:
+            fut = self._staged.pop(inp, None)
+            self._cond.notify_all()
+        if fut is None or fut.cancel() or not (staged := fut.result()):
+            return
+        staged[0].unlink(missing_ok=True)
+        with self._cond:
+            self.used -= staged[1]
+            self._cond.notify_all()
+
+    def output(self, out: Path) -> Path:
+        return self.dir / f"{next(self._n)}-{part_path(out).name}"
+
+    def deliver(
+        self,
+        tmp: Path,
+        out: Path,
+        then: Callable[[], None],
+        undo: Callable[[], None] | None = None,
+    ) -> None:
+        def move() -> None:
+            part = part_path(out)
+            try:
+                shutil.move(tmp, part)
+                os.replace(part, out)
+            except OSError as e:
+                # The journal still says "start", so --resume redoes this file
+                part.unlink(missing_ok=True)
+                tmp.unlink(missing_ok=True)
+                self.log.err(f"  Moving {out.name} failed: {e}")
+                if undo:
+                    undo()
+                return
+            then()
+
+        self._mover.submit(move)
+
+    def flush(self) -> None:
+        self._mover.shutdown(wait=True)
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._copier.shutdown(wait=True, cancel_futures=True)
+        self._mover.shutdown(wait=True)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def count_lost(stats: Stats, lost: list[tuple[Path, int, int]]) -> None:
+    # Items already counted as encoded whose output never reached its place
+    for inp, in_sz, out_sz in lost:
+        stats.processed -= 1
+        stats.input_bytes -= in_sz
+        stats.output_bytes -= out_sz
+        stats.failed += 1
+        stats.failures.append(f"{inp}: output move failed")
+        stats.decisions["failed: move failed"] += 1
+
+
+def stage_ahead(
+    items: Iterator[tuple[Path, Probe | None]],
+    stager: Stager,
+    depth: int,
+    wanted: Callable[[Path], bool],
+) -> Iterator[tuple[Path, Probe | None]]:
+    window: deque[tuple[Path, Probe | None]] = deque()
+    for item in items:
+        if wanted(item[0]):
+            stager.prefetch(item[0])
+        window.append(item)
+        if len(window) > depth:
+            yield window.popleft()
+    yield from window
+
+
+# ─── Encode cache ───
+HASH_CHUNK: Final = 4 << 20
+FICLONE: Final = 0x40049409  # _IOW(0x94, 9, int)
+
+
+def content_hash(path: Path, full: bool = False) -> str:
+    # Size plus head and tail: enough to tell remuxes and copies apart cheaply
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, "little"))
+        if full or size <= 2 * HASH_CHUNK:
+            while chunk := f.read(COPY_CHUNK):
+                h.update(chunk)
+        else:
+            h.update(f.read(HASH_CHUNK))
+            f.seek(-HASH_CHUNK, os.SEEK_END)
+            h.update(f.read(HASH_CHUNK))
+    return ("full:" if full else "") + h.hexdigest()
+
+
+def clone_file(src: Path, dst: Path) -> str:
+    # Reflinks stay independent copies; hardlink where the filesystem can't
+    with open(src, "rb") as fi, open(dst, "wb") as fo, suppress(OSError):
+        fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+        return "reflink"
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        copy_fast(src, dst)
+        return "copy"
+
+
+def link_output(src: Path, out: Path) -> str:
+    tmp = part_path(out)
+    tmp.unlink(missing_ok=True)
+    try:
+        how = clone_file(src, tmp)
+        os.replace(tmp, out)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return how
+
+
+class EncodeCache:
+    # Content key -> finished output. The first claimant of a key encodes it;
+    # duplicates in flight wait for that encode instead of repeating it
+    def __init__(self, db: ProbeCache | None) -> None:
+        self._db = db
+        self._lock = threading.Lock()
+        self._done: dict[str, tuple[Path, tuple[int, int, int]]] = {}
+        self._pending: dict[str, Future[Path | None]] = {}
+
+    def _lookup(self, key: str) -> Path | None:
+        hit = self._done.get(key) or (self._db.get_encode(key) if self._db else None)
+        if not hit:
+            return None
+        try:
+            st = hit[0].stat()
+        except OSError:
+            return None
+        # Replaced or edited since it was recorded
+        return hit[0] if (st.st_size, st.st_mtime_ns, st.st_ino) == hit[1] else None
+
+    def claim(self, key: str) -> Path | Future[Path | None] | None:
+        # A reusable output, a future for the encode in flight, or None: yours
+        with self._lock:
+            if path := self._lookup(key):
+                return path
+            if fut := self._pending.get(key):
+                return fut
+            self._pending[key] = Future()
+        return None
+
+    def settle(self, key: str, out: Path | None) -> None:
+        with self._lock:
+            if out:
+                with suppress(OSError):
+                    st = out.stat()
+                    self._done[key] = (out, (st.st_size, st.st_mtime_ns, st.st_ino))
+                    if self._db:
+                        self._db.put_encode(key, out, st)
+            fut = self._pending.pop(key, None)
+        if fut:
+            fut.set_result(out)
+
+
+@dataclass(slots=True)
+class Runtime:
+    cpus: CpuPool | None = None
+    journal: Journal | None = None
+    progress: Progress | None = None
+    metrics: Metrics | None = None
+    probes: ProbeCache | None = None
+    outputs: dict[Path, Path] | None = None  # planned input -> output
+    stager: Stager | None = None
+    gate: Gate | None = None
+    mem: MemModel | None = None
+    encodes: EncodeCache | None = None
+    done: Callable[[Path], None] | None = None  # told when a file is finished
+    walk: WalkStats | None = None
+
+
+def admit_mem(
+    preset: Preset, cfg: Config, probe: Probe | None, log: Log, rt: Runtime | None
+) -> int:
+    if not (rt and rt.mem and rt.gate):
+        return 0
+    mem = rt.mem.estimate(preset, cfg, probe)
+    if mem > rt.gate.mem_budget:
+        log.warn(f"  Needs ~{mem >> 20}MiB, over --mem-budget: runs alone")
+    return mem
+
+
+def gated(rt: Runtime | None, mem: int, fn: Callable[[], Any]) -> Any:
+    # Analysis encodes (crop, noise, target CRF) share the job and memory limits
+    if not (rt and rt.gate):
+        return fn()
+    with rt.gate.slot(mem if rt.mem else 0):
+        return fn()
+
+
+def probe_file(
+    inp: Path, cache: ProbeCache | None, walk: WalkStats | None = None
+) -> Probe | None:
+    try:
+        st = path_stat(inp, walk)
+        path = real_path(inp, walk)
+    except OSError:
+        return None
+    if cache and (hit := cache.get(path, st)):
+        return hit
+    if not has("ffprobe") or (data := run_ffprobe(path)) is None:
+        return None
+    if cache:
+        cache.put(path, st, data)
+    return parse_probe(data)
+
+
+def prefetch_probes(
+    files: Iterable[Path],
+    cache: ProbeCache | None,
+    ahead: int,
+    walk: WalkStats | None = None,
+) -> Iterator[tuple[Path, Probe | None]]:
+    if cache is None or ahead <= 0:
+        # ahead=0: probe inline, for iterators that block between files
+        for f in files:
+            yield f, probe_file(f, cache, walk) if cache else None
+        return
+    it = iter(files)
+    with ThreadPoolExecutor(max_workers=max(1, ahead)) as executor:
+        window = deque(
+            (f, executor.submit(probe_file, f, cache, walk))
+            for f in itertools.islice(it, max(1, ahead))
+        )
+        while window:
+            f, future = window.popleft()
+            if (nxt := next(it, None)) is not None:
+                window.append((nxt, executor.submit(probe_file, nxt, cache, walk)))
+            yield f, future.result()
+
+
+def job_cost(inp: Path, probe: Probe | None, walk: WalkStats | None = None) -> float:
+    if probe and probe.duration:
+        return probe.duration * max(1, probe.pixels)
+    # Unprobed: bytes are a rough stand-in for pixel-seconds
+    try:
+        return float(path_stat(inp, walk).st_size)
+    except OSError:
+        return 0.0
+
+
+def order_by_cost(
+    items: Iterable[tuple[Path, Probe | None]],
+    window: int,
+    walk: WalkStats | None = None,
+) -> Iterator[tuple[Path, Probe | None]]:
+    heap: list[tuple[float, int, Path, Probe | None]] = []
+    for n, (f, pr) in enumerate(items):
+        heapq.heappush(heap, (-job_cost(f, pr, walk), n, f, pr))
+        if len(heap) > window:
+            _, _, f, pr = heapq.heappop(heap)
+            yield f, pr
+    while heap:
+        _, _, f, pr = heapq.heappop(heap)
+        yield f, pr
+
+
+def parse_bitrate(v: str) -> int:
+    v = v.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(v[-1:], 1)
+    try:
+        return int(float(v.rstrip("km")) * mult)
+    except ValueError:
+        return 0
+
+
+def crf_bitrate(codec: str, cfg: Config, v: Stream) -> int:
+    bpp = BPP_CRF26 * 2 ** ((26 - cfg.crf) / 6) * CODEC_COST.get(codec, 2.0)
+    return int(bpp * v.width * v.height * (v.fps or 24))
+
+
+def _fits(codec: str, ext: str) -> bool:
+    allowed = CONTAINER_CODECS.get(ext)
+    return allowed is None or codec in allowed
+
+
+def plan_streams(
+    inp: Path, preset: Preset, cfg: Config, probe: Probe | None
+) -> StreamPlan | None:
+    if not cfg.passthrough or probe is None:
+        return None
+    video = audio = None
+    if preset.is_video and (v := probe.video):
+        w, h = cfg.max_dim or (v.width, v.height)
+        rate = v.bit_rate or max(0, probe.bit_rate - sum(a.bit_rate for a in probe.audio))
+        reshape = (
+            cfg.scale
+            or cfg.rotate
+            or (cfg.crop and cfg.crop != "off")
+            or (cfg.deinterlace and cfg.deinterlace != "off")
+        )
+        encoder = dict(preset.params).get("-c:v") or ""
+        copy = (
+            v.codec == ENCODER_CODECS.get(encoder)
+            and _fits(v.codec, preset.ext)
+            and (v.width <= w if v.width >= v.height else v.height <= h)
+            and not reshape
+            and 0 < rate <= crf_bitrate(v.codec, cfg, v)
+        )
+        video = "copy" if copy else "encode"
+    if probe.audio:
+        # 5% slack for VBR overshoot of the nominal bitrate
+        limit = parse_bitrate(cfg.audio_bitrate) * 1.05
+        fallback = probe.bit_rate if probe.video is None else 0
+        downmix = any(k == "-ac" for k, _ in preset.params)
+        copy = all(
+            a.codec == "opus"
+            and _fits(a.codec, preset.ext)
+            and not (downmix and a.channels > cfg.audio_channels)
+            and 0 < (a.bit_rate or fallback) <= limit
+            for a in probe.audio
+        )
+        audio = "copy" if copy else "encode"
+    if video is None and audio is None:
+        return None
+    skip = (
+        "encode" not in (video, audio) and inp.suffix.lower() == f".{preset.ext}"
+    )
+    return StreamPlan(video, audio, skip)
+
+
+def denoise_filter(cfg: Config) -> str | None:
+    if not (cfg.default_denoise or (cfg.denoise and cfg.denoise != "off")):
+        return None
+    h = {"ultralight": 2, "light": 4, "medium": 6, "strong": 8}.get(
+        cfg.denoise_strength, 4
+    )
+    if cfg.denoise == "nlmeans":
+        return f"nlmeans=h={h}"
+    if cfg.denoise == "hqdn3d":
+        return f"hqdn3d={h}"
+    return "hqdn3d=1.5:1.5:6:6"
+
+
+def _even(x: float) -> int:
+    return max(2, int(round(x / 2)) * 2)
+
+
+def _scale_size(spec: str, w: int, h: int) -> tuple[int, int]:
+    try:
+        sw, sh = (int(v) for v in re.split(r"[x:]", spec)[:2])
+    except ValueError:
+        return 0, 0
+    if sw > 0 and sh > 0:
+        return sw, sh
+    if sw > 0 and w:
+        return sw, _even(h * sw / w)
+    if sh > 0 and h:
+        return _even(w * sh / h), sh
+    return 0, 0
+
+
+def scale_filter(cfg: Config, w: int, h: int) -> tuple[str, int, int] | None:
+    # w/h of 0 means the source size is unknown (no probe)
+    if cfg.scale:
+        nw, nh = _scale_size(cfg.scale, w, h)
+        if w and (nw, nh) == (w, h):
+            return None
+        return f"scale={cfg.scale}:flags=lanczos", nw, nh
+    if cfg.max_dim:
+        mw, mh = cfg.max_dim
+        expr = f"scale='if(gte(iw,ih),min({mw},iw),-2)':'if(gte(iw,ih),-2,min({mh},ih))':flags=lanczos"
+        if not w:
+            return expr, 0, 0
+        if w >= h:
+            return None if w <= mw else (expr, mw, _even(h * mw / w))
+        return None if h <= mh else (expr, _even(w * mh / h), mh)
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class FilterStep:
+    expr: str
+    width: int  # input size, 0 if unknown
+    height: int
+
+    @property
+    def cost(self) -> float:
+        mpx = (self.width * self.height or 1920 * 1080) / 1e6
+        return mpx * sum(
+            FILTER_COST.get(f.partition("=")[0], 0.5) for f in self.expr.split(",")
+        )
+
+
+def plan_filters(cfg: Config, reorder: bool = True) -> list[FilterStep]:
+    w, h = cfg.frame_size or (0, 0)
+    steps: list[FilterStep] = []
+
+    def add(expr: str) -> None:
+        steps.append(FilterStep(expr, w, h))
+
+    denoise = denoise_filter(cfg)
+    # Fields have to be rebuilt before anything touches pixels spatially
+    if cfg.deinterlace in DEINTERLACE_FILTERS:
+        add(DEINTERLACE_FILTERS[cfg.deinterlace])
+    if denoise and not reorder:
+        add(denoise)
+    # Block edges are only on the 8px grid at source size and offset
+    if cfg.deblock and cfg.deblock != "off":
+        add(f"deblock={cfg.deblock}")
+    if cfg.rotate in ROTATE_FILTERS:
+        add(ROTATE_FILTERS[cfg.rotate])
+        if cfg.rotate != 180:
+            w, h = h, w
+    # "auto" is resolved to a real rectangle by auto_crop() before encoding
+    if cfg.crop and cfg.crop not in ("off", "auto"):
+        add(f"crop={cfg.crop}")
+        w, h = _scale_size(cfg.crop, 0, 0)
+    scale = scale_filter(cfg, w, h)
+    # Denoise after a downscale (fewer pixels), before an upscale
+    shrinks = bool(scale) and (not w or not scale[1] or scale[1] * scale[2] <= w * h)
+    if denoise and reorder and not shrinks:
+        add(denoise)
+    if scale:
+        add(scale[0])
+        w, h = scale[1], scale[2]
+    if denoise and reorder and shrinks:
+        add(denoise)
+    if cfg.default_deband:
+        add("deband")
+    add(f"format={cfg.pix_fmt}")
+    return steps
+
+
+def with_frame_size(cfg: Config, probe: Probe | None) -> Config:
+    v = probe.video if probe else None
+    return replace(cfg, frame_size=(v.width, v.height)) if v and v.width else cfg
+
+
+def build_filters(cfg: Config, is_video: bool) -> list[str]:
+    if not is_video:
+        return []
+    return [s.expr for s in plan_filters(cfg)]
+
+
+def describe_filters(cfg: Config) -> str:
+    steps = plan_filters(cfg)
+    cost = sum(s.cost for s in steps)
+    fixed = sum(s.cost for s in plan_filters(cfg, reorder=False))
+    size = "x".join(map(str, cfg.frame_size)) if cfg.frame_size else "unknown size"
+    return (
+        f"{','.join(s.expr for s in steps)}\n"
+        f"    {size}: cost {cost:.1f}/frame (fixed order {fixed:.1f})"
+    )
+
+
+def build_params(
+    preset: Preset, cfg: Config, plan: StreamPlan | None = None
+) -> list[str]:
+    copy_video = plan is not None and plan.video == "copy"
+    copy_audio = plan is not None and plan.audio == "copy"
+    drop_audio = plan is not None and plan.audio == "drop"
+    filters = build_filters(cfg, preset.is_video and not copy_video)
+    params = ["-vf", ",".join(filters)] if filters else []
+    fmt = {
+        "crf": str(cfg.crf),
+        "preset": str(cfg.preset),
+        "preset_name": cfg.preset_name,
+        "grain": str(cfg.grain),
+        "audio_bitrate": cfg.audio_bitrate,
+        "keyint": str(cfg.keyint),
+        "pix_fmt": cfg.pix_fmt,
+        "audio_channels": str(cfg.audio_channels),
+        "fast_decode": ":fast-decode=1" if cfg.fast_decode else "",
+        "lp": f":lp={cfg.threads}" if cfg.threads else "",
+        "pools": f":pools={cfg.threads}" if cfg.threads else "",
+        "threads": str(cfg.threads),
+        "tile_columns": str(min(4, max(0, cfg.threads.bit_length() - 1))),
+    }
+    for k, v in itertools.chain(preset.params, preset.threads if cfg.threads else ()):
+        if (copy_video and k in VIDEO_OPTS) or (
+            (copy_audio or drop_audio) and k in AUDIO_OPTS
+        ):
+            if k == "-c:v" or (k == "-c:a" and copy_audio):
+                params.extend((k, "copy"))
+            continue
+        params.append(k)
+        if v is not None:
+            params.append(v.format(**fmt))
+    if drop_audio:
+        params.append("-an")
+    params.extend(cfg.extra)
+    return params
+
+
+def ffmpeg_base(quiet: bool, progress: bool = False) -> list[str]:
+    return [
+        "ffmpeg",
+        "-y",
+        "-hide_banner",
+        "-nostdin",
+        "-v",
+        "fatal",
+        "-loglevel",
+        "error",
+        "-stats" if not (quiet or progress) else "-nostats",
+    ] + (["-progress", "pipe:1"] if progress else [])
+
+
+def pin_cmd(cmd: list[str], cpus: frozenset[int] | None) -> list[str]:
+    # Pin before exec without preexec_fn, which is unsafe once threads run
+    if cpus and has("taskset"):
+        return ["taskset", "-c", ",".join(map(str, sorted(cpus))), *cmd]
+    return cmd
+
+
+def pin_started(pid: int, cpus: frozenset[int] | None, pinned: bool) -> None:
+    # No taskset: pin right after spawn; threads the encoder starts inherit it
+    if cpus and not pinned:
+        with suppress(OSError):
+            os.sched_setaffinity(pid, cpus)
+
+
+def run_cmd(
+    cmd: list[str],
+    quiet: bool,
+    cpus: frozenset[int] | None = None,
+    on_progress: ProgressHook | None = None,
+    echo: Callable[[str], None] | None = None,
+) -> RunResult:
+    argv = pin_cmd(cmd, cpus)
+    echo = echo or (None if quiet else sys.stderr.write)
+    quiet_out = subprocess.DEVNULL if quiet else None
+    piped = on_progress is not None or "pipe:1" in cmd
+    frames = 0
+    stopped = False
+    tail: deque[str] = deque(maxlen=STDERR_TAIL)
+    start = time.perf_counter()
+    with subprocess.Popen(
+        argv,
+        stdout=subprocess.PIPE if piped else quiet_out,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        shell=False,
+    ) as proc:
+        pin_started(proc.pid, cpus, argv is not cmd)
+        reader = threading.Thread(
+            target=_drain, args=(proc.stderr, tail, echo), daemon=True
+        )
+        reader.start()
+        if piped and proc.stdout:
+            fields: dict[str, str] = {}
+            for line in proc.stdout:
+                if _progress_block(fields, line):
+                    frames = _num(fields.get("frame")) or frames
+                    if on_progress and on_progress(fields) and not stopped:
+                        stopped = True
+                        proc.terminate()
+                    fields = {}
+        # Reap here rather than in Popen.wait() to get the child's rusage
+        _, status, ru = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        reader.join()
+    return RunResult(
+        ok=proc.returncode == 0 and not stopped,
+        returncode=proc.returncode,
+        wall=time.perf_counter() - start,
+        utime=ru.ru_utime,
+        stime=ru.ru_stime,
+        maxrss=ru.ru_maxrss * 1024,
+        frames=frames,
+        tool=Path(cmd[0]).name,
+        stderr="".join(tail),
+    )
+
+
+def _progress_block(fields: dict[str, str], line: str) -> bool:
+    # -progress emits key=value lines, each block closed by progress=...
+    k, _, v = line.strip().partition("=")
+    fields[k] = v
+    return k == "progress"
+
+
+def _drain(
+    stream: Any, tail: deque[str], echo: Callable[[str], None] | None
+) -> None:
+    for line in stream:
+        tail.append(line)
+        if echo:
+            echo(line)
+
+
+def classify_failure(res: RunResult) -> str:
+    for reason, pattern in FAILURE_PATTERNS:
+        if pattern.search(res.stderr):
+            return reason
+    # SIGKILL with nothing on stderr is almost always the OOM killer
+    if res.returncode == -9:
+        return "oom-killed"
+    return "transient"
+
+
+def retry_delay(
+    res: RunResult, attempt: int, retries: int, use_ffzap: bool
+) -> float | None:
+    # ffzap gets one plain ffmpeg run whatever went wrong; after that
+    # only transient failures are worth decoding the input again
+    if attempt >= retries or (res.reason != "transient" and not use_ffzap):
+        return None
+    return 2.0**attempt if res.reason == "transient" else 0.0
+
+
+# ─── Early abort ───
+ABORT_WARMUP: Final = (30.0, 0.10)  # judge after max(seconds, fraction of duration)
+
+
+@dataclass(slots=True)
+class SizeGuard:
+    # Projects the final size from bytes written so far and output position
+    limit: float
+    duration: float
+    warmup: float
+    projected: float = 0.0
+    at: float = 0.0
+
+    def __call__(self, fields: dict[str, str]) -> bool:
+        t = _progress_seconds(fields)
+        size = _num(fields.get("total_size"))
+        if t < self.warmup or size <= 0:
+            return False
+        self.projected, self.at = size * self.duration / t, t
+        return self.projected > self.limit
+
+
+def size_guard(
+    inp: Path, cfg: Config, probe: Probe | None, walk: WalkStats | None = None
+) -> SizeGuard | None:
+    if not (cfg.abort_larger or cfg.in_place) or not (probe and probe.duration):
+        return None
+    try:
+        in_sz = path_stat(inp, walk).st_size
+    except OSError:
+        return None
+    warmup = max(ABORT_WARMUP[0], probe.duration * ABORT_WARMUP[1])
+    if warmup >= probe.duration:
+        return None  # too short to be worth projecting
+    return SizeGuard(in_sz * (1 + cfg.abort_margin), probe.duration, warmup)
+
+
+def progress_hook(
+    report: ProgressFn | None, guard: SizeGuard | None
+) -> ProgressHook | None:
+    if not (report or guard):
+        return None
+
+    def hook(fields: dict[str, str]) -> bool:
+        if report:
+            report(fields, 0)
+        return bool(guard and guard(fields))
+
+    return hook
+
+
+def abort_reason(guard: SizeGuard | None, log: Log) -> str:
+    if not (guard and guard.projected > guard.limit):
+        return ""
+    log.warn(
+        f"  Projected {guard.projected / 1e6:.1f}MB > {guard.limit / 1e6:.1f}MB"
+        f" at {_hms(guard.at)}: stopped"
+    )
+    return "incompressible"
+
+
+def incompressible_kind(preset: Preset, cfg: Config) -> str:
+    return f"incompressible:{preset.name}:{quality_target(cfg) or cfg.crf}"
+
+
+def known_incompressible(
+    inp: Path, preset: Preset, cfg: Config, rt: Runtime | None
+) -> bool:
+    # Keyed on size/mtime/inode like every analysis, so an edited file retries
+    if not (rt and rt.probes and (cfg.abort_larger or cfg.in_place)):
+        return False
+    try:
+        st, path = path_stat(inp, rt.walk), real_path(inp, rt.walk)
+    except OSError:
+        return False
+    return rt.probes.get_analysis(path, st, incompressible_kind(preset, cfg)) is not None
+
+
+def ffmpeg_cmd(
+    inp: Path,
+    out: Path,
+    params: list[str],
+    quiet: bool,
+    use_ffzap: bool,
+    input_opts: Iterable[str] = (),
+) -> list[str]:
+    if use_ffzap and has("ffzap"):
+        return ["ffzap", "-i", str(inp), "-o", str(out)] + params
+    return ffmpeg_base(quiet, True) + [*input_opts, "-i", str(inp)] + params + [str(out)]
+
+
+def run_ffmpeg(
+    inp: Path,
+    out: Path,
+    params: list[str],
+    quiet: bool,
+    use_ffzap: bool,
+    cpus: frozenset[int] | None = None,
+    input_opts: Iterable[str] = (),
+    on_progress: ProgressHook | None = None,
+    echo: Callable[[str], None] | None = None,
+) -> RunResult:
+    cmd = ffmpeg_cmd(inp, out, params, quiet, use_ffzap, input_opts)
+    if cmd[0] == "ffzap":
+        on_progress = None
+    return run_cmd(cmd, quiet, cpus, on_progress, echo)
+
+
+def keyframe_times(inp: Path) -> list[float]:
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        str(inp),
+    ]
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, shell=False)
+    except OSError:
+        return []
+    first = None
+    times = []
+    for line in res.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if not pts or pts == "N/A":
+            continue
+        t = _num(pts, float)
+        first = t if first is None else min(first, t)
+        if "K" in flags:
+            times.append(t)
+    # Relative to the first packet: -ss counts from the file's start_time
+    return sorted(t - first for t in times if t > first) if first is not None else []
+
+
+def snap_to_keyframes(points: Iterable[float], keyframes: list[float]) -> list[float]:
+    # Cut only where a chunk can start on a keyframe: the first at or after each point
+    snapped = set()
+    for t in points:
+        i = bisect.bisect_left(keyframes, t)
+        if i < len(keyframes):
+            snapped.add(keyframes[i])
+    return sorted(snapped)
+
+
+def scene_times(inp: Path, threshold: float = 0.3) -> list[float]:
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-i",
+        str(inp),
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-vf",
+        f"scale=320:-2,select='gt(scene,{threshold})',showinfo",
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, shell=False)
+    except OSError:
+        return []
+    return [float(t) for t in re.findall(r"pts_time:([\d.]+)", res.stderr)]
+
+
+def split_chunks(
+    points: Iterable[float], duration: float, min_len: float
+) -> list[tuple[float, float]]:
+    chunks: list[tuple[float, float]] = []
+    start = 0.0
+    for t in sorted(points):
+        # Leave at least half a chunk for the tail so it is not a sliver
+        if t - start >= min_len and duration - t >= min_len / 2:
+            chunks.append((start, t))
+            start = t
+    chunks.append((start, duration))
+    return chunks
+
+
+def plan_chunks(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    probe: Probe | None,
+    plan: StreamPlan | None,
+) -> list[tuple[float, float]]:
+    if (
+        not cfg.chunked
+        or not preset.is_video
+        or probe is None
+        or probe.video is None
+        or probe.duration < 2 * cfg.chunk_len
+        or (plan and plan.video == "copy")
+    ):
+        return []
+    points = keyframe_times(inp)
+    if cfg.chunk_split == "scenes":
+        points = snap_to_keyframes(scene_times(inp), points)
+    chunks = split_chunks(points, probe.duration, cfg.chunk_len)
+    return chunks if len(chunks) > 1 else []
+
+
+def default_streams(probe: Probe | None) -> tuple[str, str]:
+    # The streams ffmpeg picks on its own for a single input: the first real
+    # video (not cover art) and the audio with the most channels, first wins
+    v = probe.video if probe else None
+    a = max(probe.audio, key=lambda s: s.channels, default=None) if probe else None
+    return (str(v.index) if v else "v:0"), (str(a.index) if a else "a:0?")
+
+
+def encode_chunks(
+    inp: Path,
+    out: Path,
+    preset: Preset,
+    cfg: Config,
+    chunks: list[tuple[float, float]],
+    plan: StreamPlan | None,
+    log: Log,
+    cpus: frozenset[int] | None = None,
+    report: ProgressFn | None = None,
+    probe: Probe | None = None,
+) -> RunResult:
+    # Two inputs defeat ffmpeg's own stream choice, so map what it would
+    # have picked from the source alone; chunks carry that video stream
+    video, audio = default_streams(probe)
+    vparams = build_params(preset, cfg, StreamPlan(video="encode", audio="drop"))
+    # Chunks start on keyframes; end half a frame early so float rounding
+    # can neither repeat the next chunk's first frame nor drop our last
+    fps = probe.video.fps if probe and probe.video else 0.0
+    trim = 0.5 / fps if fps > 0 else 0.0
+    tmp = Path(tempfile.mkdtemp(prefix=f".{out.stem}.chunks-", dir=out.parent))
+    started = time.perf_counter()
+    try:
+        parts = [tmp / f"{i:05d}.mkv" for i in range(len(chunks))]
+
+        def encode(i: int) -> list[RunResult]:
+            start, end = chunks[i]
+            last = i == len(chunks) - 1
+            opts = ["-map", f"0:{video}"]
+            if not last:
+                opts += ["-t", f"{end - start - trim:.6f}"]
+            opts.extend(vparams)
+            on_progress = (lambda f: report(f, i)) if report else None
+            results: list[RunResult] = []
+            while len(results) < 2 and not any(results):
+                results.append(
+                    run_ffmpeg(
+                        inp,
+                        parts[i],
+                        opts,
+                        True,
+                        False,
+                        cpus,
+                        ["-ss", f"{start:.6f}"],
+                        on_progress,
+                    )
+                )
+            return results
+
+        with ThreadPoolExecutor(max_workers=max(1, cfg.chunk_jobs)) as executor:
+            attempts = list(executor.map(encode, range(len(chunks))))
+        results = [r for rs in attempts for r in rs]
+        if not all(rs[-1] for rs in attempts):
+            res = RunResult.combine(results, time.perf_counter() - started)
+            res.ok = False
+            return res
+        listing = tmp / "chunks.txt"
+        listing.write_text(
+            "".join("file '{}'\n".format(str(p).replace("'", "'\\''")) for p in parts)
+        )
+        mux = build_params(
+            preset,
+            cfg,
+            StreamPlan(video="copy", audio=plan.audio if plan and plan.audio else "encode"),
+        )
+        # Metadata comes from the source, which is input 1 here
+        mux = [
+            "1" if prev == "-map_metadata" else v for prev, v in zip([""] + mux, mux)
+        ]
+        cmd = (
+            ffmpeg_base(log.quiet)
+            + ["-f", "concat", "-safe", "0", "-i", str(listing), "-i", str(inp)]
+            + ["-map", "0:v:0", "-map", f"1:{audio}", "-map_chapters", "1"]
+            + mux
+            + [str(out)]
+        )
+        results.append(run_cmd(cmd, log.quiet, cpus, echo=log.echo))
+        res = RunResult.combine(results, time.perf_counter() - started)
+        res.ok = bool(results[-1])
+        return res
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def convert(
+    inp: Path,
+    out: Path,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    retries: int = 3,
+    plan: StreamPlan | None = None,
+    rt: Runtime | None = None,
+    probe: Probe | None = None,
+    report: ProgressFn | None = None,
+) -> RunResult:
+    params = build_params(preset, cfg, plan)
+    chunks = plan_chunks(inp, preset, cfg, probe, plan)
+    if chunks:
+        log.info(
+            f"  {len(chunks)} chunks ({cfg.chunk_split}) on {cfg.chunk_jobs} workers"
+        )
+        # Each chunk already gets a second try; don't multiply that by 3
+        retries = 1
+    for attempt in range(1, retries + 1):
+        # Chunks only know their own share of the output
+        guard = None if chunks else size_guard(inp, cfg, probe, rt.walk if rt else None)
+        # ffzap reports no progress, so it cannot be stopped early
+        use_ffzap = attempt == 1 and has("ffzap") and not chunks and not guard
+        tool = "ffzap" if use_ffzap else "ffmpeg"
+        log.info(f"  [{attempt}/{retries}] {tool}...")
+        start = time.perf_counter()
+        mem = admit_mem(preset, cfg, probe, log, rt)
+        with (
+            rt.gate.slot(mem) if rt and rt.gate else nullcontext(),
+            rt.cpus.slot() if rt and rt.cpus else nullcontext() as cpus,
+        ):
+            if chunks:
+                res = encode_chunks(
+                    inp,
+                    out,
+                    preset,
+                    cfg,
+                    chunks,
+                    plan,
+                    log,
+                    cpus,
+                    report,
+                    probe,
+                )
+            else:
+                res = run_ffmpeg(
+                    inp,
+                    out,
+                    params,
+                    log.quiet,
+                    use_ffzap,
+                    cpus,
+                    on_progress=progress_hook(report, guard),
+                    echo=log.echo,
+                )
+        res.attempt, res.tool = attempt, tool
+        if rt and rt.mem:
+            rt.mem.observe(preset, cfg, probe, res)
+        if res:
+            log.ok(f"  {time.perf_counter() - start:.1f}s")
+            return res
+        res.reason = abort_reason(guard, log) or classify_failure(res)
+        log.warn(f"  Attempt {attempt} failed: {res.reason}")
+        if (delay := retry_delay(res, attempt, retries, use_ffzap)) is None:
+            break
+        time.sleep(delay)
+    return res
+
+
+# ─── Auto-crop ───
+def crop_sample(
+    inp: Path, start: float, rotate: int = 0
+) -> tuple[int, int, int, int] | None:
+    vf = [ROTATE_FILTERS[rotate]] if rotate in ROTATE_FILTERS else []
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-ss",
+        f"{start:.3f}",
+        "-i",
+        str(inp),
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-frames:v",
+        "8",
+        "-vf",
+        ",".join([*vf, "cropdetect=24:2:0"]),
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, shell=False)
+    except OSError:
+        return None
+    # Negative sizes (all-black frames) never match
+    found = re.findall(r"crop=(\d+):(\d+):(\d+):(\d+)", res.stderr)
+    if not found:
+        return None
+    w, h, x, y = map(int, found[-1])
+    return (w, h, x, y) if w and h else None
+
+
+def stable_crop(
+    rects: Iterable[tuple[int, int, int, int]], width: int, height: int
+) -> str:
+    rects = list(rects)
+    if not rects:
+        return ""
+    # Union of all samples: a dark scene can only widen the rectangle,
+    # never cut into picture that another sample showed
+    x0 = min(r[2] for r in rects)
+    y0 = min(r[3] for r in rects)
+    w = max(r[2] + r[0] for r in rects) - x0
+    h = max(r[3] + r[1] for r in rects) - y0
+    w, h = w - w % 2, h - h % 2
+    if width and height and w >= width - 8 and h >= height - 8:
+        return ""
+    return f"{w}:{h}:{x0}:{y0}"
+
+
+def detect_crop(inp: Path, probe: Probe, rotate: int = 0) -> str | None:
+    v = probe.video
+    width, height = (v.width, v.height) if v else (0, 0)
+    if rotate in (90, 270):
+        width, height = height, width
+    points = sample_points(probe.duration, CROP_SAMPLES, 0.0)
+    with ThreadPoolExecutor(len(points)) as ex:
+        rects = [r for r in ex.map(lambda t: crop_sample(inp, t, rotate), points) if r]
+    # No sample produced a reading: unknown, not "no bars"
+    return stable_crop(rects, width, height) if rects else None
+
+
+def auto_crop(
+    inp: Path, cfg: Config, log: Log, probe: Probe | None, rt: Runtime | None = None
+) -> str | None:
+    if cfg.crop != "auto" or not probe or not probe.video:
+        return None
+    def detect() -> dict[str, str] | None:
+        crop = detect_crop(inp, probe, cfg.rotate)
+        return None if crop is None else {"crop": crop}
+
+    # A failed detection returns None, which cached_analysis does not store
+    found = cached_analysis(
+        rt.probes if rt else None,
+        inp,
+        f"crop:{cfg.rotate}",
+        lambda: gated(rt, probe_mem(cfg, probe, CROP_SAMPLES), detect),
+        rt.walk if rt else None,
+    )
+    if found is None:
+        log.warn("  Auto-crop: detection failed, not cropping")
+        return "off"
+    log.info(f"  Auto-crop: {found['crop'] or 'none'}")
+    return found["crop"] or "off"
+
+
+# ─── Adaptive denoise/deband ───
+def noise_sample(
+    inp: Path, start: float, crop: str = "", rotate: int = 0
+) -> float | None:
+    # Measure the picture the encoder will see: crop rectangles are in
+    # rotated coordinates, so rotate first when cropping
+    pre = [ROTATE_FILTERS[rotate]] if crop and rotate in ROTATE_FILTERS else []
+    if crop:
+        pre.append(f"crop={crop}")
+    graph = (
+        f"[0:v]{','.join([*pre, 'format=yuv420p'])},split[a][b];"
+        "[b]hqdn3d=4:4:0:0[d];[a][d]psnr"
+    )
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-ss",
+        f"{start:.3f}",
+        "-i",
+        str(inp),
+        "-frames:v",
+        "12",
+        "-lavfi",
+        graph,
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, shell=False)
+    except OSError:
+        return None
+    m = re.search(r"PSNR y:([\d.]+|inf)", res.stderr)
+    return float(m.group(1)) if m else None
+
+
+def measure_noise(
+    inp: Path, probe: Probe, crop: str = "", rotate: int = 0
+) -> dict[str, float] | None:
+    points = sample_points(probe.duration, NOISE_SAMPLES, 1.0)
+    with ThreadPoolExecutor(len(points)) as ex:
+        vals = [
+            v for v in ex.map(lambda t: noise_sample(inp, t, crop, rotate), points) if v
+        ]
+    if not vals:
+        return None
+    # Flat frames come back as inf; cap so the mean stays meaningful
+    return {"psnr_y": sum(min(v, 60.0) for v in vals) / len(vals)}
+
+
+def banding_prone(probe: Probe, psnr_y: float) -> bool:
+    v = probe.video
+    if not v or "10" in v.pix_fmt or "12" in v.pix_fmt:
+        return False
+    rate = v.bit_rate or probe.bit_rate
+    if not (rate and v.width and v.height and v.fps):
+        return True
+    # Grain dithers gradients, so only clean starved sources band
+    return psnr_y >= 42.0 and rate / (v.width * v.height * v.fps) < BANDING_BPP
+
+
+def adapt_filters(
+    inp: Path, cfg: Config, log: Log, probe: Probe | None, rt: Runtime | None = None
+) -> Config:
+    # Only refine the defaults; explicit --denoise/--no-denoise/--no-deband win
+    auto_denoise = cfg.default_denoise and not cfg.denoise
+    if not cfg.auto_filters or not (auto_denoise or cfg.default_deband):
+        return cfg
+    if not probe or not probe.video:
+        return cfg
+    crop = cfg.crop if cfg.crop not in (None, "off", "auto") else ""
+    noise = cached_analysis(
+        rt.probes if rt else None,
+        inp,
+        f"noise:{crop}:{cfg.rotate}" if crop else "noise",
+        lambda: gated(
+            rt,
+            probe_mem(cfg, probe, NOISE_SAMPLES),
+            lambda: measure_noise(inp, probe, crop, cfg.rotate),
+        ),
+        rt.walk if rt else None,
+    )
+    if not noise:
+        return cfg
+    psnr_y = noise["psnr_y"]
+    changes: dict[str, Any] = {}
+    if auto_denoise:
+        denoise, strength = next(
+            (d, s) for floor, d, s in NOISE_LEVELS if psnr_y >= floor
+        )
+        if denoise:
+            changes.update(
+                default_denoise=False, denoise=denoise, denoise_strength=strength
+            )
+    if cfg.default_deband:
+        changes["default_deband"] = banding_prone(probe, psnr_y)
+    cfg = replace(cfg, **changes)
+    denoise = denoise_filter(cfg) or "none"
+    deband = "deband" if cfg.default_deband else "no deband"
+    log.info(f"  Noise {psnr_y:.1f}dB: {denoise}, {deband}")
+    return cfg
+
+
+# ─── Target quality ───
+def quality_target(cfg: Config) -> tuple[str, float] | None:
+    if cfg.target_ssim is not None:
+        return "ssim", cfg.target_ssim
+    if cfg.target_psnr is not None:
+        return "psnr", cfg.target_psnr
+    return None
+
+
+def sample_points(duration: float, count: int, length: float) -> list[float]:
+    if duration <= length * count:
+        return [0.0]
+    # Evenly spaced, centred in each slice so intros/credits weigh less
+    return [duration * (i + 0.5) / count - length / 2 for i in range(count)]
+
+
+def sample_score(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    start: float,
+    work: Path,
+    metric: str,
+    video: str = "v:0",
+) -> float | None:
+    out = work / f"crf{cfg.crf}-{start:.0f}.{preset.ext}"
+    seg = ["-ss", f"{start:.3f}", "-t", f"{cfg.sample_len:g}"]
+    plan = StreamPlan(video="encode", audio="drop")
+    # The one stream that gets scored; build_params leaves mapping to us
+    params = ["-map", f"0:{video}", *build_params(preset, cfg, plan)]
+    if not run_ffmpeg(inp, out, params, True, False, input_opts=seg):
+        return None
+    ref_vf = ",".join(build_filters(cfg, True))
+    ssim, psnr = quality_scores(inp, out, seg, ref_vf)
+    out.unlink(missing_ok=True)
+    return ssim if metric == "ssim" else psnr
+
+
+def search_crf(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    probe: Probe,
+    metric: str,
+    target: float,
+) -> dict[str, Any] | None:
+    points = sample_points(probe.duration, max(1, cfg.samples), cfg.sample_len)
+    scores: dict[int, float] = {}
+    lo, hi = cfg.crf_range
+    best = lo
+    video, _ = default_streams(probe)
+    with tempfile.TemporaryDirectory(prefix="vidconv-target-") as tmp:
+        work = Path(tmp)
+        with ThreadPoolExecutor(len(points)) as ex:
+            # Higher CRF is always cheaper, so look for the highest that passes
+            while lo <= hi:
+                crf = (lo + hi) // 2
+                c = replace(cfg, crf=crf)
+                vals = list(
+                    ex.map(
+                        lambda t, c=c: sample_score(
+                            inp, preset, c, t, work, metric, video
+                        ),
+                        points,
+                    )
+                )
+                if None in vals:
+                    return None
+                scores[crf] = sum(vals) / len(vals)
+                if scores[crf] >= target:
+                    best, lo = crf, crf + 1
+                else:
+                    hi = crf - 1
+    return {"crf": best, "scores": scores}
+
+
+def target_crf(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    probe: Probe | None,
+    rt: Runtime | None = None,
+) -> int | None:
+    goal = quality_target(cfg)
+    if not goal or not preset.is_video or not probe or probe.duration <= 0:
+        return None
+    metric, target = goal
+    # Anything that changes the encode except the CRF itself invalidates the result
+    params = build_params(preset, replace(cfg, crf=0))
+    key = json.dumps(
+        [preset.name, metric, target, cfg.crf_range, cfg.samples, cfg.sample_len, params]
+    )
+    kind = "crf:" + hashlib.sha1(key.encode()).hexdigest()[:16]
+    # One unchunked sample encode per point, all at once
+    single = replace(cfg, chunked=False)
+    mem = (rt.mem.estimate if rt and rt.mem else estimate_mem)(preset, single, probe)
+    mem *= len(sample_points(probe.duration, max(1, cfg.samples), cfg.sample_len))
+    found = cached_analysis(
+        rt.probes if rt else None,
+        inp,
+        kind,
+        lambda: gated(
+            rt, mem, lambda: search_crf(inp, preset, cfg, probe, metric, target)
+        ),
+        rt.walk if rt else None,
+    )
+    if not found:
+        log.warn(f"  Target search failed, using CRF {cfg.crf}")
+        return None
+    log.info(f"  Target {metric} {target:g}: CRF {found['crf']}")
+    return int(found["crf"])
+
+
+def gen_out_path(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    out_dir: Path | None,
+    src_root: Path | None,
+    create: bool = True,
+) -> Path:
+    fmt = {
+        "crf": str(cfg.crf),
+        "preset": str(cfg.preset),
+        "grain": str(cfg.grain),
+        "audio_bitrate": cfg.audio_bitrate,
+    }
+    pattern = preset.suffix
+    if goal := quality_target(cfg):
+        # Name by target, not by whichever CRF the search lands on per file
+        pattern = pattern.replace("crf{crf}", f"{goal[0]}{goal[1]:g}")
+    suffix = "".join(
+        c for c in pattern.format(**fmt) if c.isalnum() or c in "._-+"
+    )
+    new_name = f"{inp.stem}{suffix}.{preset.ext}"
+    if out_dir:
+        if src_root:
+            rel = inp.parent.relative_to(src_root)
+            target = out_dir / rel
+        else:
+            target = out_dir
+        if create:
+            _ensure_dir(target)
+        return target / new_name
+    return inp.with_name(new_name)
+
+
+@lru_cache(maxsize=4096)
+def _ensure_dir(path: Path) -> None:
+    # Sibling files share a directory; one mkdir per directory, not per file
+    path.mkdir(parents=True, exist_ok=True)
+
+
+def part_path(out: Path) -> Path:
+    # Keep the real extension last so ffmpeg still picks the right muxer
+    return out.with_name(f".{out.stem}.part{out.suffix}")
+
+
+def remove_partial(out: Path) -> None:
+    part_path(out).unlink(missing_ok=True)
+    for d in out.parent.glob(f".{glob_escape(out.stem)}.chunks-*"):
+        shutil.rmtree(d, ignore_errors=True)
+
+
+def start_output(
+    inp: Path,
+    out: Path,
+    cfg: Config,
+    log: Log,
+    probe: Probe | None = None,
+    plan: StreamPlan | None = None,
+    rt: Runtime | None = None,
+) -> int:
+    walk = rt.walk if rt else None
+    in_sz = probe.size if probe and probe.size else path_stat(inp, walk).st_size
+    log.info(f"  {inp.name} → {out.name}")
+    if probe:
+        log.info(f"  {probe.describe()}")
+    if plan:
+        log.info(f"  {plan.describe()}")
+    if cfg.dry_run:
+        log.info("  [dry-run]")
+        return in_sz
+    # Not _ensure_dir: its cache still says yes if the directory went away
+    # since planning, and one mkdir is nothing next to an encode
+    out.parent.mkdir(parents=True, exist_ok=True)
+    if rt and rt.journal:
+        rt.journal.record("start", inp, out)
+    return in_sz
+
+
+def finish_output(
+    inp: Path,
+    out: Path,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    res: RunResult,
+    in_sz: int,
+    probe: Probe | None = None,
+    rt: Runtime | None = None,
+    tmp: Path | None = None,
+    key: str | None = None,
+) -> tuple[RunResult, int, int]:
+    tmp = tmp or part_path(out)
+    journal = rt.journal if rt else None
+    metrics = rt.metrics if rt else None
+    encodes = rt.encodes if rt and key else None
+    duration = probe.duration if probe else 0.0
+    if not res:
+        tmp.unlink(missing_ok=True)
+        if encodes:
+            encodes.settle(key, None)
+        if journal:
+            journal.record("failed", inp, out, reason=res.reason)
+        if res.reason == "incompressible" and rt and rt.probes:
+            with suppress(OSError):
+                rt.probes.put_analysis(
+                    real_path(inp, rt.walk),
+                    path_stat(inp, rt.walk),
+                    incompressible_kind(preset, cfg),
+                    {"input_bytes": in_sz},
+                )
+        if metrics:
+            metrics.write(metric_record(inp, out, preset, cfg, res, duration, in_sz, 0))
+        return res, in_sz, 0
+    out_sz = tmp.stat().st_size
+    if metrics:
+        metrics.write(metric_record(inp, out, preset, cfg, res, duration, in_sz, out_sz))
+    ratio = out_sz / in_sz if in_sz else 0
+    log.info(f"  {in_sz / 1e6:.2f}MB → {out_sz / 1e6:.2f}MB ({ratio:.1%})")
+    remove = cfg.in_place and out_sz < in_sz
+    if cfg.in_place and not remove:
+        log.warn(f"  Output larger ({out_sz / 1e6:.2f}MB), kept original")
+
+    def publish() -> None:
+        if encodes:
+            encodes.settle(key, out)
+        if journal:
+            journal.record("done", inp, out)
+        if remove:
+            inp.unlink()
+            log.ok("  Removed original")
+
+    if rt and rt.stager and tmp.parent == rt.stager.dir:
+        stager = rt.stager
+
+        def undo() -> None:
+            if encodes:
+                encodes.settle(key, None)
+            stager.lost.append((inp, in_sz, out_sz))
+
+        stager.deliver(tmp, out, publish, undo)
+    else:
+        os.replace(tmp, out)
+        publish()
+    return res, in_sz, out_sz
+
+
+def encode_key(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    plan: StreamPlan | None,
+    rt: Runtime | None,
+) -> str | None:
+    if not (rt and rt.encodes):
+        return None
+    try:
+        digest = cached_analysis(
+            rt.probes,
+            inp,
+            "content-full" if cfg.full_hash else "content",
+            lambda: content_hash(inp, cfg.full_hash),
+            rt.walk,
+        )
+    except OSError:
+        return None
+    # Same bytes in, same ffmpeg arguments: same output
+    args = "\0".join((preset.name, preset.ext, *build_params(preset, cfg, plan)))
+    return f"{digest}:{hashlib.sha1(args.encode()).hexdigest()}"
+
+
+def claim_output(cache: EncodeCache, key: str, log: Log) -> Path | None:
+    # Earlier output to reuse, or None once this caller owns the encode
+    while isinstance(hit := cache.claim(key), Future):
+        log.info("  Waiting for a duplicate already encoding")
+        hit.result()
+    return hit
+
+
+async def claim_output_async(cache: EncodeCache, key: str, log: Log) -> Path | None:
+    while isinstance(hit := await asyncio.to_thread(cache.claim, key), Future):
+        log.info("  Waiting for a duplicate already encoding")
+        await asyncio.wrap_future(hit)
+    return hit
+
+
+def reuse_output(
+    inp: Path,
+    out: Path,
+    cached: Path,
+    cfg: Config,
+    log: Log,
+    in_sz: int,
+    rt: Runtime,
+) -> tuple[RunResult, int, int] | None:
+    try:
+        same = cached == out or (out.exists() and out.samefile(cached))
+        how = "existing" if same else link_output(cached, out)
+        out_sz = out.stat().st_size
+    except OSError as e:
+        log.warn(f"  Reusing {cached} failed ({e.strerror}), encoding")
+        return None
+    log.ok(f"  Reused {cached.name} ({how}): {out_sz / 1e6:.2f}MB")
+    if rt.journal:
+        rt.journal.record("done", inp, out)
+    if cfg.in_place and out_sz < in_sz:
+        inp.unlink()
+        log.ok("  Removed original")
+    return RunResult(True, reason=f"reused: {how}"), in_sz, out_sz
+
+
+def process(
+    inp: Path,
+    out: Path,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    probe: Probe | None = None,
+    plan: StreamPlan | None = None,
+    rt: Runtime | None = None,
+) -> tuple[RunResult, int, int]:
+    in_sz = start_output(inp, out, cfg, log, probe, plan, rt)
+    if cfg.dry_run:
+        return RunResult(True), in_sz, 0
+    key = encode_key(inp, preset, cfg, plan, rt)
+    if key and (cached := claim_output(rt.encodes, key, log)):
+        if hit := reuse_output(inp, out, cached, cfg, log, in_sz, rt):
+            return hit
+    live = rt.progress if rt else None
+    duration = probe.duration if probe else 0.0
+    stager = rt.stager if rt else None
+    try:
+        src = stager.acquire(inp) if stager else inp
+        tmp = stager.output(out) if stager else part_path(out)
+        with live.task(inp.name, duration) if live else nullcontext() as report:
+            res = convert(
+                src,
+                tmp,
+                preset,
+                cfg,
+                log,
+                plan=plan,
+                rt=rt,
+                probe=probe,
+                report=report,
+            )
+        return finish_output(
+            inp, out, preset, cfg, log, res, in_sz, probe, rt, tmp, key
+        )
+    except BaseException:
+        # Let duplicates waiting on this key encode for themselves (no-op
+        # once finish_output has settled it)
+        if key:
+            rt.encodes.settle(key, None)
+        raise
+
+
+@dataclass(slots=True)
+class Job:
+    inp: Path
+    out: Path
+    cfg: Config
+    probe: Probe | None = None
+    plan: StreamPlan | None = None
+    stats: Stats = field(default_factory=Stats)
+    skip: str = ""  # message when there is nothing to encode
+
+
+def prepare_item(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    out_dir: Path | None,
+    src_root: Path | None,
+    log: Log,
+    probe: Probe | None = None,
+    rt: Runtime | None = None,
+    create: bool = True,
+) -> Job:
+    planned = rt.outputs.get(inp) if rt and rt.outputs else None
+    out = planned or gen_out_path(inp, preset, cfg, out_dir, src_root, create)
+    job = Job(inp, out, cfg, probe)
+    stats = job.stats
+    if rt and rt.journal and rt.journal.is_done(inp, out):
+        job.skip = f"Skipped (journal): {out.name}"
+    # The plan already checked existence (and collisions) against its index
+    elif not planned and cfg.skip_existing and out.exists():
+        job.skip = f"Skipped (exists): {out.name}"
+    elif inp == out:
+        job.skip = f"Skipped (same): {inp.name}"
+    elif known_incompressible(inp, preset, cfg, rt):
+        job.skip = f"Skipped (incompressible): {inp.name}"
+        stats.decisions["skip: incompressible"] += 1
+    if job.skip:
+        stats.skipped += 1
+        return job
+    cfg = with_frame_size(cfg, probe)
+    plan = job.plan = plan_streams(inp, preset, cfg, probe)
+    if plan and plan.skip:
+        stats.skipped += 1
+        stats.decisions["skip: meets target"] += 1
+        job.skip = f"Skipped (meets target): {inp.name}"
+        return job
+    if plan:
+        stats.decisions.update(
+            f"{k}: {v}" for k, v in (("video", plan.video), ("audio", plan.audio)) if v
+        )
+    if preset.is_video and (not plan or plan.video == "encode") and not cfg.dry_run:
+        cfg = resolve_filters(inp, cfg, log, probe, rt, stats)
+        if (crf := target_crf(inp, preset, cfg, log, probe, rt)) is not None:
+            cfg = replace(cfg, crf=crf)
+            stats.decisions[f"target: crf {crf}"] += 1
+    job.cfg = cfg
+    return job
+
+
+def resolve_filters(
+    inp: Path,
+    cfg: Config,
+    log: Log,
+    probe: Probe | None,
+    rt: Runtime | None,
+    stats: Stats,
+) -> Config:
+    # Crop first: black bars would read as a clean source
+    if (crop := auto_crop(inp, cfg, log, probe, rt)) is not None:
+        cfg = replace(cfg, crop=crop)
+        stats.decisions["crop: " + ("none" if crop == "off" else "bars")] += 1
+    if cfg.auto_filters:
+        cfg = adapt_filters(inp, cfg, log, probe, rt)
+        stats.decisions[
+            f"denoise: {(denoise_filter(cfg) or 'none').partition('=')[0]}"
+        ] += 1
+    return cfg
+
+
+def finish_item(job: Job, res: RunResult, in_sz: int, out_sz: int) -> tuple[Stats, str]:
+    stats, inp, out = job.stats, job.inp, job.out
+    if res:
+        stats.processed += 1
+        stats.input_bytes += in_sz
+        stats.output_bytes += out_sz
+        ratio = out_sz / in_sz if in_sz else 0
+        if res.reason:
+            stats.decisions[res.reason] += 1
+        return (
+            stats,
+            f"{inp.name} → {out.name}: {in_sz / 1e6:.2f}MB → {out_sz / 1e6:.2f}MB ({ratio:.1%})"
+            + (f", {res.reason}" if res.reason else ""),
+        )
+    if res.reason == "incompressible":
+        stats.skipped += 1
+        stats.decisions["skip: incompressible"] += 1
+        return stats, f"Kept original (incompressible): {inp.name}"
+    stats.failed += 1
+    stats.failures.append(f"{inp}: {res.reason or 'failed'}")
+    stats.decisions[f"failed: {res.reason or 'unknown'}"] += 1
+    return stats, f"Failed ({res.reason or 'unknown'}): {inp.name}"
+
+
+def process_item(
+    inp: Path,
+    preset: Preset,
+    cfg: Config,
+    out_dir: Path | None,
+    src_root: Path | None,
+    log: Log,
+    probe: Probe | None = None,
+    rt: Runtime | None = None,
+) -> tuple[Stats, str]:
+    job = prepare_item(inp, preset, cfg, out_dir, src_root, log, probe, rt)
+    if job.skip:
+        return job.stats, job.skip
+    res, in_sz, out_sz = process(
+        inp, job.out, preset, job.cfg, log, probe, job.plan, rt
+    )
+    return finish_item(job, res, in_sz, out_sz)
+
+
+# ─── Audio batching ───
+def batch_size(preset: Preset, cfg: Config) -> int:
+    return 1 if preset.is_video else max(1, cfg.batch)
+
+
+def _batched(items: Iterator[Any], size: int) -> Iterator[list[Any]]:
+    while unit := list(itertools.islice(items, size)):
+        yield unit
+
+
+def batch_cmd(jobs: list[Job], preset: Preset, quiet: bool) -> list[str]:
+    cmd = ffmpeg_base(quiet, True)
+    for job in jobs:
+        cmd += ["-i", str(job.inp)]
+    # Outputs default to the first input's tags, so map them explicitly
+    for i, job in enumerate(jobs):
+        cmd += ["-map", f"{i}:a:0", "-map_metadata", str(i), "-map_chapters", str(i)]
+        cmd += build_params(preset, job.cfg, job.plan) + [str(part_path(job.out))]
+    return cmd
+
+
+def _batch_outputs(
+    jobs: list[Job],
+    sizes: list[int],
+    res: RunResult,
+    preset: Preset,
+    log: Log,
+    rt: Runtime | None,
+) -> dict[int, tuple[RunResult, int, int]]:
+    if not res:
+        # One bad file sinks the whole run; redo them singly to find it
+        log.warn(f"  Batch of {len(jobs)} failed ({classify_failure(res)}), retrying singly")
+        for job in jobs:
+            part_path(job.out).unlink(missing_ok=True)
+        return {}
+    n = len(jobs)
+    share = replace(
+        res,
+        wall=res.wall / n,
+        utime=res.utime / n,
+        stime=res.stime / n,
+        frames=0,
+        tool="ffmpeg-batch",
+    )
+    return {
+        id(job): finish_output(
+            job.inp, job.out, preset, job.cfg, log, share, in_sz, job.probe, rt
+        )
+        for job, in_sz in zip(jobs, sizes)
+    }
+
+
+def _batch_duration(jobs: list[Job]) -> float:
+    return sum(j.probe.duration for j in jobs if j.probe)
+
+
+def process_batch(
+    unit: list[tuple[Path, Probe | None]],
+    preset: Preset,
+    cfg: Config,
+    out_dir: Path | None,
+    src_root: Path | None,
+    log: Log,
+    rt: Runtime | None = None,
+) -> list[tuple[Stats, str]]:
+    jobs = [
+        prepare_item(inp, preset, cfg, out_dir, src_root, log, pr, rt)
+        for inp, pr in unit
+    ]
+    todo = [j for j in jobs if not j.skip]
+    done: dict[int, tuple[RunResult, int, int]] = {}
+    if len(todo) > 1 and not cfg.dry_run:
+        sizes = [
+            start_output(j.inp, j.out, j.cfg, log, j.probe, j.plan, rt) for j in todo
+        ]
+        live = rt.progress if rt else None
+        mem = admit_mem(preset, cfg, None, log, rt)
+        with rt.gate.slot(mem) if rt and rt.gate else nullcontext():
+            with (
+                live.task(f"{len(todo)} files", _batch_duration(todo))
+                if live
+                else nullcontext()
+            ) as report, rt.cpus.slot() if rt and rt.cpus else nullcontext() as cpus:
+                res = run_cmd(
+                    batch_cmd(todo, preset, log.quiet),
+                    log.quiet,
+                    cpus,
+                    (lambda f: report(f, 0)) if report else None,
+                    log.echo,
+                )
+        done = _batch_outputs(todo, sizes, res, preset, log, rt)
+    results = []
+    for j in jobs:
+        if j.skip:
+            results.append((j.stats, j.skip))
+            continue
+        out = done.get(id(j)) or process(
+            j.inp, j.out, preset, j.cfg, log, j.probe, j.plan, rt
+        )
+        results.append(finish_item(j, *out))
+    return results
+
+
+# ─── Plan ───
+class OutputIndex:
+    # Directory listings taken once, so existence checks never hit the disk
+    def __init__(self) -> None:
+        self._dirs: dict[Path, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def _names(self, d: Path) -> set[str]:
+        if (names := self._dirs.get(d)) is None:
+            try:
+                with os.scandir(d) as it:
+                    names = {e.name for e in it}
+            except OSError:
+                names = set()
+            self._dirs[d] = names
+        return names
+
+    def exists(self, p: Path) -> bool:
+        with self._lock:
+            return p.name in self._names(p.parent)
+
+    def add(self, p: Path) -> None:
+        with self._lock:
+            self._names(p.parent).add(p.name)
+
+
+@dataclass(slots=True)
+class PlanItem:
+    input: Path
+    output: Path
+    action: str = "encode"  # encode | skip | collision
+    reason: str = ""
+
+
+def iter_plan(
+    pairs: Iterable[tuple[Path, Path]],
+    cfg: Config,
+    index: OutputIndex | None = None,
+    walk: WalkStats | None = None,
+) -> Iterator[PlanItem]:
+    index = index or OutputIndex()
+    claimed: dict[Path, Path] = {}
+    for inp, out in pairs:
+        item = PlanItem(inp, out)
+        if inp == out:
+            item.action, item.reason = "skip", "same"
+        elif (first := claimed.get(out)) is not None:
+            item.action, item.reason = "collision", f"same output as {first}"
+        elif cfg.skip_existing and index.exists(out):
+            item.action, item.reason = "skip", "exists"
+        else:
+            claimed[out] = inp
+        if item.action != "encode" and walk:
+            walk.forget(inp)
+        yield item
+
+
+def plan_outputs(
+    pairs: Iterable[tuple[Path, Path]],
+    cfg: Config,
+    index: OutputIndex | None = None,
+    walk: WalkStats | None = None,
+) -> list[PlanItem]:
+    return list(iter_plan(pairs, cfg, index, walk))
+
+
+def make_dirs(plan: list[PlanItem]) -> None:
+    dirs = {i.output.parent for i in plan if i.action == "encode"}
+    # Parents first so concurrent mkdirs rarely race on shared ancestors
+    with ThreadPoolExecutor(SCAN_THREADS) as ex:
+        list(ex.map(_ensure_dir, sorted(dirs, key=lambda d: len(d.parts))))
+
+
+def plan_stats(plan: list[PlanItem]) -> Stats:
+    stats = Stats()
+    for item in plan:
+        if item.action == "skip":
+            stats.skipped += 1
+            stats.decisions[f"skip: {item.reason}"] += 1
+        elif item.action == "collision":
+            stats.failed += 1
+            stats.failures.append(f"{item.input}: output collision ({item.reason})")
+            stats.decisions["failed: output collision"] += 1
+    return stats
+
+
+def write_plan(
+    path: Path,
+    plan: list[PlanItem],
+    preset: Preset,
+    out_dir: Path | None,
+    src_root: Path | None,
+) -> None:
+    doc = {
+        "version": 1,
+        "preset": preset.name,
+        "out_dir": str(out_dir) if out_dir else None,
+        "src_root": str(src_root) if src_root else None,
+        "items": [
+            {
+                "input": str(i.input),
+                "output": str(i.output),
+                "action": i.action,
+                "reason": i.reason,
+            }
+            for i in plan
+        ],
+    }
+    tmp = path.with_name(f".{path.name}.part")
+    tmp.write_text(json.dumps(doc, ensure_ascii=False) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def read_plan(path: Path) -> dict[str, Any]:
+    doc = json.loads(path.read_text(encoding="utf-8"))
+    if doc.get("version") != 1:
+        raise ValueError(f"unsupported plan version: {doc.get('version')}")
+    return doc
+
+
+def log_settings(
+    preset: Preset, cfg: Config, log: Log, out_dir: Path | None, src_root: Path | None
+) -> None:
+    log.info(
+        f"Format: {preset.name} (.{preset.ext}), CRF {cfg.crf}, Preset {cfg.preset}, Grain {cfg.grain}"
+    )
+    if (goal := quality_target(cfg)) and preset.is_video:
+        lo, hi = cfg.crf_range
+        log.info(
+            f"Target: {goal[0]} >= {goal[1]:g}, CRF {lo}-{hi},"
+            f" {cfg.samples}x{cfg.sample_len:g}s samples"
+        )
+    if preset.is_video:
+        log.info(f"Audio: {cfg.audio_bitrate}, {cfg.audio_channels}ch")
+        filters: list[str] = []
+        if cfg.max_dim:
+            filters.append(f"max-dim={cfg.max_dim[0]}x{cfg.max_dim[1]}")
+        if cfg.default_denoise:
+            filters.append("denoise=hqdn3d:1.5:1.5:6:6")
+        if cfg.deinterlace:
+            filters.append(f"deinterlace={cfg.deinterlace}")
+        if cfg.denoise:
+            filters.append(f"denoise={cfg.denoise}:{cfg.denoise_strength}")
+        if cfg.deblock:
+            filters.append(f"deblock={cfg.deblock}")
+        if cfg.default_deband:
+            filters.append("deband")
+        if cfg.auto_filters and (cfg.default_denoise or cfg.default_deband):
+            filters.append("auto (per-file noise probe)")
+        if cfg.rotate:
+            filters.append(f"rotate={cfg.rotate}")
+        if cfg.crop:
+            filters.append(f"crop={cfg.crop}")
+        if cfg.scale:
+            filters.append(f"scale={cfg.scale}")
+        if filters:
+            log.info(f"Filters: {', '.join(filters)}")
+    if src_root and out_dir:
+        log.info(f"Input:  {src_root}")
+        log.info(f"Output: {out_dir}")
+    print()
+
+
+def run_batch(
+    files: Iterable[Path],
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    out_dir: Path | None,
+    src_root: Path | None,
+    jobs: int,
+    pairs: Iterable[tuple[Path, Path]] | None = None,
+    walk: WalkStats | None = None,
+) -> Stats:
+    streaming = pairs is None and not (cfg.plan_out or cfg.dry_run)
+    if pairs is None:
+        pairs = (
+            (f, gen_out_path(f, preset, cfg, out_dir, src_root, create=False))
+            for f in files
+        )
+    if streaming:
+        return stream_batch(pairs, preset, cfg, log, out_dir, src_root, jobs, walk)
+    start = time.perf_counter()
+    plan = plan_outputs(pairs, cfg, walk=walk)
+    stats = plan_stats(plan)
+    todo = [i for i in plan if i.action == "encode"]
+    total = len(todo)
+    log.info(
+        f"Plan: {total} to encode, {stats.skipped} skipped, {stats.failed} collisions"
+        f" ({time.perf_counter() - start:.1f}s)"
+    )
+    for item in plan:
+        if item.action == "collision":
+            log.warn(f"  Collision: {item.input} → {item.output.name} ({item.reason})")
+    if cfg.plan_out:
+        write_plan(cfg.plan_out, plan, preset, out_dir, src_root)
+        log.ok(f"Wrote plan: {cfg.plan_out}")
+
+    log.info(f"Processing {total} files")
+
+    log_settings(preset, cfg, log, out_dir, src_root)
+    if cfg.dry_run:
+        # The plan is the whole answer; no probing, no directories
+        for item in todo:
+            log.info(f"  {item.input} → {item.output}")
+        return stats
+    make_dirs(todo)
+    outputs = {i.input: i.output for i in todo}
+    stats.merge(
+        execute(
+            [i.input for i in todo],
+            total,
+            preset,
+            cfg,
+            log,
+            out_dir,
+            src_root,
+            jobs,
+            outputs,
+            walk=walk,
+        )
+    )
+    return stats
+
+
+def stream_batch(
+    pairs: Iterable[tuple[Path, Path]],
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    out_dir: Path | None,
+    src_root: Path | None,
+    jobs: int,
+    walk: WalkStats | None = None,
+) -> Stats:
+    # Nothing needs the whole plan up front: plan while discovery runs, so
+    # encoding starts at once and --order longest keeps its --lookahead window
+    stats = Stats()
+    outputs: dict[Path, Path] = {}
+
+    def todo() -> Iterator[Path]:
+        for item in iter_plan(pairs, cfg, walk=walk):
+            if item.action != "encode":
+                stats.merge(plan_stats([item]))
+                if item.action == "collision":
+                    log.warn(f"  Collision: {item.input} → {item.output.name} ({item.reason})")
+                continue
+            _ensure_dir(item.output.parent)
+            outputs[item.input] = item.output
+            yield item.input
+
+    log.info("Processing files as they are found")
+    log_settings(preset, cfg, log, out_dir, src_root)
+    stats.merge(
+        execute(
+            todo(), 0, preset, cfg, log, out_dir, src_root, jobs, outputs, walk=walk
+        )
+    )
+    return stats
+
+
+def journal_path(out_dir: Path | None, src_root: Path | None) -> Path:
+    if out_dir:
+        return out_dir / JOURNAL_NAME
+    root = str((src_root or Path.cwd()).resolve())
+    return JOURNAL_DIR / f"{hashlib.sha1(root.encode()).hexdigest()[:16]}.jsonl"
+
+
+def execute(
+    files: Iterable[Path],
+    total: int,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    out_dir: Path | None,
+    src_root: Path | None,
+    jobs: int,
+    outputs: dict[Path, Path] | None = None,
+    ahead: int | None = None,
+    done: Callable[[Path], None] | None = None,
+    walk: WalkStats | None = None,
+) -> Stats:
+    cache = ProbeCache(cfg.probe_cache) if cfg.probe_cache and has("ffprobe") else None
+    depth = max(8, jobs * 4) if ahead is None else ahead
+    items = prefetch_probes(files, cache, depth, walk)
+    if cfg.order == "longest":
+        window = total or cfg.lookahead
+        log.info(f"Order: longest first (window {window})")
+        items = order_by_cost(items, window, walk)
+    rt = Runtime(
+        cpus=CpuPool(available_cpus(), jobs) if cfg.pin and jobs > 1 else None,
+        probes=cache,
+        outputs=outputs,
+        done=done,
+        walk=walk,
+    )
+    # Audio batches read many small files at once; staging targets big inputs
+    if cfg.scratch and not cfg.dry_run and batch_size(preset, cfg) == 1:
+        rt.stager = Stager(cfg.scratch, cfg.scratch_budget, log, walk)
+        log.info(f"Scratch: {rt.stager.dir} (budget {rt.stager.budget >> 20}MiB)")
+
+        def wanted(f: Path) -> bool:
+            # Planned items are known to need encoding; others may be skipped
+            if outputs or not cfg.skip_existing:
+                return True
+            return not gen_out_path(f, preset, cfg, out_dir, src_root, create=False).exists()
+
+        depth = jobs if ahead is None else min(ahead, jobs)
+        items = stage_ahead(items, rt.stager, depth, wanted)
+    governor = None
+    if cfg.adaptive and jobs > 1:
+        lo = max(1, min(cfg.min_jobs, jobs))
+        job_threads = cfg.threads or max(1, len(available_cpus()) // jobs)
+        start = initial_jobs(lo, jobs, sample_load(), job_threads)
+        rt.gate = Gate(start, cfg.mem_budget)
+        governor = Governor(rt.gate, lo, jobs, job_threads, log)
+        governor.start()
+        log.info(f"Adaptive concurrency: {lo}-{jobs} jobs, starting at {start}")
+    elif cfg.mem_budget and jobs > 1:
+        rt.gate = Gate(jobs, cfg.mem_budget)
+    if cfg.dedup and not cfg.dry_run:
+        rt.encodes = EncodeCache(cache)
+    if rt.gate and cfg.mem_budget:
+        rt.mem = MemModel()
+        log.info(f"Memory budget: {cfg.mem_budget >> 20}MiB of estimated encoder memory")
+    if cfg.metrics_out:
+        rt.metrics = Metrics(cfg.metrics_out)
+    rt.journal = Journal(journal_path(out_dir, src_root))
+    if cfg.resume:
+        stale = rt.journal.load()
+        log.info(
+            f"Resume: {rt.journal.done_count} done, {len(stale)} interrupted"
+            f" ({rt.journal.path})"
+        )
+        for _, out in stale:
+            remove_partial(out)
+    if not log.quiet:
+        rt.progress = log.live = Progress(sys.stdout.isatty())
+    try:
+        run = _run_items_async if cfg.engine == "asyncio" else _run_items
+        stats = run(items, total, preset, cfg, log, out_dir, src_root, jobs, rt)
+        if rt.stager:
+            # Outputs are still moving; a failed move turns a success into a failure
+            rt.stager.flush()
+            count_lost(stats, rt.stager.lost)
+        return stats
+    finally:
+        if governor:
+            governor.stop()
+        if rt.stager:
+            rt.stager.close()
+        if rt.progress:
+            rt.progress.close()
+            log.live = None
+        if cache:
+            cache.close()
+        if rt.journal:
+            rt.journal.compact(cfg.resume)
+            rt.journal.close()
+        if rt.metrics:
+            rt.metrics.close()
+
+
+def _run_items(
+    items: Iterator[tuple[Path, Probe | None]],
+    total: int,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    out_dir: Path | None,
+    src_root: Path | None,
+    jobs: int,
+    rt: Runtime,
+) -> Stats:
+    stats = Stats()
+    units = _batched(items, batch_size(preset, cfg))
+    tot_str = f"/{total}" if total else ""
+    if jobs > 1:
+        threads = f" × {cfg.threads} threads" if cfg.threads else ""
+        pinned = ", pinned" if rt.cpus else ""
+        log.info(f"Parallel execution with {jobs} jobs{threads}{pinned}")
+        quiet_log = Log(quiet=True, silent=log.silent)
+        quiet_log.live = log.live
+
+        def submit(unit: list[tuple[Path, Probe | None]]) -> None:
+            for _, pr in unit:
+                _queued(rt, pr)
+            futures[
+                executor.submit(
+                    process_batch, unit, preset, cfg, out_dir, src_root, quiet_log, rt
+                )
+            ] = unit
+
+        # The source may block (slow discovery, --watch); pull it on its own
+        # thread so finished jobs are collected and logged meanwhile
+        feeder = Feeder(units)
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures: dict[Any, list[tuple[Path, Probe | None]]] = {}
+                pull: Future | None = feeder.pull()
+                i = 1
+                while futures or pull:
+                    done, _ = wait(
+                        [*futures, *([pull] if pull else [])],
+                        return_when=FIRST_COMPLETED,
+                    )
+                    if pull in done:
+                        if (unit := pull.result()) is None:
+                            _discovered(rt)
+                        else:
+                            submit(unit)
+                        pull = None
+                    for future in done & futures.keys():
+                        unit = futures.pop(future)
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            for f, pr in unit:
+                                _finished(rt, f, pr)
+                                stats.failed += 1
+                                stats.failures.append(str(f))
+                                log.err(f"Error processing {f.name}: {e}")
+                                i += 1
+                            continue
+                        for (f, pr), (s, msg) in zip(unit, results):
+                            _finished(rt, f, pr, s)
+                            stats.merge(s)
+                            log.info(f"[{i}{tot_str}] {msg}")
+                            i += 1
+                    if not pull and not feeder.exhausted and len(futures) < jobs * 2:
+                        pull = feeder.pull()
+        except KeyboardInterrupt:
+            log.err("Interrupted")
+            sys.exit(130)
+        return stats
+
+    i = 1
+    for unit in units:
+        for _, pr in unit:
+            _queued(rt, pr)
+        if len(unit) == 1:
+            log.info(f"[{i}{tot_str}] {unit[0][0].name}")
+        else:
+            log.info(f"[{i}-{i + len(unit) - 1}{tot_str}] {len(unit)} files")
+        results = process_batch(unit, preset, cfg, out_dir, src_root, log, rt)
+        for (f, pr), (s, msg) in zip(unit, results):
+            _finished(rt, f, pr, s)
+            stats.merge(s)
+            if s.skipped:
+                log.warn(f"  {msg}")
+            elif s.failed:
+                log.err(f"  {msg}")
+            elif len(unit) > 1:
+                log.info(f"  {msg}")
+        i += len(unit)
+    return stats
+
+
+class Feeder:
+    # One daemon thread drives the iterator; each pull() is a future for wait()
+    def __init__(self, items: Iterator[Any]) -> None:
+        self.items = items
+        self.exhausted = False
+        self._requests: queue.SimpleQueue[Future] = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            fut = self._requests.get()
+            if self.exhausted:
+                fut.set_result(None)
+                continue
+            try:
+                item = next(self.items, None)
+            except BaseException as e:
+                self.exhausted = True
+                fut.set_exception(e)
+                continue
+            self.exhausted = item is None
+            fut.set_result(item)
+
+    def pull(self) -> Future:
+        fut: Future = Future()
+        self._requests.put(fut)
+        return fut
+
+
+def _queued(rt: Runtime, probe: Probe | None) -> None:
+    if rt.progress:
+        rt.progress.add(probe.duration if probe else 0.0)
+
+
+def _finished(
+    rt: Runtime, inp: Path, probe: Probe | None, s: Stats | None = None
+) -> None:
+    if rt.walk:
+        rt.walk.forget(inp)
+    if rt.done:
+        rt.done(inp)
+    if rt.stager:
+        rt.stager.release(inp)
+    if rt.progress:
+        encoded = bool(s and s.processed) and not any(
+            k.startswith("reused: ") for k in s.decisions
+        )
+        rt.progress.finish(probe.duration if probe else 0.0, encoded)
+
+
+def _discovered(rt: Runtime) -> None:
+    if rt.progress:
+        rt.progress.discovering = False
+
+
+# ─── asyncio engine ───
+async def _wait_exit(pid: int) -> tuple[int, Any]:
+    loop = asyncio.get_running_loop()
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        _, status, ru = await loop.run_in_executor(None, os.wait4, pid, 0)
+        return status, ru
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+    # The pidfd is readable only once the child has exited, so this never blocks;
+    # reap ourselves (no asyncio child watcher) to keep the rusage
+    _, status, ru = os.wait4(pid, os.WNOHANG)
+    return status, ru
+
+
+async def _kill_group(pid: int, grace: float = 5.0) -> None:
+    for sig, wait_s in ((signal.SIGTERM, grace), (signal.SIGKILL, None)):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            await asyncio.wait_for(_wait_exit(pid), wait_s)
+            return
+        except asyncio.TimeoutError:
+            continue
+        except ChildProcessError:
+            return
+
+
+async def _read_lines(
+    loop: asyncio.AbstractEventLoop, pipe: Any, transports: list[Any]
+) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), pipe
+    )
+    transports.append(transport)
+    return reader
+
+
+async def run_cmd_async(
+    cmd: list[str],
+    quiet: bool,
+    cpus: frozenset[int] | None = None,
+    on_progress: ProgressHook | None = None,
+    echo: Callable[[str], None] | None = None,
+) -> RunResult:
+    loop = asyncio.get_running_loop()
+    argv = pin_cmd(cmd, cpus)
+    echo = echo or (None if quiet else sys.stderr.write)
+    piped = on_progress is not None or "pipe:1" in cmd
+    frames = 0
+    stopped = False
+    tail: deque[str] = deque(maxlen=STDERR_TAIL)
+    start = time.perf_counter()
+    # Not create_subprocess_exec: its child watcher reaps the process itself
+    # and drops the rusage we report per job, and we want our own session so
+    # Ctrl-C reaches us only and we can kill ffmpeg's whole group. fork/exec
+    # can stall on a large heap, so spawn off the loop thread.
+    spawn = asyncio.ensure_future(
+        asyncio.to_thread(
+            subprocess.Popen,
+            argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if piped else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            shell=False,
+            start_new_session=True,
+        )
+    )
+    try:
+        proc = await asyncio.shield(spawn)
+    except asyncio.CancelledError:
+        with suppress(Exception):
+            await _kill_group((await spawn).pid)
+        raise
+    pin_started(proc.pid, cpus, argv is not cmd)
+
+    async def read_err(reader: asyncio.StreamReader) -> None:
+        async for raw in reader:
+            line = raw.decode(errors="replace")
+            tail.append(line)
+            if echo:
+                echo(line)
+
+    async def read_out(reader: asyncio.StreamReader) -> None:
+        nonlocal frames, stopped
+        fields: dict[str, str] = {}
+        async for raw in reader:
+            if _progress_block(fields, raw.decode(errors="replace")):
+                frames = _num(fields.get("frame")) or frames
+                if on_progress and on_progress(fields) and not stopped:
+                    stopped = True
+                    proc.terminate()
+                fields = {}
+
+    transports: list[Any] = []
+    try:
+        readers = [read_err(await _read_lines(loop, proc.stderr, transports))]
+        if piped:
+            readers.append(read_out(await _read_lines(loop, proc.stdout, transports)))
+        await asyncio.gather(*readers)
+        status, ru = await _wait_exit(proc.pid)
+    except asyncio.CancelledError:
+        await _kill_group(proc.pid)
+        proc.returncode = -signal.SIGTERM
+        raise
+    finally:
+        for t in transports:
+            t.close()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return RunResult(
+        ok=proc.returncode == 0 and not stopped,
+        returncode=proc.returncode,
+        wall=time.perf_counter() - start,
+        utime=ru.ru_utime,
+        stime=ru.ru_stime,
+        maxrss=ru.ru_maxrss * 1024,
+        frames=frames,
+        tool=Path(cmd[0]).name,
+        stderr="".join(tail),
+    )
+
+
+async def convert_async(
+    inp: Path,
+    out: Path,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    retries: int = 3,
+    plan: StreamPlan | None = None,
+    rt: Runtime | None = None,
+    probe: Probe | None = None,
+    report: ProgressFn | None = None,
+) -> RunResult:
+    if cfg.chunked:
+        # Chunked files are long; a thread per file costs nothing there
+        return await asyncio.to_thread(
+            convert, inp, out, preset, cfg, log, retries, plan, rt, probe, report
+        )
+    params = build_params(preset, cfg, plan)
+    for attempt in range(1, retries + 1):
+        guard = size_guard(inp, cfg, probe, rt.walk if rt else None)
+        use_ffzap = attempt == 1 and has("ffzap") and not guard
+        tool = "ffzap" if use_ffzap else "ffmpeg"
+        log.info(f"  [{attempt}/{retries}] {tool}...")
+        start = time.perf_counter()
+        cmd = ffmpeg_cmd(inp, out, params, log.quiet, use_ffzap)
+        on_progress = None if use_ffzap else progress_hook(report, guard)
+        mem = admit_mem(preset, cfg, probe, log, rt)
+        async with (
+            rt.gate.slot_async(mem) if rt and rt.gate else nullcontext(),
+            rt.cpus.slot_async() if rt and rt.cpus else nullcontext() as cpus,
+        ):
+                res = await run_cmd_async(
+                    cmd, log.quiet, cpus, on_progress, log.echo
+                )
+        res.attempt, res.tool = attempt, tool
+        if rt and rt.mem:
+            rt.mem.observe(preset, cfg, probe, res)
+        if res:
+            log.ok(f"  {time.perf_counter() - start:.1f}s")
+            return res
+        res.reason = abort_reason(guard, log) or classify_failure(res)
+        log.warn(f"  Attempt {attempt} failed: {res.reason}")
+        if (delay := retry_delay(res, attempt, retries, use_ffzap)) is None:
+            break
+        await asyncio.sleep(delay)
+    return res
+
+
+async def process_async(
+    job: Job, preset: Preset, log: Log, rt: Runtime
+) -> tuple[RunResult, int, int]:
+    inp, out, cfg, probe = job.inp, job.out, job.cfg, job.probe
+    in_sz = start_output(inp, out, cfg, log, probe, job.plan, rt)
+    if cfg.dry_run:
+        return RunResult(True), in_sz, 0
+    key = None
+    if rt.encodes:
+        key = await asyncio.to_thread(encode_key, inp, preset, cfg, job.plan, rt)
+    if key and (cached := await claim_output_async(rt.encodes, key, log)):
+        if hit := await asyncio.to_thread(
+            reuse_output, inp, out, cached, cfg, log, in_sz, rt
+        ):
+            return hit
+    live = rt.progress
+    duration = probe.duration if probe else 0.0
+    tmp = None
+    try:
+        src = await asyncio.to_thread(rt.stager.acquire, inp) if rt.stager else inp
+        tmp = rt.stager.output(out) if rt.stager else part_path(out)
+        with live.task(inp.name, duration) if live else nullcontext() as report:
+            res = await convert_async(
+                src,
+                tmp,
+                preset,
+                cfg,
+                log,
+                plan=job.plan,
+                rt=rt,
+                probe=probe,
+                report=report,
+            )
+        return finish_output(
+            inp, out, preset, cfg, log, res, in_sz, probe, rt, tmp, key
+        )
+    except BaseException:
+        if tmp:
+            tmp.unlink(missing_ok=True)
+        if key:
+            rt.encodes.settle(key, None)
+        raise
+
+
+async def process_batch_async(
+    unit: list[tuple[Path, Probe | None]],
+    preset: Preset,
+    cfg: Config,
+    out_dir: Path | None,
+    src_root: Path | None,
+    log: Log,
+    rt: Runtime,
+) -> list[tuple[Stats, str]]:
+    loop = asyncio.get_running_loop()
+    jobs = await loop.run_in_executor(
+        None,
+        lambda: [
+            prepare_item(inp, preset, cfg, out_dir, src_root, log, pr, rt)
+            for inp, pr in unit
+        ],
+    )
+    todo = [j for j in jobs if not j.skip]
+    done: dict[int, tuple[RunResult, int, int]] = {}
+    if len(todo) > 1 and not cfg.dry_run:
+        sizes = [
+            start_output(j.inp, j.out, j.cfg, log, j.probe, j.plan, rt) for j in todo
+        ]
+        live = rt.progress
+        try:
+            mem = admit_mem(preset, cfg, None, log, rt)
+            async with (
+                rt.gate.slot_async(mem) if rt.gate else nullcontext(),
+                rt.cpus.slot_async() if rt.cpus else nullcontext() as cpus,
+            ):
+                    with (
+                        live.task(f"{len(todo)} files", _batch_duration(todo))
+                        if live
+                        else nullcontext()
+                    ) as report:
+                        res = await run_cmd_async(
+                            batch_cmd(todo, preset, log.quiet),
+                            log.quiet,
+                            cpus,
+                            (lambda f: report(f, 0)) if report else None,
+                            log.echo,
+                        )
+        except asyncio.CancelledError:
+            for j in todo:
+                part_path(j.out).unlink(missing_ok=True)
+            raise
+        done = _batch_outputs(todo, sizes, res, preset, log, rt)
+    results = []
+    for j in jobs:
+        if j.skip:
+            results.append((j.stats, j.skip))
+            continue
+        out = done.get(id(j)) or await process_async(j, preset, log, rt)
+        results.append(finish_item(j, *out))
+    return results
+
+
+def _run_items_async(
+    items: Iterator[tuple[Path, Probe | None]],
+    total: int,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    out_dir: Path | None,
+    src_root: Path | None,
+    jobs: int,
+    rt: Runtime,
+) -> Stats:
+    stats = Stats()
+    pinned = ", pinned" if rt.cpus else ""
+    log.info(f"asyncio engine with {jobs} concurrent jobs{pinned}")
+    job_log = log
+    if jobs > 1:
+        job_log = Log(quiet=True, silent=log.silent)
+        job_log.live = log.live
+    tot_str = f"/{total}" if total else ""
+    done = itertools.count(1)
+    units = _batched(items, batch_size(preset, cfg))
+    # The file iterator may block on discovery, probing or --watch; keep it
+    # off the loop and out of the default executor (which exit waits for)
+    feeder = Feeder(units)
+
+    async def claim() -> list[tuple[Path, Probe | None]] | None:
+        unit = await asyncio.wrap_future(feeder.pull())
+        if unit is None:
+            _discovered(rt)
+        else:
+            for _, pr in unit:
+                _queued(rt, pr)
+        return unit
+
+    async def worker() -> None:
+        while (unit := await claim()) is not None:
+            try:
+                results = await process_batch_async(
+                    unit, preset, cfg, out_dir, src_root, job_log, rt
+                )
+            except Exception as e:
+                results = [
+                    (
+                        Stats(failed=1, failures=[f"{inp}: {e}"]),
+                        f"Error processing {inp.name}: {e}",
+                    )
+                    for inp, _ in unit
+                ]
+            for (f, pr), (s, msg) in zip(unit, results):
+                _finished(rt, f, pr, s)
+                stats.merge(s)
+                log.info(f"[{next(done)}{tot_str}] {msg}")
+
+    async def run() -> None:
+        await asyncio.gather(*(worker() for _ in range(max(1, jobs))))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        log.err("Interrupted")
+        sys.exit(130)
+    return stats
+
+
+# ─── Watch mode ───
+IN_CLOSE_WRITE: Final = 0x008
+IN_MOVED_FROM: Final = 0x040
+IN_MOVED_TO: Final = 0x080
+IN_CREATE: Final = 0x100
+IN_DELETE: Final = 0x200
+IN_Q_OVERFLOW: Final = 0x4000
+IN_IGNORED: Final = 0x8000
+IN_ISDIR: Final = 0x40000000
+IN_NONBLOCK: Final = os.O_NONBLOCK
+IN_CLOEXEC: Final = os.O_CLOEXEC
+WATCH_MASK: Final = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MOVED_FROM
+WATCH_SETTLE: Final = 5.0  # seconds a file's size/mtime must hold still
+_INOTIFY_EVENT: Final = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class Inotify:
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), "inotify_init1")
+        self.dirs: dict[int, Path] = {}
+
+    def add(self, d: Path) -> None:
+        wd = self._add(self.fd, os.fsencode(d), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(d))
+        self.dirs[wd] = d
+
+    def read(self) -> Iterator[tuple[Path | None, int]]:
+        # (None, IN_Q_OVERFLOW) means events were lost and the tree needs a rescan
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        off = 0
+        while off < len(buf):
+            wd, mask, _, n = _INOTIFY_EVENT.unpack_from(buf, off)
+            off += _INOTIFY_EVENT.size
+            name = buf[off : off + n].rstrip(b"\0")
+            off += n
+            if mask & IN_Q_OVERFLOW:
+                yield None, mask
+            elif mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            elif (d := self.dirs.get(wd)) is not None and name:
+                yield d / os.fsdecode(name), mask
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Watcher:
+    def __init__(
+        self,
+        root: Path,
+        exts: frozenset[str],
+        exclude: Path | None = None,
+        settle: float = WATCH_SETTLE,
+    ) -> None:
+        self.root, self.exts, self.exclude, self.settle = root, exts, exclude, settle
+        self.ino = Inotify()
+        # Debounce: path -> (deadline, (size, mtime_ns)); the heap holds deadlines
+        self.pending: dict[Path, tuple[float, tuple[int, int]]] = {}
+        self.heap: list[tuple[float, Path]] = []
+        # Yielded and not yet done with: a repeat close on an unchanged file
+        # is not news. Entries go once the run finishes the file or it leaves.
+        self.seen: dict[Path, tuple[int, int]] = {}
+
+    def _skip(self, p: Path) -> bool:
+        return p.name.startswith(".") or (
+            self.exclude is not None and p.is_relative_to(self.exclude)
+        )
+
+    def _queue(self, p: Path, st: os.stat_result | None = None) -> None:
+        if self._skip(p) or p.suffix.lower() not in self.exts:
+            return
+        try:
+            st = st or p.stat()
+        except OSError:
+            return
+        deadline = time.monotonic() + self.settle
+        self.pending[p] = (deadline, (st.st_size, st.st_mtime_ns))
+        heapq.heappush(self.heap, (deadline, p))
+
+    def _add_tree(self, top: Path) -> None:
+        # Watch first, then list, so nothing created in between is missed
+        stack = [top]
+        while stack:
+            d = stack.pop()
+            if self._skip(d) and d != self.root:
+                continue
+            try:
+                self.ino.add(d)
+                with os.scandir(d) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(Path(e.path))
+                        elif e.is_file():
+                            self._queue(Path(e.path), e.stat())
+            except OSError:
+                continue
+
+    def done(self, p: Path) -> None:
+        # Called from worker threads; a single pop needs no lock
+        self.seen.pop(p, None)
+
+    def _forget(self, p: Path, tree: bool) -> None:
+        for table in (self.seen, self.pending):
+            gone = [q for q in list(table) if q.is_relative_to(p)] if tree else [p]
+            for q in gone:
+                table.pop(q, None)
+
+    def _event(self, p: Path | None, mask: int) -> None:
+        if p is None:
+            self._add_tree(self.root)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._forget(p, bool(mask & IN_ISDIR))
+        elif mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(p)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._queue(p)
+
+    def _settled(self) -> Iterator[Path]:
+        now = time.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, p = heapq.heappop(self.heap)
+            entry = self.pending.get(p)
+            if entry is None or entry[0] != deadline:
+                continue  # superseded by a later event
+            try:
+                st = p.stat()
+            except OSError:
+                del self.pending[p]
+                continue
+            sig = (st.st_size, st.st_mtime_ns)
+            if sig != entry[1]:
+                self._queue(p, st)  # still growing
+                continue
+            del self.pending[p]
+            if self.seen.get(p) != sig:
+                self.seen[p] = sig
+                yield p
+
+    def __iter__(self) -> Iterator[Path]:
+        self._add_tree(self.root)
+        try:
+            while True:
+                yield from self._settled()
+                timeout = (
+                    max(0.0, self.heap[0][0] - time.monotonic()) if self.heap else None
+                )
+                # Idle cost is one blocked select(); no polling
+                if select.select([self.ino.fd], [], [], timeout)[0]:
+                    for p, mask in self.ino.read():
+                        self._event(p, mask)
+        finally:
+            self.ino.close()
+
+
+def run_watch(
+    watcher: Watcher,
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    out_dir: Path | None,
+    src_root: Path | None,
+    jobs: int,
+) -> Stats:
+    # Files arrive one at a time: no look-ahead ordering or batching to wait on
+    cfg = replace(cfg, order="discovery", batch=1)
+    log.info(f"Watching {src_root} (settle {WATCH_SETTLE:g}s, Ctrl-C to stop)")
+    log_settings(preset, cfg, log, out_dir, src_root)
+    return execute(
+        watcher, 0, preset, cfg, log, out_dir, src_root, jobs, ahead=0, done=watcher.done
+    )
+
+
+def print_summary(stats: Stats, log: Log) -> None:
+    print()
+    total_files = stats.processed + stats.skipped + stats.failed
+    log.info("┌──────────────┬───────┐")
+    log.info(f"│ {'Total Files':<12} │ {total_files:>5} │")
+    log.info("├──────────────┼───────┤")
+    log.info(f"│ {'Succeeded':<12} │ {stats.processed:>5} │")
+    log.info(f"│ {'Skipped':<12} │ {stats.skipped:>5} │")
+    log.info(f"│ {'Failed':<12} │ {stats.failed:>5} │")
+    log.info("└──────────────┴───────┘")
+
+    if stats.input_bytes or stats.output_bytes:
+        ratio = stats.output_bytes / stats.input_bytes if stats.input_bytes else 0
+        saved = stats.input_bytes - stats.output_bytes
+        log.info(
+            f"Storage: {stats.input_bytes / 1e6:.2f}MB → {stats.output_bytes / 1e6:.2f}MB ({ratio:.1%})"
+        )
+        if saved > 0:
+            log.ok(f"Saved: {saved / 1e6:.2f}MB")
+    if stats.decisions:
+        log.info("Decisions:")
+    for decision, n in sorted(stats.decisions.items()):
+        log.info(f"  {decision:<24} {n:>5}")
+    if stats.failures:
+        log.err("Failures:")
+        for f in stats.failures:
+            log.err(f"  - {f}")
+
+
+def print_filtergraphs(
+    files: Iterable[Path],
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    walk: WalkStats | None = None,
+) -> int:
+    if not preset.is_video:
+        log.warn(f"{preset.name} has no video filter graph")
+        return 0
+    cache = ProbeCache(cfg.probe_cache) if cfg.probe_cache and has("ffprobe") else None
+    # The graph the encode would run: same stream plan, crop and noise analyses
+    # (and the same cached results) as prepare_item
+    rt = Runtime(probes=cache, walk=walk)
+    quiet = Log(quiet=True, silent=log.silent)
+    try:
+        for inp, probe in prefetch_probes(files, cache, 8, walk):
+            c = with_frame_size(cfg, probe)
+            plan = plan_streams(inp, preset, c, probe)
+            if plan and plan.video == "copy":
+                print(f"{inp}\n    video stream copy: no filters")
+                continue
+            c = resolve_filters(inp, c, quiet, probe, rt, Stats())
+            print(f"{inp}\n    {describe_filters(c)}")
+    finally:
+        if cache:
+            cache.close()
+    return 0
+
+
+# ─── Estimate ───
+ESTIMATE_FILES: Final = 12
+# Two-sided 95% Student t by degrees of freedom; larger df use the next lower key
+T95: Final = {
+    1: 12.71,
+    2: 4.30,
+    3: 3.18,
+    4: 2.78,
+    5: 2.57,
+    6: 2.45,
+    7: 2.36,
+    8: 2.31,
+    9: 2.26,
+    10: 2.23,
+    12: 2.18,
+    15: 2.13,
+    20: 2.09,
+    30: 2.04,
+    60: 2.00,
+}
+
+
+def t95(df: int) -> float:
+    keys = [k for k in T95 if k <= df]
+    return T95[max(keys)] if keys else math.inf
+
+
+def ratio_estimate(
+    xs: list[float], ys: list[float], total_x: float, population: int
+) -> tuple[float, float]:
+    # Ratio estimator of sum(y) given the known sum(x) over the population:
+    # (estimate, 95% half-width), with finite population correction
+    n = len(xs)
+    if not n or not sum(xs):
+        return 0.0, math.inf
+    r = sum(ys) / sum(xs)
+    if n < 2:
+        return r * total_x, math.inf
+    s2 = sum((y - r * x) ** 2 for x, y in zip(xs, ys)) / (n - 1)
+    fpc = max(0.0, 1 - n / population)
+    se = total_x / (sum(xs) / n) * math.sqrt(fpc * s2 / n)
+    return r * total_x, t95(n - 1) * se
+
+
+def sample_encode(
+    inp: Path, preset: Preset, job: Job, start: float, out: Path
+) -> tuple[int, float] | None:
+    # (bytes, wall seconds) for one segment, encoded exactly as the real run would
+    seg = ["-ss", f"{start:.3f}", "-t", f"{job.cfg.sample_len:g}"]
+    params = build_params(preset, job.cfg, job.plan)
+    res = run_ffmpeg(inp, out, params, True, False, input_opts=seg)
+    try:
+        return (out.stat().st_size, res.wall) if res else None
+    except OSError:
+        return None
+    finally:
+        out.unlink(missing_ok=True)
+
+
+def estimate_batch(
+    files: Iterable[Path],
+    preset: Preset,
+    cfg: Config,
+    log: Log,
+    out_dir: Path | None,
+    src_root: Path | None,
+    jobs: int,
+    count: int,
+    walk: WalkStats | None = None,
+) -> int:
+    if not has("ffprobe"):
+        log.err("--estimate needs ffprobe for durations")
+        return 1
+    kept: list[Path] = []
+    sizes: list[int] = []
+    for f in files:
+        # Gone or unreadable since the scan: leave it out of the population
+        try:
+            sizes.append(path_stat(f, walk).st_size)
+        except OSError as e:
+            log.warn(f"  Skipping {f.name}: {e.strerror or e}")
+            continue
+        kept.append(f)
+    files = kept
+    # Seeded by the file set, not discovery order: reruns that compare
+    # CRF/preset choices sample the same files
+    order = sorted(range(len(files)), key=lambda i: str(files[i]))
+    seed = hashlib.sha1("\0".join(str(files[i]) for i in order).encode()).digest()
+    picks = random.Random(seed).sample(order, min(count, len(files)))
+    cache = ProbeCache(cfg.probe_cache) if cfg.probe_cache else None
+    rt = Runtime(probes=cache, walk=walk)
+    quiet = Log(quiet=True, silent=log.silent)
+    log.info(
+        f"Estimating from {len(picks)} of {len(files)} files,"
+        f" {cfg.samples}x{cfg.sample_len:g}s samples each, {jobs} at a time"
+    )
+
+    def prepare(i: int) -> Job:
+        inp = files[i]
+        # Plan the output path only: an estimate leaves the output tree alone
+        probe = probe_file(inp, cache, walk)
+        return prepare_item(
+            inp, preset, cfg, out_dir, src_root, quiet, probe, rt, create=False
+        )
+
+    xs: list[float] = []
+    out_ys: list[float] = []
+    time_ys: list[float] = []
+    skipped = failed = 0
+    try:
+        with (
+            tempfile.TemporaryDirectory(prefix="vidconv-estimate-") as tmp,
+            ThreadPoolExecutor(max(1, jobs)) as ex,
+        ):
+            # Same decisions as the real run: passthrough, crop, noise, target CRF
+            prepared = list(ex.map(prepare, picks))
+            tasks: list[tuple[int, Job, list[tuple[float, Any]]]] = []
+            for i, job in zip(picks, prepared):
+                if job.skip:
+                    skipped += 1
+                    xs.append(sizes[i])
+                    out_ys.append(sizes[i])  # untouched
+                    time_ys.append(0.0)
+                    continue
+                duration = job.probe.duration if job.probe else 0.0
+                if not duration:
+                    failed += 1
+                    continue
+                points = sample_points(duration, max(1, cfg.samples), cfg.sample_len)
+                segs = [
+                    (
+                        min(cfg.sample_len, duration - t),
+                        ex.submit(
+                            sample_encode,
+                            files[i],
+                            preset,
+                            job,
+                            t,
+                            Path(tmp) / f"{i}-{n}.{preset.ext}",
+                        ),
+                    )
+                    for n, t in enumerate(points)
+                ]
+                tasks.append((i, job, segs))
+            for i, job, segs in tasks:
+                results = [(secs, fut.result()) for secs, fut in segs]
+                if any(r is None for _, r in results):
+                    failed += 1
+                    log.warn(f"  Sample encode failed: {files[i].name}")
+                    continue
+                secs = sum(s for s, _ in results)
+                duration = job.probe.duration if job.probe else 0.0
+                xs.append(sizes[i])
+                out_ys.append(sum(r[0] for _, r in results) / secs * duration)
+                time_ys.append(sum(r[1] for _, r in results) / secs * duration)
+                log.info(
+                    f"  {files[i].name}: {sizes[i] / 1e6:.1f}MB → ~{out_ys[-1] / 1e6:.1f}MB,"
+                    f" ~{_hms(time_ys[-1])}"
+                )
+    finally:
+        if cache:
+            cache.close()
+    if not xs:
+        log.err("No usable samples")
+        return 1
+    total_in = sum(sizes)
+    out_est, out_ci = ratio_estimate(xs, out_ys, total_in, len(files))
+    time_est, time_ci = ratio_estimate(xs, time_ys, total_in, len(files))
+    # Assumes -j jobs scale perfectly, so this is the best case
+    wall, wall_ci = time_est / max(1, jobs), time_ci / max(1, jobs)
+
+    def mb(v: float) -> str:
+        return "?" if math.isinf(v) else f"{v / 1e6:.2f}MB"
+
+    def hms(v: float) -> str:
+        return "?" if math.isinf(v) else _hms(v)
+
+    saved = total_in - out_est
+    print()
+    log.info(f"Files:  {len(files)} ({len(xs)} sampled, {skipped} would skip, {failed} failed)")
+    log.info(f"Input:  {mb(total_in)}")
+    log.info(f"Output: {mb(out_est)} ± {mb(out_ci)} (95% CI)")
+    log.info(
+        f"Saved:  {mb(saved)} ± {mb(out_ci)}"
+        + (f" ({saved / total_in:.0%})" if total_in else "")
+    )
+    log.info(
+        f"Time:   ≥{hms(wall)} ± {hms(wall_ci)} wall-clock at -j {jobs}"
+        f" ({hms(time_est)} of encoding)"
+    )
+    return 0
+
+
+# ─── Benchmark ───
+def make_clip(source: str, size: str, seconds: float, work: Path) -> Path | None:
+    clip = work / f"{source}-{size}-{seconds:g}s.mkv"
+    if clip.exists():
+        return clip
+    w, h = BENCH_SIZES[size]
+    tmp = part_path(clip)
+    cmd = ffmpeg_base(True) + [
+        "-f",
+        "lavfi",
+        "-i",
+        BENCH_SOURCES[source].format(w=w, h=h),
+        "-f",
+        "lavfi",
+        "-i",
+        "sine=frequency=440:sample_rate=48000",
+        "-t",
+        f"{seconds:g}",
+        "-c:v",
+        "ffv1",
+        "-c:a",
+        "flac",
+        str(tmp),
+    ]
+    if not run_cmd(cmd, True):
+        tmp.unlink(missing_ok=True)
+        return None
+    os.replace(tmp, clip)
+    return clip
+
+
+def quality_scores(
+    ref: Path, dist: Path, ref_opts: Iterable[str] = (), ref_vf: str = ""
+) -> tuple[float | None, float | None]:
+    # ref_vf lets the reference go through the same filters as the encode,
+    # so the score only measures what the encoder threw away
+    pre = f"{ref_vf}," if ref_vf else ""
+    graph = (
+        f"[0:v]format=yuv420p[d0];[1:v]{pre}format=yuv420p[r0];"
+        "[r0][d0]scale2ref=flags=bicubic[r][d];"
+        "[d]split[d1][d2];[r]split[r1][r2];[d1][r1]ssim;[d2][r2]psnr"
+    )
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-nostdin",
+        "-i",
+        str(dist),
+        *ref_opts,
+        "-i",
+        str(ref),
+        "-lavfi",
+        graph,
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, shell=False)
+    except OSError:
+        return None, None
+    ssim = re.search(r"SSIM .*All:([\d.]+)", res.stderr)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", res.stderr)
+    return (
+        float(ssim.group(1)) if ssim else None,
+        float(psnr.group(1)) if psnr else None,
+    )
+
+
+def bench_configs(
+    preset: Preset, crfs: list[int], speeds: list[int], names: list[str], bitrate: str
+) -> Iterator[tuple[str, Config]]:
+    if not preset.is_video:
+        yield bitrate, Config(audio_bitrate=bitrate)
+    elif "{preset_name}" in _values(preset):
+        for crf, name in itertools.product(crfs, names):
+            yield name, Config(crf=crf, preset_name=name, audio_bitrate=bitrate)
+    else:
+        for crf, speed in itertools.product(crfs, speeds):
+            yield str(speed), Config(crf=crf, preset=speed, audio_bitrate=bitrate)
+
+
+def bench_one(
+    clip: Path, preset: Preset, cfg: Config, seconds: float, work: Path
+) -> dict[str, Any]:
+    out = work / f"{clip.stem}.{preset.name}.{preset.ext}"
+    res = run_ffmpeg(clip, out, build_params(preset, cfg), True, False)
+    size = out.stat().st_size if res and out.exists() else 0
+    ssim = psnr = None
+    if res and preset.is_video:
+        ssim, psnr = quality_scores(clip, out)
+    out.unlink(missing_ok=True)
+    return {
+        "ok": bool(res),
+        "crf": cfg.crf,
+        "wall_s": round(res.wall, 3),
+        "fps": round(res.frames / res.wall, 2) if res.wall and res.frames else 0.0,
+        "cpu_s_per_min": round((res.utime + res.stime) * 60 / seconds, 2),
+        "bytes": size,
+        "kbps": round(size * 8 / seconds / 1000, 1),
+        "ssim": ssim,
+        "psnr": psnr,
+    }
+
+
+def bench_key(row: dict[str, Any]) -> tuple[Any, ...]:
+    return tuple(row.get(k) for k in ("source", "size", "preset", "speed", "crf"))
+
+
+def bench_regressions(
+    rows: list[dict[str, Any]], baseline: list[dict[str, Any]], tolerance: float
+) -> list[tuple[dict[str, Any], float]]:
+    base = {bench_key(r): r for r in baseline}
+    out = []
+    for row in rows:
+        old = base.get(bench_key(row))
+        if old and old.get("fps") and row.get("fps") is not None:
+            delta = row["fps"] / old["fps"] - 1
+            if delta < -tolerance:
+                out.append((row, delta))
+    return out
+
+
+def _csv_list(v: str) -> list[str]:
+    return [x.strip() for x in v.split(",") if x.strip()]
+
+
+def make_tree(root: Path, files: int, per_dir: int = 100) -> None:
+    done = root / ".complete"
+    if done.exists():
+        return
+    exts = (".mkv", ".mp4", ".webm", ".txt")
+    for d in range(-(-files // per_dir)):
+        sub = root / f"{d // 100:04d}" / f"{d % 100:02d}"
+        sub.mkdir(parents=True, exist_ok=True)
+        for i in range(min(per_dir, files - d * per_dir)):
+            os.close(os.open(sub / f"f{i}{exts[i % len(exts)]}", os.O_CREAT | os.O_WRONLY))
+    done.touch()
+
+
+# The walkers scan_tree() replaced, kept only as baselines for bench walk
+def _fd_files(root: Path, exts: frozenset[str]) -> Iterator[Path]:
+    if not has("fd"):
+        return
+    cmd = list(
+        itertools.chain(
+            ["fd", "--type", "f"],
+            (x for e in exts for x in ["-e", e.lstrip(".")]),
+            [".", str(root)],
+        )
+    )
+    try:
+        with subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, text=True, bufsize=1, shell=False
+        ) as proc:
+            if proc.stdout:
+                for line in proc.stdout:
+                    if _l := line.strip():
+                        yield Path(_l)
+    except (subprocess.SubprocessError, OSError):
+        return
+
+
+def _os_walk_files(root: Path, exts: frozenset[str]) -> Iterator[Path]:
+    for r, _, fnames in os.walk(root):
+        for f in fnames:
+            if os.path.splitext(f)[1].lower() in exts:
+                yield Path(r) / f
+
+
+def bench_walk(argv: list[str]) -> int:
+    p = argparse.ArgumentParser(
+        prog="vidconv bench walk",
+        description="Compare file discovery walkers on a synthetic tree",
+    )
+    p.add_argument("--files", type=int, default=1_000_000, help="Files in the tree")
+    p.add_argument("--per-dir", type=int, default=100, help="Files per directory")
+    p.add_argument(
+        "--root", type=Path, help="Tree location, reused if complete (default: temporary)"
+    )
+    p.add_argument("--threads", type=int, default=SCAN_THREADS, help="scandir workers")
+    p.add_argument("--json", type=Path, metavar="FILE", help="Write results as JSON")
+    args = p.parse_args(argv)
+    log = Log()
+    root = args.root or Path(tempfile.mkdtemp(prefix="vidconv-walk-"))
+    root.mkdir(parents=True, exist_ok=True)
+    root = root.resolve()
+    # Every method pays for a stat per match: the old walkers did it later
+    methods: dict[str, Callable[[], Iterable[Any]]] = {
+        "scandir": lambda: scan_tree(root, VIDEO_EXTS, args.threads, WalkStats()),
+        "os.walk+stat": lambda: (p.stat() for p in _os_walk_files(root, VIDEO_EXTS)),
+    }
+    if has("fd"):
+        methods["fd+stat"] = lambda: (p.stat() for p in _fd_files(root, VIDEO_EXTS))
+    rows: list[dict[str, Any]] = []
+    try:
+        start = time.perf_counter()
+        make_tree(root, args.files, args.per_dir)
+        log.info(f"Tree: {args.files} files in {root} ({time.perf_counter() - start:.1f}s)")
+        # Warm the dentry cache so the first method is not penalised
+        sum(1 for _ in _os_walk_files(root, VIDEO_EXTS))
+        log.info(f"{'method':<14} {'files':>9} {'seconds':>8} {'files/s':>10}")
+        for name, walk in methods.items():
+            start = time.perf_counter()
+            n = sum(1 for _ in walk())
+            secs = time.perf_counter() - start
+            rows.append({"method": name, "files": n, "seconds": round(secs, 3)})
+            log.info(f"{name:<14} {n:>9} {secs:>8.2f} {n / secs if secs else 0:>10.0f}")
+    finally:
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2) + "\n")
+        log.ok(f"Wrote {args.json}")
+    return 0
+
+
+def bench_main(argv: list[str]) -> int:
+    if argv[:1] == ["walk"]:
+        return bench_walk(argv[1:])
+    p = argparse.ArgumentParser(
+        prog="vidconv bench",
+        description="Benchmark presets on reproducible synthetic clips",
+    )
+    p.add_argument("--presets", type=_csv_list, default=list(PRESETS))
+    p.add_argument(
+        "--sources", type=_csv_list, default=list(BENCH_SOURCES), help="lavfi sources"
+    )
+    p.add_argument("--sizes", type=_csv_list, default=["720p", "1080p"])
+    p.add_argument("--seconds", type=float, default=5.0, help="Clip length")
+    p.add_argument("--crf", type=_csv_list, default=["26"], help="CRF grid (e.g. 22,26,30)")
+    p.add_argument("--preset", type=_csv_list, default=["6"], help="SVT-AV1/VP9 presets")
+    p.add_argument(
+        "--preset-name", type=_csv_list, default=["medium"], help="x264/x265 presets"
+    )
+    p.add_argument("--audio-bitrate", default="128k")
+    p.add_argument("--work", type=Path, help="Clip directory (default: temporary)")
+    p.add_argument("--json", type=Path, metavar="FILE", help="Write results as JSON")
+    p.add_argument(
+        "--compare", type=Path, metavar="FILE", help="Flag fps regressions vs. a JSON run"
+    )
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed fps drop for --compare (default: 0.1)",
+    )
+    args = p.parse_args(argv)
+    log = Log()
+    if not has("ffmpeg"):
+        log.err("Missing: ffmpeg")
+        return 1
+    for name, known in (
+        ("presets", PRESETS),
+        ("sources", BENCH_SOURCES),
+        ("sizes", BENCH_SIZES),
+    ):
+        if bad := [v for v in getattr(args, name) if v not in known]:
+            log.err(f"Unknown {name}: {', '.join(bad)}")
+            return 1
+    work = args.work or Path(tempfile.mkdtemp(prefix="vidconv-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    rows: list[dict[str, Any]] = []
+    log.info(
+        f"{'source':<10} {'size':<6} {'preset':<5} {'speed':<7} {'crf':>3}"
+        f" {'fps':>8} {'cpu-s/min':>9} {'kbps':>9} {'ssim':>7} {'psnr':>6}"
+    )
+    try:
+        for source, size in itertools.product(args.sources, args.sizes):
+            clip = make_clip(source, size, args.seconds, work)
+            if clip is None:
+                log.err(f"Could not generate {source} {size}")
+                continue
+            for name in args.presets:
+                preset = PRESETS[name]
+                for speed, cfg in bench_configs(
+                    preset,
+                    [int(c) for c in args.crf],
+                    [int(v) for v in args.preset],
+                    args.preset_name,
+                    args.audio_bitrate,
+                ):
+                    row = {"source": source, "size": size, "preset": name, "speed": speed}
+                    row |= bench_one(clip, preset, cfg, args.seconds, work)
+                    rows.append(row)
+                    ssim = f"{row['ssim']:.4f}" if row["ssim"] is not None else "-"
+                    psnr = f"{row['psnr']:.2f}" if row["psnr"] is not None else "-"
+                    line = (
+                        f"{source:<10} {size:<6} {name:<5} {speed:<7} {row['crf']:>3}"
+                        f" {row['fps']:>8.2f} {row['cpu_s_per_min']:>9.1f}"
+                        f" {row['kbps']:>9.1f} {ssim:>7} {psnr:>6}"
+                    )
+                    if row["ok"]:
+                        log.info(line)
+                    else:
+                        log.err(line)
+    finally:
+        if not args.work:
+            shutil.rmtree(work, ignore_errors=True)
+    if args.json:
+        args.json.write_text(json.dumps(rows, indent=2) + "\n")
+        log.ok(f"Wrote {args.json}")
+    if args.compare:
+        regressions = bench_regressions(
+            rows, json.loads(args.compare.read_text()), args.tolerance
+        )
+        for row, delta in regressions:
+            log.err(
+                f"Regression: {' '.join(str(k) for k in bench_key(row))} fps {delta:+.1%}"
+            )
+        if regressions:
+            return 1
+    return 0 if all(r["ok"] for r in rows) else 1
+
+
+def parse_args() -> tuple[argparse.Namespace, list[str]]:
+    p = argparse.ArgumentParser(
+        prog="vidconv",
+        description="Unified video/audio converter (Priority: av1→vp9→h265→x264)",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""Examples:
+  vidconv av1 *.mp4                      # Compress to AV1 (default: 1080p, denoise, deband)
+  vidconv av1 --max-dim 1280 720 *.mp4   # Limit to 720p
+  vidconv av1 -i /src -o /dst            # Directory mode, preserve structure
+  vidconv av1 --deinterlace bwdif old.avi  # Fix interlaced video
+  vidconv opus **/*.mp3 --in-place       # MP3→Opus, remove originals
+  vidconv vp9 --crf 30 video.mkv         # VP9 with custom CRF
+  vidconv bench --crf 24,30 --json b.json  # Benchmark presets on synthetic clips
+  vidconv bench walk --files 1000000     # Benchmark file discovery
+""",
+    )
+    p.add_argument("format", choices=list(PRESETS.keys()), help="Output format")
+    p.add_argument("files", nargs="*", help="Input files (glob patterns)")
+    p.add_argument(
+        "-i",
+        "--input-dir",
+        type=Path,
+        metavar="DIR",
+        help="Input directory (recursive)",
+    )
+    p.add_argument(
+        "-o", "--output-dir", type=Path, metavar="DIR", help="Output directory"
+    )
+    p.add_argument(
+        "-e", "--ext", help="Comma-separated format filters (e.g. mp4,mkv)"
+    )
+    p.add_argument("--crf", type=int, default=26, help="Video CRF (default: 26)")
+    p.add_argument(
+        "--preset", type=int, default=3, help="SVT-AV1/VP9 preset (default: 3)"
+    )
+    p.add_argument(
+        "--preset-name", default="slow", help="x264/x265 preset name (default: slow)"
+    )
+    p.add_argument("--grain", type=int, default=6, help="Film grain 0-50 (default: 6)")
+    p.add_argument(
+        "--audio-bitrate", default="128k", help="Audio bitrate (default: 128k)"
+    )
+    v = p.add_argument_group("video")
+    v.add_argument(
+        "--max-dim",
+        type=int,
+        nargs=2,
+        metavar=("W", "H"),
+        default=[1920, 1080],
+        help="Max dimensions (default: 1920 1080)",
+    )
+    v.add_argument(
+        "--pix-fmt", default="yuv420p10le", help="Pixel format (default: yuv420p10le)"
+    )
+    v.add_argument(
+        "--keyint", type=int, default=600, help="Keyframe interval (default: 600)"
+    )
+    v.add_argument(
+        "--fast-decode", action="store_true", help="Enable SVT-AV1 fast-decode"
+    )
+    v.add_argument("--no-denoise", action="store_true", help="Disable default denoise")
+    v.add_argument("--no-deband", action="store_true", help="Disable default deband")
+    v.add_argument(
+        "--no-auto-filters",
+        dest="auto_filters",
+        action="store_false",
+        help="Skip the per-file noise probe (3 short samples, cached);"
+        " always apply the default denoise/deband",
+    )
+    v.add_argument(
+        "--audio-channels", type=int, default=2, help="Audio channels (default: 2)"
+    )
+    c = p.add_argument_group("chunked encoding")
+    c.add_argument(
+        "--chunked",
+        action="store_true",
+        help="Split each video into chunks and encode them in parallel (needs ffprobe)",
+    )
+    c.add_argument(
+        "--chunk-split",
+        choices=["keyframes", "scenes"],
+        default="keyframes",
+        help="Split at existing keyframes or detected scene cuts (default: keyframes)",
+    )
+    c.add_argument(
+        "--chunk-len",
+        type=float,
+        default=60.0,
+        metavar="SEC",
+        help="Minimum chunk length in seconds (default: 60)",
+    )
+    c.add_argument(
+        "--chunk-jobs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Parallel chunk encodes per file (default: cores/8/jobs)",
+    )
+    t = p.add_argument_group("target quality")
+    goal = t.add_mutually_exclusive_group()
+    goal.add_argument(
+        "--target-ssim",
+        type=float,
+        metavar="X",
+        help="Pick the highest CRF whose sampled SSIM stays >= X (e.g. 0.98)",
+    )
+    goal.add_argument(
+        "--target-psnr",
+        type=float,
+        metavar="DB",
+        help="Pick the highest CRF whose sampled PSNR stays >= DB",
+    )
+    t.add_argument(
+        "--crf-range",
+        type=int,
+        nargs=2,
+        default=[18, 45],
+        metavar=("MIN", "MAX"),
+        help="CRF search bounds (default: 18 45)",
+    )
+    t.add_argument(
+        "--samples",
+        type=int,
+        default=3,
+        metavar="N",
+        help="Segments sampled per file for --target-*/--estimate (default: 3)",
+    )
+    t.add_argument(
+        "--sample-len",
+        type=float,
+        default=4.0,
+        metavar="SEC",
+        help="Length of each sampled segment (default: 4)",
+    )
+    f = p.add_argument_group("filters")
+    f.add_argument(
+        "--deinterlace",
+        choices=["off", "bwdif", "yadif", "decomb"],
+        help="Deinterlace filter",
+    )
+    f.add_argument(
+        "--denoise", choices=["off", "nlmeans", "hqdn3d"], help="Custom denoise filter"
+    )
+    f.add_argument(
+        "--denoise-strength",
+        choices=["ultralight", "light", "medium", "strong"],
+        default="light",
+    )
+    f.add_argument("--deblock", metavar="PARAMS", help='Deblock filter (e.g., "weak")')
+    f.add_argument(
+        "--rotate",
+        type=int,
+        choices=[0, 90, 180, 270],
+        default=0,
+        help="Rotate degrees",
+    )
+    f.add_argument("--crop", metavar="W:H:X:Y", help='Crop video (or "auto")')
+    f.add_argument("--scale", metavar="WxH", help='Scale video (e.g., "1920x1080")')
+    f.add_argument(
+        "--print-filtergraph",
+        action="store_true",
+        help="Print each file's planned filter chain and cost estimate, then exit",
+    )
+    p.add_argument(
+        "-I", "--in-place", "--delete", dest="in_place", action="store_true", help="Delete original after conversion"
+    )
+    p.add_argument(
+        "--abort-larger",
+        action="store_true",
+        help="Stop encodes projected to outgrow the input (implied by --in-place)",
+    )
+    p.add_argument(
+        "--abort-margin",
+        type=float,
+        default=5.0,
+        metavar="PCT",
+        help="How far the projection may exceed the input before stopping (default: 5)",
+    )
+    p.add_argument(
+        "--estimate",
+        type=parse_count,
+        nargs="?",
+        const=ESTIMATE_FILES,
+        metavar="N",
+        help=f"Sample-encode N random files (default {ESTIMATE_FILES}) and project"
+        " output size and time, then exit; see --samples/--sample-len",
+    )
+    p.add_argument(
+        "-n", "--dry-run", action="store_true", help="Print planned conversions without encoding"
+    )
+    p.add_argument(
+        "--scratch",
+        type=Path,
+        metavar="DIR",
+        help="Stage inputs and outputs on fast local storage (SSD/tmpfs)",
+    )
+    p.add_argument(
+        "--scratch-budget",
+        type=parse_size,
+        default=0,
+        metavar="SIZE",
+        help="Bytes of inputs staged at once, e.g. 20G (default: half of free space)",
+    )
+    p.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Encode identical inputs once and reflink/hardlink the result to every"
+        " target; reuses earlier outputs via the probe cache",
+    )
+    p.add_argument(
+        "--full-hash",
+        action="store_true",
+        help="With --dedup: hash whole inputs, not just size, head and tail",
+    )
+    p.add_argument(
+        "--watch",
+        action="store_true",
+        help="With --input-dir: keep running and convert files as they land (inotify)",
+    )
+    p.add_argument(
+        "--plan-out",
+        type=Path,
+        metavar="FILE",
+        help="Write the batch plan (input, output, action) as JSON",
+    )
+    p.add_argument(
+        "--plan-in",
+        type=Path,
+        metavar="FILE",
+        help="Run a plan saved with --plan-out instead of scanning for files",
+    )
+    p.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"Skip work the output dir's {JOURNAL_NAME} records as done"
+        f" (without -o: a journal per input root under {JOURNAL_DIR})",
+    )
+    p.add_argument(
+        "--overwrite", dest="skip_existing", action="store_false", help="Overwrite if output file already exists"
+    )
+    p.add_argument(
+        "--passthrough",
+        action="store_true",
+        help="Stream-copy video/audio already in the preset's codec and bitrate budget (needs ffprobe)",
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=parse_jobs,
+        default=1,
+        help="Number of parallel jobs, or 'auto' to size by core count (default: 1)",
+    )
+    p.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Job orchestrator; 'asyncio' scales to huge batches of short jobs",
+    )
+    p.add_argument(
+        "--batch",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Audio presets: encode up to N files per ffmpeg process (default: 1)",
+    )
+    p.add_argument(
+        "--order",
+        choices=["discovery", "longest"],
+        default="discovery",
+        help="Dispatch order; 'longest' starts the most expensive files first",
+    )
+    p.add_argument(
+        "--lookahead",
+        type=int,
+        default=512,
+        metavar="N",
+        help="Files buffered for --order longest when streaming (default: 512)",
+    )
+    p.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Encoder threads per job (default: cores/jobs when -j > 1)",
+    )
+    p.add_argument(
+        "--pin", action="store_true", help="Pin each parallel job to its own CPU set"
+    )
+    p.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Grow/shrink running jobs between --min-jobs and -j by PSI and loadavg",
+    )
+    p.add_argument(
+        "--min-jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Lower bound for --adaptive (default: 1)",
+    )
+    p.add_argument(
+        "--mem-budget",
+        type=parse_size,
+        default=0,
+        metavar="SIZE",
+        help="Only start encodes while their estimated memory fits, e.g. 24G",
+    )
+    p.add_argument(
+        "--idle",
+        action="store_true",
+        help="Run encoders under SCHED_IDLE with idle-class I/O priority",
+    )
+    p.add_argument(
+        "--metrics-out",
+        type=Path,
+        metavar="FILE",
+        help="Append per-file encode telemetry (.csv for CSV, otherwise JSONL)",
+    )
+    p.add_argument(
+        "--probe-cache",
+        type=Path,
+        default=PROBE_CACHE,
+        metavar="FILE",
+        help=f"ffprobe metadata cache (default: {PROBE_CACHE})",
+    )
+    p.add_argument(
+        "--no-probe",
+        dest="probe_cache",
+        action="store_const",
+        const=None,
+        help="Do not probe inputs with ffprobe",
+    )
+    p.add_argument("--quiet", action="store_true", help="Suppress progress output")
+    p.add_argument(
+        "--silent", action="store_true", help="Suppress all output except errors"
+    )
+    return p.parse_known_args()
+
+
+def main() -> int:
+    if sys.argv[1:2] == ["bench"]:
+        return bench_main(sys.argv[2:])
+    args, extra = parse_args()
+    log = Log(args.quiet, args.silent)
+    if args.input_dir and args.files:
+        log.err("Cannot use both --input-dir and file arguments")
+        return 1
+    if (args.input_dir or args.files) and args.plan_in:
+        log.err("--plan-in replaces --input-dir and file arguments")
+        return 1
+    if not args.input_dir and not args.files and not args.plan_in:
+        log.err("Provide files, --input-dir or --plan-in")
+        return 1
+    if args.input_dir and not args.output_dir:
+        log.err("--output-dir required with --input-dir")
+        return 1
+    if args.watch and not args.input_dir:
+        log.err("--watch requires --input-dir")
+        return 1
+    if not has("ffmpeg"):
+        log.err("Missing: ffmpeg")
+        return 1
+    preset = PRESETS[args.format]
+    if args.idle:
+        set_idle_priority(log)
+    cores = len(available_cpus())
+    jobs = args.jobs or auto_jobs(preset, cores)
+    chunk_jobs = 1
+    if args.chunked:
+        chunk_jobs = args.chunk_jobs or max(1, auto_jobs(preset, cores) // jobs)
+    workers = jobs * chunk_jobs
+    threads = args.threads or (max(1, cores // workers) if workers > 1 else 0)
+    cfg = Config(
+        crf=args.crf,
+        preset=args.preset,
+        preset_name=args.preset_name,
+        grain=args.grain,
+        audio_bitrate=args.audio_bitrate,
+        audio_channels=args.audio_channels,
+        max_dim=tuple(args.max_dim),
+        pix_fmt=args.pix_fmt,
+        keyint=args.keyint,
+        fast_decode=args.fast_decode,
+        default_denoise=not args.no_denoise,
+        default_deband=not args.no_deband,
+        auto_filters=args.auto_filters,
+        engine=args.engine,
+        batch=args.batch,
+        deinterlace=args.deinterlace,
+        denoise=args.denoise,
+        denoise_strength=args.denoise_strength,
+        deblock=args.deblock,
+        rotate=args.rotate,
+        crop=args.crop,
+        scale=args.scale,
+        extra=extra,
+        dry_run=args.dry_run,
+        skip_existing=args.skip_existing,
+        in_place=args.in_place,
+        abort_larger=args.abort_larger,
+        abort_margin=max(0.0, args.abort_margin) / 100,
+        probe_cache=args.probe_cache,
+        passthrough=args.passthrough,
+        threads=threads if preset.is_video else 0,
+        pin=args.pin,
+        order=args.order,
+        lookahead=max(1, args.lookahead),
+        chunked=args.chunked,
+        chunk_split=args.chunk_split,
+        chunk_len=args.chunk_len,
+        chunk_jobs=chunk_jobs,
+        resume=args.resume,
+        metrics_out=args.metrics_out,
+        target_ssim=args.target_ssim,
+        target_psnr=args.target_psnr,
+        crf_range=(min(args.crf_range), max(args.crf_range)),
+        samples=max(1, args.samples),
+        sample_len=args.sample_len,
+        plan_out=args.plan_out,
+        adaptive=args.adaptive,
+        min_jobs=args.min_jobs,
+        mem_budget=args.mem_budget,
+        scratch=args.scratch,
+        scratch_budget=args.scratch_budget,
+        dedup=args.dedup or args.full_hash,
+        full_hash=args.full_hash,
+    )
+    if args.plan_in:
+        try:
+            doc = read_plan(args.plan_in)
+        except (OSError, ValueError) as e:
+            log.err(f"Cannot read plan {args.plan_in}: {e}")
+            return 1
+        if doc["preset"] != preset.name:
+            log.err(f"Plan is for {doc['preset']}, not {preset.name}")
+            return 1
+        pairs = [
+            (Path(i["input"]), Path(i["output"]))
+            for i in doc["items"]
+            if i["action"] == "encode"
+        ]
+        out_dir = Path(doc["out_dir"]) if doc["out_dir"] else None
+        src_root = Path(doc["src_root"]) if doc["src_root"] else None
+        stats = run_batch([], preset, cfg, log, out_dir, src_root, jobs, pairs)
+        print_summary(stats, log)
+        return 1 if stats.failed else 0
+
+    if preset.is_video:
+        exts = VIDEO_EXTS
+    else:
+        exts = AUDIO_EXTS | PASSTHROUGH_EXTS
+
+    if args.ext:
+        allowed = {f".{e.strip().lstrip('.')}" for e in args.ext.lower().split(",")}
+        exts = exts & allowed
+
+    walk = WalkStats()
+    if args.input_dir:
+        src_root = args.input_dir.resolve()
+        if not src_root.exists():
+            log.err(f"Source directory does not exist: {src_root}")
+            return 1
+        out_dir = args.output_dir.resolve()
+        if args.format == "opus":
+            exts = exts - PASSTHROUGH_EXTS
+        if args.watch:
+            files = Watcher(src_root, exts, exclude=out_dir)
+        else:
+            files = find_files(src_root, exts, walk)
+    else:
+        src_root = None
+
+        def get_files():
+            import glob
+
+            for pat in args.files:
+                for p in glob.iglob(str(Path(pat).expanduser()), recursive=True):
+                    path = Path(p)
+                    if path.is_file() and path.suffix.lower() in exts:
+                        if (
+                            args.format == "opus"
+                            and path.suffix.lower() in PASSTHROUGH_EXTS
+                        ):
+                            continue
+                        yield path
+
+        files = get_files()
+        out_dir = args.output_dir.resolve() if args.output_dir else None
+
+    if args.watch:
+        stats = run_watch(files, preset, cfg, log, out_dir, src_root, jobs)
+        print_summary(stats, log)
+        return 1 if stats.failed else 0
+    files_iter = iter(files)
+    try:
+        first = next(files_iter)
+        files = itertools.chain([first], files_iter)
+    except StopIteration:
+        log.warn("No files found")
+        return 0
+    if args.print_filtergraph:
+        return print_filtergraphs(files, preset, cfg, log, walk)
+    if args.estimate is not None:
+        return estimate_batch(
+            files, preset, cfg, log, out_dir, src_root, jobs, args.estimate, walk
+        )
+    stats = run_batch(files, preset, cfg, log, out_dir, src_root, jobs, walk=walk)
+    print_summary(stats, log)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
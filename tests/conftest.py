@@ -0,0 +1,30 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+# Load vidconv.py once as the "vidconv" module; test files just `import vidconv`
+spec = importlib.util.spec_from_file_location(
+    "vidconv", Path(__file__).resolve().parents[1] / "Home/.local/bin/vidconv.py"
+)
+vidconv = importlib.util.module_from_spec(spec)
+sys.modules["vidconv"] = vidconv
+spec.loader.exec_module(vidconv)
+
+
+@pytest.fixture
+def make_files(tmp_path):
+    # Input files under tmp_path/src, created with their parent directories
+    def make(names, size=1):
+        src = tmp_path / "src"
+        src.mkdir(exist_ok=True)
+        files = []
+        for n in names:
+            f = src / n
+            f.parent.mkdir(parents=True, exist_ok=True)
+            f.write_bytes(b"x" * size)
+            files.append(f)
+        return src, files
+
+    return make
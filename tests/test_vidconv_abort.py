@@ -0,0 +1,88 @@
+import sys
+import time
+
+import vidconv
+
+# Emits a -progress block per "second" of output, growing 2000 bytes each,
+# then idles as if the encode had hours left
+GROWING = (
+    "import sys, time\n"
+    "for i in range(1, 400):\n"
+    "    print(f'frame={i}\\nout_time_us={i * 1_000_000}\\ntotal_size={i * 2000}\\nprogress=continue', flush=True)\n"
+    "time.sleep(30)\n"
+)
+
+
+def _probe(duration=600.0):
+    return vidconv.Probe(duration, 1000, 0, "matroska", [])
+
+
+def test_size_guard_waits_for_warmup_then_projects():
+    guard = vidconv.SizeGuard(limit=1_000_000, duration=600.0, warmup=60.0)
+    assert not guard({"out_time_us": "30000000", "total_size": "900000"})
+    assert not guard({"out_time_us": "60000000", "total_size": "90000"})
+    assert guard.projected == 900_000
+    assert guard({"out_time_us": "120000000", "total_size": "300000"})
+
+
+def test_size_guard_only_when_enabled(tmp_path):
+    f = tmp_path / "a.mkv"
+    f.write_bytes(b"x" * 1000)
+    assert vidconv.size_guard(f, vidconv.Config(), _probe()) is None
+    guard = vidconv.size_guard(f, vidconv.Config(in_place=True), _probe())
+    assert guard.limit == 1050 and guard.warmup == 60.0
+    # Too short to project: warm-up would cover the whole file
+    assert vidconv.size_guard(f, vidconv.Config(abort_larger=True), _probe(20.0)) is None
+
+
+def test_run_cmd_stops_when_hook_asks():
+    calls = []
+
+    def hook(fields):
+        calls.append(fields)
+        return len(calls) == 3
+
+    start = time.monotonic()
+    res = vidconv.run_cmd([sys.executable, "-c", GROWING], True, on_progress=hook)
+    assert not res
+    assert time.monotonic() - start < 10
+
+
+def test_incompressible_is_stopped_remembered_and_skipped(tmp_path, monkeypatch):
+    inp = tmp_path / "a.mp4"
+    inp.write_bytes(b"x" * 100_000)  # 600s at 2000 B/s projects to 1.2MB
+    monkeypatch.setattr(vidconv, "has", lambda tool: False)
+    monkeypatch.setattr(
+        vidconv, "ffmpeg_cmd", lambda *a, **k: [sys.executable, "-c", GROWING]
+    )
+    cache = vidconv.ProbeCache(tmp_path / "c.sqlite")
+    rt = vidconv.Runtime(probes=cache)
+    cfg = vidconv.Config(in_place=True)
+    log = vidconv.Log(quiet=True)
+    args = (vidconv.PRESETS["av1"], cfg, tmp_path / "out", tmp_path, log)
+    stats, msg = vidconv.process_item(inp, *args, _probe(), rt)
+    assert (stats.skipped, stats.failed) == (1, 0)
+    assert "incompressible" in msg and inp.exists()
+    stats, msg = vidconv.process_item(inp, *args, _probe(), rt)
+    assert msg == f"Skipped (incompressible): {inp.name}"
+    # A changed file gets another try
+    inp.write_bytes(b"y" * 200_000)
+    assert not vidconv.known_incompressible(inp, vidconv.PRESETS["av1"], cfg, rt)
+    cache.close()
+
+
+def test_guarded_encodes_skip_ffzap(tmp_path, monkeypatch):
+    inp = tmp_path / "a.mp4"
+    inp.write_bytes(b"x" * 100_000)
+    tools = []
+
+    def fake_run(inp, out, params, quiet, use_ffzap, *a, **k):
+        tools.append(use_ffzap)
+        return vidconv.RunResult(True)
+
+    monkeypatch.setattr(vidconv, "has", lambda tool: tool == "ffzap")
+    monkeypatch.setattr(vidconv, "run_ffmpeg", fake_run)
+    log = vidconv.Log(quiet=True)
+    for cfg in (vidconv.Config(abort_larger=True), vidconv.Config()):
+        vidconv.convert(inp, tmp_path / "o.mkv", vidconv.PRESETS["av1"], cfg, log, probe=_probe())
+    assert tools == [False, True]
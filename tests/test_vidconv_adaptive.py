@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import time
+
+import vidconv
+
+
+def _sample(load=2.0, cpus=16, **pressure):
+    return vidconv.LoadSample(load, cpus, pressure)
+
+
+def test_read_psi(tmp_path, monkeypatch):
+    text = (
+        "some avg10=12.50 avg60=3.00 avg300=1.00 total=123\n"
+        "full avg10=4.25 avg60=1.00 avg300=0.50 total=45\n"
+    )
+    real = vidconv.Path.read_text
+    monkeypatch.setattr(
+        vidconv.Path,
+        "read_text",
+        lambda self, *a, **k: text if str(self) == "/proc/pressure/memory" else real(self, *a, **k),
+    )
+    assert vidconv.read_psi("memory") == {"some": 12.5, "full": 4.25}
+
+
+def test_adapt_step_shrinks_on_pressure_and_grows_when_calm():
+    step = vidconv.adapt_step
+    assert step(4, 1, 8, _sample(cpu=5.0, memory=9.0, io=0.0), 2) == (3, "pressure: memory")
+    assert step(4, 1, 8, _sample(load=30.0), 2)[0] == 3
+    assert step(1, 1, 8, _sample(io=50.0), 2) == (1, "")
+    assert step(4, 1, 8, _sample(cpu=1.0, memory=0.0, io=0.0), 2) == (5, "idle capacity")
+    # Calm PSI but no free cores for another job: hold
+    assert step(4, 1, 8, _sample(load=15.0, cpu=1.0), 2) == (4, "")
+    # Between thresholds: hold
+    assert step(4, 1, 8, _sample(cpu=30.0), 2) == (4, "")
+    assert step(8, 1, 8, _sample(), 2) == (8, "")
+
+
+def test_initial_jobs_fits_free_cores():
+    assert vidconv.initial_jobs(1, 8, _sample(load=10.0, cpus=16), 2) == 3
+    assert vidconv.initial_jobs(2, 8, _sample(load=20.0, cpus=16), 2) == 2
+    assert vidconv.initial_jobs(1, 4, _sample(load=0.0, cpus=64), 2) == 4
+
+
+def test_gate_tracks_limit_changes():
+    gate = vidconv.Gate(1)
+    peak, running = [0], [0]
+    lock = threading.Lock()
+
+    def job():
+        with gate.slot():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=job) for _ in range(6)]
+    for t in threads:
+        t.start()
+    time.sleep(0.02)
+    gate.set_limit(3)
+    for t in threads:
+        t.join()
+    assert peak[0] == 3 and gate.active == 0
+
+
+def test_gate_async_waiters_wake_on_release():
+    gate = vidconv.Gate(2)
+    peak = [0]
+
+    async def job():
+        async with gate.slot_async():
+            peak[0] = max(peak[0], gate.active)
+            await asyncio.sleep(0.02)
+
+    async def main():
+        await asyncio.gather(*(job() for _ in range(7)))
+
+    asyncio.run(main())
+    assert peak[0] == 2 and gate.active == 0
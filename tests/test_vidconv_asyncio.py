@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+import time
+
+import vidconv
+
+
+def test_run_cmd_async_progress_stderr_and_rusage():
+    script = (
+        "import sys\n"
+        "x = sum(range(3_000_000))\n"
+        "for i in range(1, 4): print(f'frame={i * 10}\\nprogress=continue', flush=True)\n"
+        "print('boom', file=sys.stderr)\n"
+        "sys.exit(3)\n"
+    )
+    seen = []
+    res = asyncio.run(
+        vidconv.run_cmd_async(
+            [sys.executable, "-c", script], True, on_progress=lambda f: seen.append(f)
+        )
+    )
+    assert not res and res.returncode == 3
+    assert res.frames == 30 and len(seen) == 3
+    assert res.stderr == "boom\n"
+    assert res.utime > 0 and res.maxrss > 0
+
+
+def test_cancel_kills_process_group(tmp_path):
+    pidfile = tmp_path / "child.pid"
+    script = (
+        "import subprocess, sys, time\n"
+        "p = subprocess.Popen(['sleep', '30'])\n"
+        f"open({str(pidfile)!r}, 'w').write(str(p.pid))\n"
+        "time.sleep(30)\n"
+    )
+
+    async def run():
+        task = asyncio.create_task(
+            vidconv.run_cmd_async([sys.executable, "-c", script], True)
+        )
+        while not pidfile.exists() or not pidfile.read_text():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    start = time.monotonic()
+    assert asyncio.run(run())
+    assert time.monotonic() - start < 5
+    child = int(pidfile.read_text())
+    # The grandchild got the group signal too (it is reaped by init, so poll)
+    for _ in range(50):
+        try:
+            os.kill(child, 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.05)
+    else:
+        raise AssertionError("grandchild survived")
+
+
+def test_run_items_async_batch(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    files = []
+    for i in range(20):
+        f = src / f"t{i}.mp3"
+        f.write_bytes(b"x" * 10)
+        files.append(f)
+    writer = "import sys; open(sys.argv[1], 'wb').write(b'o')"
+    monkeypatch.setattr(
+        vidconv,
+        "ffmpeg_cmd",
+        lambda inp, out, *a, **k: [sys.executable, "-c", writer, str(out)],
+    )
+    monkeypatch.setattr(vidconv, "has", lambda tool: False)
+    out_dir = tmp_path / "out"
+    stats = vidconv._run_items_async(
+        ((f, None) for f in files),
+        len(files),
+        vidconv.PRESETS["opus"],
+        vidconv.Config(engine="asyncio"),
+        vidconv.Log(quiet=True),
+        out_dir,
+        src,
+        4,
+        vidconv.Runtime(),
+    )
+    assert stats.processed == 20 and stats.failed == 0
+    assert len(list(out_dir.glob("*.opus"))) == 20
+    assert not list(out_dir.glob(".*part*"))
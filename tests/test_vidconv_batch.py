@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import vidconv
+
+OPUS = vidconv.PRESETS["opus"]
+
+
+def test_batch_cmd_pairs_inputs_with_outputs(tmp_path):
+    jobs = [
+        vidconv.Job(Path("a.mp3"), tmp_path / "a.opus", vidconv.Config()),
+        vidconv.Job(Path("b.mp3"), tmp_path / "b.opus", vidconv.Config()),
+    ]
+    cmd = vidconv.batch_cmd(jobs, OPUS, True)
+    assert [cmd[i + 1] for i, a in enumerate(cmd) if a == "-i"] == ["a.mp3", "b.mp3"]
+    second = cmd.index("1:a:0")
+    assert cmd[second + 1 : second + 5] == ["-map_metadata", "1", "-map_chapters", "1"]
+    assert cmd[-1] == str(tmp_path / ".b.part.opus")
+    assert cmd.count("libopus") == 2
+
+
+def test_batch_size_only_for_audio():
+    cfg = vidconv.Config(batch=16)
+    assert vidconv.batch_size(OPUS, cfg) == 16
+    assert vidconv.batch_size(vidconv.PRESETS["av1"], cfg) == 1
+
+
+def test_process_batch_one_ffmpeg_per_batch(tmp_path, monkeypatch, make_files):
+    src, files = make_files(["a.mp3", "b.mp3", "c.mp3"], 100)
+    unit = [(f, None) for f in files]
+    calls = []
+
+    def fake_run(cmd, quiet, cpus=None, on_progress=None, echo=None):
+        calls.append(cmd)
+        for a in cmd:
+            if ".part." in a:
+                Path(a).write_bytes(b"y" * 10)
+        return vidconv.RunResult(True, wall=3.0, utime=6.0)
+
+    monkeypatch.setattr(vidconv, "run_cmd", fake_run)
+    out = tmp_path / "out"
+    results = vidconv.process_batch(
+        unit, OPUS, vidconv.Config(batch=8), out, src, vidconv.Log(quiet=True)
+    )
+    assert len(calls) == 1
+    assert [s.processed for s, _ in results] == [1, 1, 1]
+    assert all(s.output_bytes == 10 for s, _ in results)
+    assert sorted(p.name for p in out.iterdir()) == ["a.128k.opus", "b.128k.opus", "c.128k.opus"]
+
+
+def test_process_batch_falls_back_to_single_files(tmp_path, monkeypatch, make_files):
+    src, files = make_files(["a.mp3", "bad.mp3"], 100)
+    unit = [(f, None) for f in files]
+    monkeypatch.setattr(
+        vidconv,
+        "run_cmd",
+        lambda *a, **k: vidconv.RunResult(False, returncode=1, stderr="corrupt"),
+    )
+    singles = []
+
+    def fake_convert(inp, out, *args, **kwargs):
+        singles.append(inp.name)
+        if "bad" in inp.name:
+            return vidconv.RunResult(False, reason="input corrupt")
+        out.write_bytes(b"y")
+        return vidconv.RunResult(True)
+
+    monkeypatch.setattr(vidconv, "convert", fake_convert)
+    out = tmp_path / "out"
+    results = vidconv.process_batch(
+        unit, OPUS, vidconv.Config(batch=8), out, src, vidconv.Log(quiet=True)
+    )
+    assert singles == ["a.mp3", "bad.mp3"]
+    assert [(s.processed, s.failed) for s, _ in results] == [(1, 0), (0, 1)]
+    assert not list(out.glob(".*part*"))
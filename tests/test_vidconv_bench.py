@@ -0,0 +1,47 @@
+
+import vidconv
+
+PRESETS = vidconv.PRESETS
+
+
+def _grid(name):
+    return [
+        (speed, cfg.crf, cfg.preset, cfg.preset_name)
+        for speed, cfg in vidconv.bench_configs(
+            PRESETS[name], [24, 30], [4, 8], ["fast"], "96k"
+        )
+    ]
+
+
+def test_bench_configs_numeric_presets():
+    assert _grid("av1") == [
+        ("4", 24, 4, "slow"),
+        ("8", 24, 8, "slow"),
+        ("4", 30, 4, "slow"),
+        ("8", 30, 8, "slow"),
+    ]
+
+
+def test_bench_configs_named_presets():
+    assert [g[:2] for g in _grid("x264")] == [("fast", 24), ("fast", 30)]
+
+
+def test_bench_configs_audio_preset():
+    [(speed, cfg)] = vidconv.bench_configs(PRESETS["opus"], [24], [4], ["fast"], "96k")
+    assert speed == "96k" and cfg.audio_bitrate == "96k"
+
+
+def test_bench_regressions():
+    base = [
+        {"source": "noise", "size": "720p", "preset": "av1", "speed": "6", "crf": 26, "fps": 100.0},
+        {"source": "noise", "size": "720p", "preset": "vp9", "speed": "6", "crf": 26, "fps": 50.0},
+    ]
+    rows = [
+        dict(base[0], fps=80.0),
+        dict(base[1], fps=47.0),
+        dict(base[1], crf=30, fps=1.0),
+    ]
+    found = vidconv.bench_regressions(rows, base, 0.1)
+    assert len(found) == 1
+    assert found[0][0]["preset"] == "av1"
+    assert round(found[0][1], 2) == -0.2
@@ -0,0 +1,124 @@
+from pathlib import Path
+
+import vidconv
+
+Config = vidconv.Config
+PRESETS = vidconv.PRESETS
+
+
+def _probe(duration):
+    v = vidconv.Stream(0, "video", "h264", 1920, 1080, 24.0)
+    return vidconv.Probe(duration, 0, 0, "matroska", (v,))
+
+
+def test_split_chunks_respects_min_len():
+    points = [float(t) for t in range(5, 120, 5)]
+    chunks = vidconv.split_chunks(points, 120.0, 30.0)
+    assert chunks == [(0.0, 30.0), (30.0, 60.0), (60.0, 90.0), (90.0, 120.0)]
+
+
+def test_split_chunks_no_sliver_tail():
+    chunks = vidconv.split_chunks([30.0, 61.0], 65.0, 30.0)
+    # A cut at 61s would leave a 4s tail, so the last chunk absorbs it
+    assert chunks == [(0.0, 30.0), (30.0, 65.0)]
+
+
+def test_split_chunks_without_points():
+    assert vidconv.split_chunks([], 10.0, 60.0) == [(0.0, 10.0)]
+
+
+def test_plan_chunks_needs_flag_and_long_video(monkeypatch):
+    monkeypatch.setattr(vidconv, "keyframe_times", lambda inp: [60.0, 120.0])
+    cfg = Config(chunked=True, chunk_len=60.0)
+    assert vidconv.plan_chunks(Path("a"), PRESETS["av1"], Config(), _probe(180), None) == []
+    assert vidconv.plan_chunks(Path("a"), PRESETS["av1"], cfg, _probe(100), None) == []
+    assert vidconv.plan_chunks(Path("a"), PRESETS["opus"], cfg, _probe(180), None) == []
+    copy = vidconv.StreamPlan(video="copy")
+    assert vidconv.plan_chunks(Path("a"), PRESETS["av1"], cfg, _probe(180), copy) == []
+    assert len(vidconv.plan_chunks(Path("a"), PRESETS["av1"], cfg, _probe(180), None)) == 3
+
+
+def test_build_params_drop_audio():
+    plan = vidconv.StreamPlan(video="encode", audio="drop")
+    params = vidconv.build_params(PRESETS["av1"], Config(), plan)
+    assert "-c:a" not in params and "-b:a" not in params
+    assert "-an" in params
+    assert "libsvtav1" in params
+
+
+def test_build_params_copy_video_drop_audio():
+    plan = vidconv.StreamPlan(video="copy", audio="drop")
+    params = vidconv.build_params(PRESETS["av1"], Config(), plan)
+    assert params[params.index("-c:v") + 1] == "copy"
+    assert "-an" in params
+
+
+def test_keyframes_relative_to_first_packet(monkeypatch):
+    out = "10.500000,K__\n10.541667,___\nN/A,___\n70.500000,K__\n130.5,K__\n"
+    monkeypatch.setattr(
+        vidconv.subprocess, "run", lambda *a, **k: vidconv.subprocess.CompletedProcess(a, 0, out, "")
+    )
+    assert vidconv.keyframe_times(Path("a")) == [60.0, 120.0]
+
+
+def test_scene_cuts_snap_to_keyframes(monkeypatch):
+    monkeypatch.setattr(vidconv, "keyframe_times", lambda inp: [59.5, 61.0, 125.0])
+    monkeypatch.setattr(vidconv, "scene_times", lambda inp: [60.2, 119.9, 170.0])
+    cfg = Config(chunked=True, chunk_len=60.0, chunk_split="scenes")
+    chunks = vidconv.plan_chunks(Path("a"), PRESETS["av1"], cfg, _probe(200), None)
+    assert chunks == [(0.0, 61.0), (61.0, 125.0), (125.0, 200.0)]
+    monkeypatch.setattr(vidconv, "keyframe_times", lambda inp: [])
+    assert vidconv.plan_chunks(Path("a"), PRESETS["av1"], cfg, _probe(200), None) == []
+
+
+def test_chunked_maps_match_ffmpegs_own_pick(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_ffmpeg(inp, out, opts, *args):
+        calls.append(opts)
+        out.write_bytes(b"v")
+        return vidconv.RunResult(True)
+
+    muxes = []
+    monkeypatch.setattr(vidconv, "run_ffmpeg", fake_ffmpeg)
+    monkeypatch.setattr(vidconv, "run_cmd", lambda cmd, *a, **k: muxes.append(cmd) or vidconv.RunResult(True))
+    # Cover art first, then the film, a stereo and a 5.1 track
+    streams = (
+        vidconv.Stream(0, "image", "mjpeg", 600, 600),
+        vidconv.Stream(1, "video", "h264", 1920, 1080, 25.0),
+        vidconv.Stream(2, "audio", "aac", channels=2),
+        vidconv.Stream(3, "audio", "ac3", channels=6),
+    )
+    probe = vidconv.Probe(120.0, 0, 0, "matroska", streams)
+    chunks = [(0.0, 60.0), (60.0, 120.0)]
+    res = vidconv.encode_chunks(
+        tmp_path / "in.mkv", tmp_path / "out.mkv", PRESETS["av1"], Config(), chunks, None,
+        vidconv.Log(quiet=True), probe=probe,
+    )
+    assert res.ok
+    first, last = calls
+    assert first[:4] == ["-map", "0:1", "-t", "59.980000"] and "-t" not in last
+    assert first.count("-map") == 1 and "-an" in first
+    (cmd,) = muxes
+    maps = [cmd[i + 1] for i, v in enumerate(cmd) if v == "-map"]
+    assert maps == ["0:v:0", "1:3"]
+
+
+def test_unchunked_params_leave_stream_choice_to_ffmpeg():
+    for plan in (None, vidconv.StreamPlan(video="encode", audio="encode")):
+        assert "-map" not in vidconv.build_params(PRESETS["av1"], Config(), plan)
+    assert vidconv.default_streams(None) == ("v:0", "a:0?")
+
+
+def test_chunked_convert_does_not_multiply_retries(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(vidconv, "plan_chunks", lambda *a: [(0.0, 60.0), (60.0, 120.0)])
+    monkeypatch.setattr(
+        vidconv, "encode_chunks", lambda *a: calls.append(a) or vidconv.RunResult(False, reason="x")
+    )
+    inp = tmp_path / "in.mkv"
+    inp.write_bytes(b"x")
+    res = vidconv.convert(
+        inp, tmp_path / "out.mkv", PRESETS["av1"], Config(chunked=True), vidconv.Log(quiet=True)
+    )
+    assert not res.ok and len(calls) == 1
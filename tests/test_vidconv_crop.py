@@ -0,0 +1,89 @@
+import subprocess
+from pathlib import Path
+
+import vidconv
+
+
+def _probe(w=1920, h=1080, duration=600.0):
+    v = vidconv.Stream(0, "video", "h264", w, h, 24.0, 0, 0, "yuv420p", "")
+    return vidconv.Probe(duration, 1000, 0, "matroska", [v])
+
+
+def test_stable_crop_takes_union_of_samples():
+    rects = [(1920, 800, 0, 140), (1920, 804, 0, 138), (1800, 700, 60, 190)]
+    assert vidconv.stable_crop(rects, 1920, 1080) == "1920:804:0:138"
+
+
+def test_stable_crop_ignores_full_frame_and_empty():
+    assert vidconv.stable_crop([(1916, 1076, 2, 2)], 1920, 1080) == ""
+    assert vidconv.stable_crop([], 1920, 1080) == ""
+    # Odd sizes are trimmed for 4:2:0
+    assert vidconv.stable_crop([(1441, 1081, 0, 0)], 1920, 1080) == "1440:1080:0:0"
+
+
+def test_crop_sample_parses_last_suggestion(monkeypatch):
+    stderr = (
+        "[Parsed_cropdetect_0] x1:0 crop=-1920:-1072:1920:1076\n"
+        "[Parsed_cropdetect_0] x1:0 crop=1920:816:0:132\n"
+        "[Parsed_cropdetect_0] x1:0 crop=1920:800:0:140\n"
+    )
+    seen = []
+
+    def fake_run(cmd, **kw):
+        seen.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, "", stderr)
+
+    monkeypatch.setattr(vidconv.subprocess, "run", fake_run)
+    assert vidconv.crop_sample(Path("a.mkv"), 12.5, 90) == (1920, 800, 0, 140)
+    vf = seen[0][seen[0].index("-vf") + 1]
+    assert vf == "transpose=1,cropdetect=24:2:0"
+    assert seen[0][seen[0].index("-ss") + 1] == "12.500"
+
+
+def test_auto_crop_cached_and_applied(tmp_path, monkeypatch):
+    inp = tmp_path / "a.mkv"
+    inp.write_bytes(b"x")
+    starts = []
+
+    def fake_sample(path, start, rotate=0):
+        starts.append(start)
+        return (1920, 800, 0, 140)
+
+    monkeypatch.setattr(vidconv, "crop_sample", fake_sample)
+    cache = vidconv.ProbeCache(tmp_path / "c.sqlite")
+    rt = vidconv.Runtime(probes=cache)
+    cfg = vidconv.Config(crop="auto")
+    log = vidconv.Log(quiet=True)
+    assert vidconv.auto_crop(inp, cfg, log, _probe(), rt) == "1920:800:0:140"
+    assert len(starts) == vidconv.CROP_SAMPLES
+    assert vidconv.auto_crop(inp, cfg, log, _probe(), rt) == "1920:800:0:140"
+    assert len(starts) == vidconv.CROP_SAMPLES
+    cache.close()
+
+    filters = vidconv.build_filters(
+        vidconv.Config(crop="1920:800:0:140", max_dim=(1280, 720)), True
+    )
+    assert filters.index("crop=1920:800:0:140") < next(
+        i for i, f in enumerate(filters) if f.startswith("scale=")
+    )
+
+
+def test_auto_crop_noop_cases():
+    log = vidconv.Log(quiet=True)
+    assert vidconv.auto_crop(Path("a"), vidconv.Config(), log, _probe()) is None
+    assert vidconv.auto_crop(Path("a"), vidconv.Config(crop="auto"), log, None) is None
+
+
+def test_failed_detection_is_not_cached(tmp_path, monkeypatch):
+    inp = tmp_path / "a.mkv"
+    inp.write_bytes(b"x")
+    results = iter([None] * vidconv.CROP_SAMPLES + [(1920, 800, 0, 140)] * vidconv.CROP_SAMPLES)
+    monkeypatch.setattr(vidconv, "crop_sample", lambda *a, **k: next(results))
+    cache = vidconv.ProbeCache(tmp_path / "c.sqlite")
+    rt = vidconv.Runtime(probes=cache)
+    cfg = vidconv.Config(crop="auto")
+    log = vidconv.Log(quiet=True)
+    assert vidconv.auto_crop(inp, cfg, log, _probe(), rt) == "off"
+    # The next run detects again instead of trusting the failure
+    assert vidconv.auto_crop(inp, cfg, log, _probe(), rt) == "1920:800:0:140"
+    cache.close()
@@ -0,0 +1,181 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import vidconv
+
+AV1 = vidconv.PRESETS["av1"]
+CHUNK = vidconv.HASH_CHUNK
+
+
+def test_content_hash_partial_and_full(tmp_path):
+    body = bytearray(b"a" * (3 * CHUNK))
+    a, b = tmp_path / "a.mkv", tmp_path / "b.mkv"
+    a.write_bytes(body)
+    body[CHUNK + 10] = ord("b")  # middle differs
+    b.write_bytes(body)
+    assert vidconv.content_hash(a) == vidconv.content_hash(b)
+    assert vidconv.content_hash(a, True) != vidconv.content_hash(b, True)
+    body[-1] = ord("c")  # tail differs
+    b.write_bytes(body)
+    assert vidconv.content_hash(a) != vidconv.content_hash(b)
+    b.write_bytes(bytes(body[:-1]))
+    assert vidconv.content_hash(a) != vidconv.content_hash(b)
+
+
+def test_encode_key_follows_params(tmp_path):
+    a, b = tmp_path / "a.mkv", tmp_path / "sub.mkv"
+    a.write_bytes(b"x" * 100)
+    b.write_bytes(b"x" * 100)
+    rt = vidconv.Runtime(encodes=vidconv.EncodeCache(None))
+    cfg = vidconv.Config()
+    key = vidconv.encode_key(a, AV1, cfg, None, rt)
+    assert key == vidconv.encode_key(b, AV1, cfg, None, rt)
+    assert key != vidconv.encode_key(a, AV1, vidconv.Config(crf=30), None, rt)
+    assert key != vidconv.encode_key(a, AV1, vidconv.Config(full_hash=True), None, rt)
+    assert vidconv.encode_key(a, AV1, cfg, None, vidconv.Runtime()) is None
+
+
+def test_claim_settle_and_stale_outputs(tmp_path):
+    cache = vidconv.EncodeCache(None)
+    assert cache.claim("k") is None
+    fut = cache.claim("k")
+    assert isinstance(fut, Future)
+    out = tmp_path / "o.mkv"
+    out.write_bytes(b"o")
+    cache.settle("k", out)
+    assert fut.result() == out and cache.claim("k") == out
+    out.write_bytes(b"edited")
+    assert cache.claim("k") is None
+    # A failed owner hands the key to the next claimant
+    waiter = cache.claim("k")
+    cache.settle("k", None)
+    assert waiter.result() is None and cache.claim("k") is None
+
+
+def test_encode_cache_persists_across_runs(tmp_path):
+    out = tmp_path / "o.mkv"
+    out.write_bytes(b"o")
+    db = vidconv.ProbeCache(tmp_path / "c.sqlite")
+    first = vidconv.EncodeCache(db)
+    assert first.claim("k") is None
+    first.settle("k", out)
+    db.close()
+    db = vidconv.ProbeCache(tmp_path / "c.sqlite")
+    assert vidconv.EncodeCache(db).claim("k") == out
+    db.close()
+
+
+def _dupes(make_files, n):
+    # Identical content in separate directories
+    return make_files([f"d{i}/v.mkv" for i in range(n)], 1000)
+
+
+def _fake_convert(monkeypatch, calls, delay=0.0, fail=False):
+    def fake(inp, out, *args, **kwargs):
+        calls.append(inp)
+        time.sleep(delay)
+        if fail and len(calls) == 1:
+            return vidconv.RunResult(False, reason="input corrupt")
+        out.write_bytes(b"y" * 10)
+        return vidconv.RunResult(True)
+
+    monkeypatch.setattr(vidconv, "convert", fake)
+
+
+def test_duplicates_encode_once_and_link(tmp_path, monkeypatch, make_files):
+    src, files = _dupes(make_files, 3)
+    calls = []
+    _fake_convert(monkeypatch, calls)
+    rt = vidconv.Runtime(encodes=vidconv.EncodeCache(None))
+    out_dir = tmp_path / "out"
+    results = [
+        vidconv.process_item(f, AV1, vidconv.Config(), out_dir, src, vidconv.Log(quiet=True), rt=rt)
+        for f in files
+    ]
+    assert len(calls) == 1
+    outs = sorted(out_dir.rglob("*.mkv"))
+    assert len(outs) == 3 and all(o.read_bytes() == b"y" * 10 for o in outs)
+    reused = sum(s.decisions[k] for s, _ in results for k in s.decisions if k.startswith("reused: "))
+    assert reused == 2
+    assert all(s.processed == 1 and s.output_bytes == 10 for s, _ in results)
+
+
+def test_in_flight_duplicates_wait_for_the_first(tmp_path, monkeypatch, make_files):
+    src, files = _dupes(make_files, 4)
+    calls = []
+    _fake_convert(monkeypatch, calls, delay=0.2)
+    rt = vidconv.Runtime(encodes=vidconv.EncodeCache(None))
+    log = vidconv.Log(quiet=True)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(
+            pool.map(
+                lambda f: vidconv.process_item(
+                    f, AV1, vidconv.Config(), tmp_path / "out", src, log, rt=rt
+                ),
+                files,
+            )
+        )
+    assert len(calls) == 1
+    assert [s.processed for s, _ in results] == [1, 1, 1, 1]
+
+
+def test_failed_owner_lets_a_duplicate_encode(tmp_path, monkeypatch, make_files):
+    src, files = _dupes(make_files, 2)
+    calls = []
+    _fake_convert(monkeypatch, calls, delay=0.2, fail=True)
+    rt = vidconv.Runtime(encodes=vidconv.EncodeCache(None))
+    log = vidconv.Log(quiet=True)
+    first = threading.Thread(
+        target=vidconv.process_item,
+        args=(files[0], AV1, vidconv.Config(), tmp_path / "out", src, log),
+        kwargs={"rt": rt},
+    )
+    first.start()
+    time.sleep(0.05)
+    stats, _ = vidconv.process_item(
+        files[1], AV1, vidconv.Config(), tmp_path / "out", src, log, rt=rt
+    )
+    first.join()
+    assert len(calls) == 2 and stats.processed == 1
+
+
+def test_overwrite_rerun_keeps_existing_output(tmp_path, monkeypatch, make_files):
+    src, (f,) = _dupes(make_files, 1)
+    calls = []
+    _fake_convert(monkeypatch, calls)
+    rt = vidconv.Runtime(encodes=vidconv.EncodeCache(None))
+    cfg = vidconv.Config(skip_existing=False)
+    log = vidconv.Log(quiet=True)
+    vidconv.process_item(f, AV1, cfg, tmp_path / "out", src, log, rt=rt)
+    stats, msg = vidconv.process_item(f, AV1, cfg, tmp_path / "out", src, log, rt=rt)
+    assert len(calls) == 1
+    assert stats.decisions["reused: existing"] == 1 and msg.endswith("reused: existing")
+
+
+def test_owner_crash_after_encode_releases_waiters(tmp_path, monkeypatch, make_files):
+    src, files = _dupes(make_files, 2)
+    calls = []
+
+    def fake(inp, out, *args, **kwargs):
+        calls.append(inp)
+        time.sleep(0.2)
+        if len(calls) > 1:
+            out.write_bytes(b"y")
+        # The first "succeeds" without writing anything: finish_output raises
+        return vidconv.RunResult(True)
+
+    monkeypatch.setattr(vidconv, "convert", fake)
+    rt = vidconv.Runtime(encodes=vidconv.EncodeCache(None))
+    log = vidconv.Log(quiet=True)
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(
+            vidconv.process_item, files[0], AV1, vidconv.Config(), tmp_path / "out", src, log, rt=rt
+        )
+        time.sleep(0.05)
+        second = pool.submit(
+            vidconv.process_item, files[1], AV1, vidconv.Config(), tmp_path / "out", src, log, rt=rt
+        )
+        assert isinstance(first.exception(timeout=5), FileNotFoundError)
+        stats, _ = second.result(timeout=5)
+    assert len(calls) == 2 and stats.processed == 1
@@ -0,0 +1,113 @@
+import argparse
+import math
+
+import pytest
+import vidconv
+
+
+def test_t95_is_conservative_between_keys():
+    assert vidconv.t95(1) == 12.71
+    assert vidconv.t95(11) == vidconv.T95[10]
+    assert vidconv.t95(500) == 2.00
+    assert math.isinf(vidconv.t95(0))
+
+
+def test_ratio_estimate():
+    # Exactly proportional samples: no spread, no interval
+    est, ci = vidconv.ratio_estimate([10, 20, 30], [5, 10, 15], 600, 100)
+    assert est == 300 and ci == 0
+    est, ci = vidconv.ratio_estimate([10, 20, 30], [4, 12, 14], 600, 100)
+    assert est == 300 and 0 < ci < est
+    # Sampling the whole population leaves no sampling error
+    assert vidconv.ratio_estimate([10, 20], [4, 12], 30, 2)[1] == 0
+    assert math.isinf(vidconv.ratio_estimate([10], [4], 30, 5)[1])
+
+
+def test_estimate_batch_extrapolates(tmp_path, monkeypatch, capsys):
+    files = []
+    for i in range(20):
+        f = tmp_path / f"v{i}.mp4"
+        f.write_bytes(b"x" * 1000)
+        files.append(f)
+
+    def probe(inp, cache, walk=None):
+        return vidconv.Probe(100.0, 1000, 0, "mov", [])
+
+    def fake_ffmpeg(inp, out, params, quiet, ffzap, cpus=None, input_opts=(), on_progress=None):
+        assert "libsvtav1" in params and input_opts[0] == "-ss"
+        out.write_bytes(b"y" * 20)  # 4s -> 20 B: 500 B per 100 s file
+        return vidconv.RunResult(True, wall=2.0)
+
+    monkeypatch.setattr(vidconv, "has", lambda tool: tool == "ffprobe")
+    monkeypatch.setattr(vidconv, "probe_file", probe)
+    monkeypatch.setattr(vidconv, "run_ffmpeg", fake_ffmpeg)
+    cfg = vidconv.Config(probe_cache=None)
+    rc = vidconv.estimate_batch(
+        files, vidconv.PRESETS["av1"], cfg, vidconv.Log(), tmp_path / "out", tmp_path, 2, 5
+    )
+    assert rc == 0
+    out = capsys.readouterr().out
+    # 20 kB in, half out; 50 s of encoding per file, 1000 s over 2 jobs at best
+    assert "Output: 0.01MB ± 0.00MB (95% CI)" in out
+    assert "Saved:  0.01MB ± 0.00MB (50%)" in out
+    assert "Time:   ≥0:08:20 ± 0:00:00 wall-clock at -j 2 (0:16:40 of encoding)" in out
+    assert "(5 sampled, 0 would skip, 0 failed)" in out
+
+
+def test_estimate_skips_vanished_files_and_creates_nothing(tmp_path, monkeypatch, capsys):
+    src = tmp_path / "src"
+    (src / "season").mkdir(parents=True)
+    kept = src / "season" / "e1.mp4"
+    kept.write_bytes(b"x" * 1000)
+
+    def fake_ffmpeg(inp, out, params, quiet, ffzap, cpus=None, input_opts=(), on_progress=None):
+        out.write_bytes(b"y" * 20)
+        return vidconv.RunResult(True, wall=2.0)
+
+    monkeypatch.setattr(vidconv, "has", lambda tool: tool == "ffprobe")
+    monkeypatch.setattr(
+        vidconv, "probe_file", lambda inp, cache, walk: vidconv.Probe(100.0, 1000, 0, "mov", [])
+    )
+    monkeypatch.setattr(vidconv, "run_ffmpeg", fake_ffmpeg)
+    out_dir = tmp_path / "out"
+    rc = vidconv.estimate_batch(
+        [kept, src / "season" / "gone.mp4"], vidconv.PRESETS["av1"],
+        vidconv.Config(probe_cache=None), vidconv.Log(), out_dir, src, 1, 5,
+    )
+    assert rc == 0
+    captured = capsys.readouterr()
+    assert "Skipping gone.mp4" in captured.err
+    assert "Files:  1 (1 sampled, 0 would skip, 0 failed)" in captured.out
+    assert not out_dir.exists()
+
+
+def test_estimate_samples_the_same_files_every_run(tmp_path, monkeypatch):
+    files = []
+    for i in range(30):
+        f = tmp_path / f"v{i}.mp4"
+        f.write_bytes(b"x" * 1000)
+        files.append(f)
+    picked = []
+
+    def prepare(inp, *args, **kwargs):
+        picked.append(inp)
+        return vidconv.Job(inp, inp, vidconv.Config(), skip="Skipped")
+
+    monkeypatch.setattr(vidconv, "has", lambda tool: tool == "ffprobe")
+    monkeypatch.setattr(vidconv, "probe_file", lambda inp, cache, walk: None)
+    monkeypatch.setattr(vidconv, "prepare_item", prepare)
+    log = vidconv.Log(quiet=True)
+    runs = []
+    for order in (files, files[::-1]):
+        picked.clear()
+        vidconv.estimate_batch(
+            order, vidconv.PRESETS["av1"], vidconv.Config(probe_cache=None), log, None, None, 1, 5
+        )
+        runs.append(sorted(picked))
+    assert runs[0] == runs[1] and len(runs[0]) == 5
+
+
+@pytest.mark.parametrize("v", ["0", "-3", "x"])
+def test_estimate_count_must_be_positive(v):
+    with pytest.raises(argparse.ArgumentTypeError):
+        vidconv.parse_count(v)
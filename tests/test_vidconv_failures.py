@@ -0,0 +1,111 @@
+import sys
+from pathlib import Path
+
+import pytest
+import vidconv
+
+
+def test_run_cmd_keeps_stderr_tail():
+    script = (
+        "import sys\n"
+        "for i in range(200): print(f'line {i}', file=sys.stderr)\n"
+        "sys.exit(1)\n"
+    )
+    res = vidconv.run_cmd([sys.executable, "-c", script], True)
+    assert not res and res.returncode == 1
+    lines = res.stderr.splitlines()
+    assert len(lines) == vidconv.STDERR_TAIL
+    assert lines[-1] == "line 199"
+
+
+@pytest.mark.parametrize(
+    "stderr,code,reason",
+    [
+        ("a.mkv: Invalid data found when processing input\n", 1, "input corrupt"),
+        ("[mov] moov atom not found\n", 1, "input corrupt"),
+        ("[h264 @ 0x55d0] corrupt decoded frame in stream 0\n", 1, "input corrupt"),
+        ("Error opening input file a.mkv.\n", 1, "input corrupt"),
+        # Output side: a missing directory is not the input's fault
+        ("/gone/a.part.mkv: No such file or directory\n", 1, "transient"),
+        ("Error opening output file /gone/a.mkv.\n", 1, "transient"),
+        ("Unknown encoder 'libsvtav1'\n", 1, "encoder missing"),
+        ("Unrecognized option 'svtav1-params'.\n", 1, "encoder missing"),
+        ("av_interleaved_write_frame(): No space left on device\n", 1, "out of disk"),
+        ("", -9, "oom-killed"),
+        ("Connection reset by peer\n", 1, "transient"),
+    ],
+)
+def test_classify_failure(stderr, code, reason):
+    res = vidconv.RunResult(False, returncode=code, stderr=stderr)
+    assert vidconv.classify_failure(res) == reason
+
+
+def _convert(monkeypatch, stderr):
+    calls, sleeps = [], []
+
+    def fake_run(*args, **kwargs):
+        calls.append(args)
+        return vidconv.RunResult(False, returncode=1, stderr=stderr)
+
+    monkeypatch.setattr(vidconv, "run_ffmpeg", fake_run)
+    monkeypatch.setattr(vidconv, "has", lambda tool: False)
+    monkeypatch.setattr(vidconv.time, "sleep", sleeps.append)
+    res = vidconv.convert(
+        Path("a.mp4"),
+        Path("a.mkv"),
+        vidconv.PRESETS["av1"],
+        vidconv.Config(),
+        vidconv.Log(quiet=True),
+    )
+    return res, calls, sleeps
+
+
+def test_convert_does_not_retry_permanent_failures(monkeypatch):
+    res, calls, sleeps = _convert(monkeypatch, "Invalid data found when processing input")
+    assert res.reason == "input corrupt"
+    assert len(calls) == 1 and sleeps == []
+
+
+def test_convert_retries_transient_with_backoff(monkeypatch):
+    res, calls, sleeps = _convert(monkeypatch, "Resource temporarily unavailable")
+    assert res.reason == "transient" and res.attempt == 3
+    assert len(calls) == 3 and sleeps == [2, 4]
+
+
+def test_failure_reason_reaches_stats(tmp_path, monkeypatch):
+    src = tmp_path / "a.mp4"
+    src.write_bytes(b"x")
+    monkeypatch.setattr(
+        vidconv,
+        "convert",
+        lambda *a, **k: vidconv.RunResult(False, reason="out of disk"),
+    )
+    stats, msg = vidconv.process_item(
+        src,
+        vidconv.PRESETS["av1"],
+        vidconv.Config(),
+        tmp_path,
+        None,
+        vidconv.Log(quiet=True),
+    )
+    assert stats.failures == [f"{src}: out of disk"]
+    assert stats.decisions["failed: out of disk"] == 1
+    assert "out of disk" in msg
+
+
+def test_child_stderr_goes_through_the_log(monkeypatch):
+    written = []
+    live = vidconv.Progress(False, interval=3600)
+    monkeypatch.setattr(live, "write", lambda text, file: written.append(text))
+    log = vidconv.Log()
+    log.live = live
+    script = "import sys; sys.stderr.write('boom\\n'); sys.exit(1)"
+    try:
+        res = vidconv.run_cmd([sys.executable, "-c", script], False, echo=log.echo)
+    finally:
+        live.close()
+    assert not res and written == ["boom"]
+    quiet = vidconv.Log(quiet=True)
+    quiet.live = live
+    vidconv.run_cmd([sys.executable, "-c", script], True, echo=quiet.echo)
+    assert written == ["boom"]
@@ -23,9 +23,10 @@ def test_build_filters_default():
     # max_dim=(1920, 1080) -> scale
     # default_deband is True -> deband
     # pix_fmt="yuv420p10le"
+    # Source size unknown -> max_dim only ever shrinks, so denoise after it
     assert len(filters) == 4
-    assert filters[0] == "hqdn3d=1.5:1.5:6:6"
-    assert "scale=" in filters[1]
+    assert "scale=" in filters[0]
+    assert filters[1] == "hqdn3d=1.5:1.5:6:6"
     assert filters[2] == "deband"
     assert filters[3] == "format=yuv420p10le"
 
@@ -76,7 +77,8 @@ def test_build_filters_rotate():
 def test_build_filters_crop_scale():
     cfg = Config(crop="auto", default_denoise=False, default_deband=False, max_dim=None)
     filters = build_filters(cfg, is_video=True)
-    assert "cropdetect=24:16:0" in filters
+    # Unresolved "auto" never reaches the encode chain
+    assert not any(f.startswith(("crop", "cropdetect")) for f in filters)
 
     cfg = Config(crop="1920:1080:0:0", default_denoise=False, default_deband=False, max_dim=None)
     filters = build_filters(cfg, is_video=True)
@@ -90,3 +92,45 @@ def test_build_filters_none_off():
     cfg = Config(deinterlace="off", denoise="off", deblock="off", crop="off", default_denoise=False, default_deband=False, max_dim=None)
     filters = build_filters(cfg, is_video=True)
     assert filters == ["format=yuv420p10le"]
+
+def test_plan_filters_downscale_before_denoise():
+    cfg = Config(denoise="nlmeans", deinterlace="bwdif", deblock="weak", frame_size=(3840, 2160))
+    filters = build_filters(cfg, is_video=True)
+    assert filters[0].startswith("bwdif")
+    assert filters[1] == "deblock=weak"
+    assert filters.index("nlmeans=h=4") > next(i for i, f in enumerate(filters) if f.startswith("scale="))
+    steps = vidconv.plan_filters(cfg)
+    nlmeans = next(s for s in steps if s.expr.startswith("nlmeans"))
+    assert (nlmeans.width, nlmeans.height) == (1920, 1080)
+    fixed = vidconv.plan_filters(cfg, reorder=False)
+    assert sum(s.cost for s in steps) < sum(s.cost for s in fixed) / 2
+
+def test_plan_filters_denoise_before_upscale():
+    cfg = Config(scale="1920:-2", max_dim=None, frame_size=(1280, 720))
+    filters = build_filters(cfg, is_video=True)
+    assert filters[:2] == ["hqdn3d=1.5:1.5:6:6", "scale=1920:-2:flags=lanczos"]
+
+def test_plan_filters_skips_noop_scale():
+    cfg = Config(frame_size=(1280, 720), default_denoise=False)
+    assert not any(f.startswith("scale=") for f in build_filters(cfg, is_video=True))
+    # Crop and rotation are applied before sizing the scale
+    cfg = Config(frame_size=(3840, 2160), crop="1600:1000:0:0", max_dim=(1920, 1080))
+    assert not any(f.startswith("scale=") for f in build_filters(cfg, is_video=True))
+    cfg = Config(frame_size=(1080, 1920), rotate=90)
+    assert not any(f.startswith("scale=") for f in build_filters(cfg, is_video=True))
+    cfg = Config(frame_size=(1920, 1080), scale="1920x1080")
+    assert not any(f.startswith("scale=") for f in build_filters(cfg, is_video=True))
+
+
+def test_print_filtergraphs_resolves_crop_and_denoise(tmp_path, monkeypatch, capsys):
+    inp = tmp_path / "a.mkv"
+    inp.write_bytes(b"x")
+    v = vidconv.Stream(0, "video", "h264", 1920, 1080, 24.0)
+    probe = vidconv.Probe(600.0, 1, 0, "matroska", (v,))
+    monkeypatch.setattr(vidconv, "prefetch_probes", lambda files, cache, *a: ((f, probe) for f in files))
+    monkeypatch.setattr(vidconv, "detect_crop", lambda *a: "1920:800:0:140")
+    monkeypatch.setattr(vidconv, "measure_noise", lambda *a: {"psnr_y": 30.0})
+    cfg = Config(crop="auto")
+    assert vidconv.print_filtergraphs([inp], vidconv.PRESETS["av1"], cfg, vidconv.Log(quiet=True)) == 0
+    graph = capsys.readouterr().out
+    assert "crop=1920:800:0:140" in graph and "nlmeans" in graph and "hqdn3d" not in graph
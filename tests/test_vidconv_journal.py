@@ -0,0 +1,129 @@
+import json
+from pathlib import Path
+
+import vidconv
+
+
+def test_part_path_keeps_extension():
+    assert vidconv.part_path(Path("/o/a.av1-crf26.mkv")) == Path(
+        "/o/.a.av1-crf26.part.mkv"
+    )
+
+
+def test_journal_roundtrip(tmp_path):
+    path = tmp_path / vidconv.JOURNAL_NAME
+    a, b, c = (tmp_path / f"{n}.mkv" for n in "abc")
+    j = vidconv.Journal(path)
+    j.record("start", Path("a.mp4"), a)
+    j.record("done", Path("a.mp4"), a)
+    j.record("start", Path("b.mp4"), b)
+    j.record("start", Path("c.mp4"), c)
+    j.record("failed", Path("c.mp4"), c)
+    j.close()
+    with path.open("a") as fh:
+        fh.write('{"state": "done", "inp": "b.mp')  # torn write
+
+    j = vidconv.Journal(path)
+    assert j.load() == [(Path("b.mp4"), b)]
+    assert j.done_count == 1
+    # Outputs are checked when asked about, not when the journal loads
+    assert not j.is_done(Path("a.mp4"), a)
+    a.touch()
+    assert j.is_done(Path("a.mp4"), a)
+    assert not j.is_done(Path("a.mp4"), tmp_path / "a.vp9.webm")
+    assert not j.is_done(Path("c.mp4"), c)
+
+
+def _item(tmp_path, monkeypatch, ok):
+    src = tmp_path / "a.mp4"
+    src.write_bytes(b"x" * 100)
+    out_dir = tmp_path / "out"
+
+    def fake_convert(inp, out, *args, **kwargs):
+        out.write_bytes(b"y" * 10)
+        return vidconv.RunResult(ok)
+
+    monkeypatch.setattr(vidconv, "convert", fake_convert)
+    rt = vidconv.Runtime(journal=vidconv.Journal(out_dir / vidconv.JOURNAL_NAME))
+    stats, _ = vidconv.process_item(
+        src,
+        vidconv.PRESETS["av1"],
+        vidconv.Config(),
+        out_dir,
+        None,
+        vidconv.Log(quiet=True),
+        rt=rt,
+    )
+    rt.journal.close()
+    states = [
+        json.loads(l)["state"] for l in (out_dir / vidconv.JOURNAL_NAME).open()
+    ]
+    return stats, out_dir, states
+
+
+def test_process_renames_on_success(tmp_path, monkeypatch):
+    stats, out_dir, states = _item(tmp_path, monkeypatch, True)
+    assert stats.processed == 1
+    assert [p.name for p in out_dir.iterdir() if p.suffix == ".mkv"] == [
+        "a.av1-crf26.mkv"
+    ]
+    assert states == ["start", "done"]
+
+
+def test_process_leaves_nothing_on_failure(tmp_path, monkeypatch):
+    stats, out_dir, states = _item(tmp_path, monkeypatch, False)
+    assert stats.failed == 1
+    assert not list(out_dir.glob("*.mkv"))
+    assert states == ["start", "failed"]
+
+
+def test_journal_without_output_dir_goes_to_state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(vidconv, "JOURNAL_DIR", tmp_path / "state")
+    out = tmp_path / "out"
+    assert vidconv.journal_path(out, tmp_path) == out / vidconv.JOURNAL_NAME
+    a = vidconv.journal_path(None, tmp_path / "a")
+    assert a.parent == tmp_path / "state" and a != vidconv.journal_path(None, tmp_path / "b")
+
+
+def test_journal_compacts_on_resume_or_size(tmp_path, monkeypatch):
+    path = tmp_path / vidconv.JOURNAL_NAME
+    a, b = tmp_path / "a.mkv", tmp_path / "b.mkv"
+    j = vidconv.Journal(path)
+    for _ in range(3):
+        for out in (a, b):
+            j.record("start", Path("x.mp4"), out)
+            j.record("done", Path("x.mp4"), out)
+    j.record("start", Path("c.mp4"), tmp_path / "c.mkv")
+    j.record("failed", Path("d.mp4"), tmp_path / "d.mkv")
+    lines = path.read_text()
+    j.compact()
+    assert path.read_text() == lines  # small, and no --resume
+    monkeypatch.setattr(
+        vidconv.Path, "exists", lambda *a: (_ for _ in ()).throw(AssertionError)
+    )
+    j.compact(force=True)
+    recs = [json.loads(line) for line in path.open()]
+    assert [(r["out"], r["state"]) for r in recs] == [
+        (str(a), "done"),
+        (str(b), "done"),
+        (str(tmp_path / "c.mkv"), "start"),
+    ]
+    monkeypatch.undo()
+    monkeypatch.setattr(vidconv, "JOURNAL_COMPACT", 1)
+    j.record("done", Path("c.mp4"), tmp_path / "c.mkv")
+    j.compact()
+    assert len(path.read_text().splitlines()) == 3
+
+
+def test_compaction_keeps_another_runs_appends(tmp_path):
+    path = tmp_path / vidconv.JOURNAL_NAME
+    ours, theirs = vidconv.Journal(path), vidconv.Journal(path)
+    ours.record("done", Path("a.mp4"), tmp_path / "a.mkv")
+    theirs.record("done", Path("b.mp4"), tmp_path / "b.mkv")
+    theirs.compact(force=True)
+    # Our handle points at the replaced file; the next line must not vanish
+    ours.record("done", Path("c.mp4"), tmp_path / "c.mkv")
+    ours.close()
+    theirs.close()
+    outs = [json.loads(line)["out"] for line in path.open()]
+    assert outs == [str(tmp_path / f"{n}.mkv") for n in "abc"]
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+import vidconv
+
+AV1 = vidconv.PRESETS["av1"]
+
+
+def _cfg(w, h, **kw):
+    return vidconv.Config(frame_size=(w, h), **kw)
+
+
+def test_estimate_scales_with_resolution_preset_and_filters():
+    est = vidconv.estimate_mem
+    hd = est(AV1, _cfg(1920, 1080), None)
+    uhd = est(AV1, _cfg(3840, 2160), None)
+    assert 3 * hd < uhd
+    assert est(AV1, _cfg(3840, 2160, preset=1), None) > uhd
+    assert est(AV1, _cfg(3840, 2160, denoise="nlmeans"), None) > uhd
+    assert est(vidconv.PRESETS["opus"], vidconv.Config(), None) == vidconv.MEM_BASE
+    # 4K 10-bit SVT-AV1 at preset 3 lands in the multi-GB range
+    assert 3 << 30 < uhd < 8 << 30
+
+
+def test_model_learns_from_rss_and_oom():
+    model = vidconv.MemModel()
+    cfg = _cfg(1920, 1080)
+    base = vidconv.estimate_mem(AV1, cfg, None)
+    model.observe(AV1, cfg, None, vidconv.RunResult(True, maxrss=base // 2))
+    learned = model.estimate(AV1, cfg, None)
+    assert abs(learned - base * 0.5 * vidconv.MEM_HEADROOM) <= 1
+    # Other classes keep the static estimate
+    assert model.estimate(AV1, _cfg(1920, 1080, preset=6), None) != learned
+    oom = vidconv.RunResult(False, returncode=-9)
+    model.observe(AV1, cfg, None, oom)
+    assert abs(model.estimate(AV1, cfg, None) - learned * 1.5) <= 2
+
+
+def test_gate_memory_budget_is_fifo():
+    gate = vidconv.Gate(8, mem_budget=10)
+    order, lock = [], threading.Lock()
+
+    def job(name, mem, hold):
+        with gate.slot(mem):
+            with lock:
+                order.append((name, gate.mem))
+            time.sleep(hold)
+
+    first = threading.Thread(target=job, args=("a", 6, 0.2))
+    first.start()
+    time.sleep(0.05)
+    # "big" queues first; "small" would fit next to "a" but must not jump it
+    threads = [threading.Thread(target=job, args=("big", 20, 0.05))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=job, args=("small", 2, 0)))
+    threads[1].start()
+    for t in [first, *threads]:
+        t.join()
+    assert order == [("a", 6), ("big", 20), ("small", 2)]
+    assert gate.active == 0 and gate.mem == 0
+
+
+def test_cancelled_async_waiter_leaves_the_line():
+    gate = vidconv.Gate(1)
+
+    async def main():
+        async with gate.slot_async():
+            waiter = asyncio.create_task(gate.slot_async().__aenter__())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        async with gate.slot_async():
+            return gate.active
+
+    assert asyncio.run(main()) == 1
+
+
+def test_estimate_falls_back_to_the_probed_size():
+    v = vidconv.Stream(0, "video", "h264", 3840, 2160, 24.0)
+    probe = vidconv.Probe(60.0, 0, 0, "matroska", (v,))
+    cfg = vidconv.Config()
+    assert vidconv.estimate_mem(AV1, cfg, probe) == vidconv.estimate_mem(
+        AV1, _cfg(3840, 2160), None
+    )
+
+
+def test_analysis_encodes_reserve_memory(tmp_path, monkeypatch):
+    v = vidconv.Stream(0, "video", "h264", 3840, 2160, 24.0)
+    probe = vidconv.Probe(600.0, 0, 0, "matroska", (v,))
+    inp = tmp_path / "in.mkv"
+    inp.write_bytes(b"x")
+    rt = vidconv.Runtime(gate=vidconv.Gate(4, 1 << 40), mem=vidconv.MemModel())
+    held = {}
+
+    def spy(name, value):
+        def fake(*a, **kw):
+            held[name] = (rt.gate.active, rt.gate.mem)
+            return value
+
+        return fake
+
+    monkeypatch.setattr(vidconv, "detect_crop", spy("crop", ""))
+    monkeypatch.setattr(vidconv, "measure_noise", spy("noise", {"psnr_y": 40.0}))
+    monkeypatch.setattr(vidconv, "search_crf", spy("crf", {"crf": 30, "scores": {}}))
+    cfg = vidconv.Config(crop="auto", denoise="nlmeans", target_ssim=0.98, samples=4)
+    log = vidconv.Log(quiet=True)
+    vidconv.auto_crop(inp, cfg, log, probe, rt)
+    vidconv.adapt_filters(inp, vidconv.Config(), log, probe, rt)
+    vidconv.target_crf(inp, AV1, cfg, log, probe, rt)
+    assert held["crop"] == (1, vidconv.probe_mem(cfg, probe, vidconv.CROP_SAMPLES))
+    assert held["noise"][0] == 1 and held["noise"][1] > 0
+    # Four parallel 4K nlmeans sample encodes
+    single = vidconv.estimate_mem(AV1, cfg, probe)
+    assert held["crf"] == (1, 4 * single)
+    assert rt.gate.active == 0 and rt.gate.mem == 0
@@ -0,0 +1,68 @@
+import csv
+import json
+import sys
+from pathlib import Path
+
+import vidconv
+
+
+def test_run_cmd_collects_rusage_and_frames():
+    script = (
+        "sum(range(2_000_000));"
+        "print('frame=250\\nout_time_us=10000000\\nprogress=end')"
+    )
+    res = vidconv.run_cmd([sys.executable, "-c", script, "pipe:1"], True)
+    assert res and res.returncode == 0
+    assert res.frames == 250
+    assert res.utime > 0 and res.maxrss > 0 and res.wall > 0
+    assert res.tool == Path(sys.executable).name
+
+
+def test_run_result_combine():
+    a = vidconv.RunResult(True, wall=5, utime=4, stime=1, maxrss=100, frames=10)
+    b = vidconv.RunResult(False, returncode=1, utime=1, maxrss=50, frames=3)
+    res = vidconv.RunResult.combine([a, b], 6.0)
+    assert not res and res.returncode == 1
+    assert (res.utime, res.stime, res.maxrss, res.frames) == (5, 1, 150, 10)
+
+
+def _record(crf=30):
+    res = vidconv.RunResult(True, wall=2.0, utime=3.0, frames=100, attempt=2)
+    return vidconv.metric_record(
+        Path("a.mp4"),
+        Path("a.mkv"),
+        vidconv.PRESETS["h265"],
+        vidconv.Config(crf=crf, preset_name="medium"),
+        res,
+        60.0,
+        1000,
+        250,
+    )
+
+
+def test_metric_record_fields():
+    rec = _record()
+    assert rec["fps"] == 50.0
+    assert rec["ratio"] == 0.25
+    assert (rec["preset"], rec["speed"], rec["crf"]) == ("h265", "medium", 30)
+    assert rec["attempt"] == 2
+    assert set(rec) == set(vidconv.Metrics.FIELDS)
+
+
+def test_metrics_csv_header_written_once(tmp_path):
+    path = tmp_path / "m.csv"
+    for _ in range(2):
+        m = vidconv.Metrics(path)
+        m.write(_record())
+        m.close()
+    rows = list(csv.DictReader(path.open()))
+    assert len(rows) == 2
+    assert rows[0]["crf"] == "30"
+
+
+def test_metrics_jsonl(tmp_path):
+    path = tmp_path / "m.jsonl"
+    m = vidconv.Metrics(path)
+    m.write(_record(crf=22))
+    m.close()
+    assert json.loads(path.read_text())["crf"] == 22
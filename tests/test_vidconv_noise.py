@@ -0,0 +1,110 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import vidconv
+
+
+def _probe(pix_fmt="yuv420p", bit_rate=2_000_000):
+    v = vidconv.Stream(0, "video", "h264", 1920, 1080, 24.0, bit_rate, 0, pix_fmt, "")
+    return vidconv.Probe(600.0, 1000, 0, "matroska", [v])
+
+
+def _adapt(monkeypatch, psnr, cfg=None, probe=None):
+    monkeypatch.setattr(vidconv, "noise_sample", lambda inp, t, *a: psnr)
+    cfg = cfg or vidconv.Config(auto_filters=True)
+    return vidconv.adapt_filters(
+        Path("a.mkv"), cfg, vidconv.Log(quiet=True), probe or _probe()
+    )
+
+
+def test_noise_sample_parses_luma_psnr(monkeypatch):
+    stderr = "[Parsed_psnr_3] PSNR y:41.23 u:45.00 v:45.10 average:42.50 min:40 max:44\n"
+    monkeypatch.setattr(
+        vidconv.subprocess,
+        "run",
+        lambda cmd, **kw: subprocess.CompletedProcess(cmd, 0, "", stderr),
+    )
+    assert vidconv.noise_sample(Path("a.mkv"), 3.0) == 41.23
+
+
+def test_clean_source_skips_denoise(monkeypatch):
+    cfg = _adapt(monkeypatch, 50.0)
+    assert vidconv.denoise_filter(cfg) is None
+    # Clean 8-bit at ~0.04 bpp is banding-prone
+    assert cfg.default_deband
+
+
+def test_grainy_source_gets_nlmeans_and_no_deband(monkeypatch):
+    cfg = _adapt(monkeypatch, 32.0)
+    assert vidconv.denoise_filter(cfg) == "nlmeans=h=6"
+    assert not cfg.default_deband
+    cfg = _adapt(monkeypatch, 40.0)
+    assert vidconv.denoise_filter(cfg) == "hqdn3d=4"
+    cfg = _adapt(monkeypatch, 44.0)
+    assert vidconv.denoise_filter(cfg) == "hqdn3d=1.5:1.5:6:6"
+
+
+def test_ten_bit_or_high_bitrate_skips_deband(monkeypatch):
+    assert not _adapt(monkeypatch, 50.0, probe=_probe("yuv420p10le")).default_deband
+    assert not _adapt(monkeypatch, 50.0, probe=_probe(bit_rate=20_000_000)).default_deband
+
+
+def test_explicit_choices_win(monkeypatch):
+    cfg = vidconv.Config(auto_filters=True, denoise="hqdn3d", default_deband=False)
+    out = _adapt(monkeypatch, 50.0, cfg)
+    assert out.denoise == "hqdn3d" and not out.default_deband
+    off = vidconv.Config(auto_filters=False)
+    assert _adapt(monkeypatch, 50.0, off) is off
+
+
+def test_noise_analysis_cached(tmp_path, monkeypatch):
+    inp = tmp_path / "a.mkv"
+    inp.write_bytes(b"x")
+    calls = []
+
+    def fake(path, t, *a):
+        calls.append(t)
+        return 40.0
+
+    monkeypatch.setattr(vidconv, "noise_sample", fake)
+    cache = vidconv.ProbeCache(tmp_path / "c.sqlite")
+    rt = vidconv.Runtime(probes=cache)
+    log = vidconv.Log(quiet=True)
+    cfg = vidconv.Config(auto_filters=True)
+    vidconv.adapt_filters(inp, cfg, log, _probe(), rt)
+    vidconv.adapt_filters(inp, cfg, log, _probe(), rt)
+    assert len(calls) == vidconv.NOISE_SAMPLES
+    cache.close()
+
+
+def test_cli_and_library_share_the_default(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["vidconv", "av1", "a.mkv"])
+    args, _ = vidconv.parse_args()
+    assert args.auto_filters is vidconv.Config().auto_filters is True
+
+
+def test_noise_measured_on_the_cropped_picture(tmp_path, monkeypatch):
+    inp = tmp_path / "a.mkv"
+    inp.write_bytes(b"x")
+    graphs = []
+
+    def fake_run(cmd, **kw):
+        graphs.append(cmd[cmd.index("-lavfi") + 1])
+        return subprocess.CompletedProcess(cmd, 0, "", "PSNR y:40.00 u:1 v:1")
+
+    monkeypatch.setattr(vidconv.subprocess, "run", fake_run)
+    monkeypatch.setattr(vidconv, "crop_sample", lambda *a, **k: (1080, 1440, 0, 240))
+    job = vidconv.prepare_item(
+        inp,
+        vidconv.PRESETS["av1"],
+        vidconv.Config(crop="auto", rotate=90),
+        tmp_path / "out",
+        tmp_path,
+        vidconv.Log(quiet=True),
+        _probe(),
+    )
+    assert job.cfg.crop == "1080:1440:0:240"
+    assert graphs and all(
+        g.startswith("[0:v]transpose=1,crop=1080:1440:0:240,format=yuv420p,") for g in graphs
+    )
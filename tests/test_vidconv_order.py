@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import vidconv
+
+
+def _probe(duration, w=1920, h=1080):
+    v = vidconv.Stream(0, "video", "h264", w, h, 24.0)
+    return vidconv.Probe(duration, 0, 0, "matroska", (v,))
+
+
+def test_job_cost_uses_pixels_and_duration():
+    assert vidconv.job_cost(Path("a"), _probe(10, 3840, 2160)) > vidconv.job_cost(
+        Path("b"), _probe(30)
+    )
+
+
+def test_job_cost_falls_back_to_size(tmp_path):
+    f = tmp_path / "a.mp4"
+    f.write_bytes(b"x" * 123)
+    assert vidconv.job_cost(f, None) == 123.0
+    assert vidconv.job_cost(tmp_path / "missing.mp4", None) == 0.0
+
+
+def test_order_by_cost_full_window():
+    items = [(Path(str(d)), _probe(d)) for d in (5, 50, 1, 20)]
+    out = [int(f.name) for f, _ in vidconv.order_by_cost(items, 10)]
+    assert out == [50, 20, 5, 1]
+
+
+def test_order_by_cost_bounded_window_streams():
+    def gen():
+        for d in (5, 50, 1, 20, 100):
+            yield Path(str(d)), _probe(d)
+
+    it = vidconv.order_by_cost(gen(), 2)
+    # Only two items are buffered before the first is released
+    assert int(next(it)[0].name) == 50
+    assert [int(f.name) for f, _ in it] == [20, 100, 5, 1]
+
+
+def test_order_by_cost_stable_for_ties():
+    items = [(Path(n), _probe(10)) for n in "abc"]
+    assert [f.name for f, _ in vidconv.order_by_cost(items, 10)] == ["a", "b", "c"]
@@ -0,0 +1,91 @@
+from pathlib import Path
+
+import vidconv
+
+Config = vidconv.Config
+Probe = vidconv.Probe
+Stream = vidconv.Stream
+PRESETS = vidconv.PRESETS
+
+
+def _probe(vcodec="av1", w=1920, h=1080, vrate=1_500_000, acodec="opus", arate=96_000):
+    streams = [Stream(1, "audio", acodec, channels=2, bit_rate=arate)]
+    if vcodec:
+        streams.insert(0, Stream(0, "video", vcodec, w, h, 24.0, vrate))
+    return Probe(60.0, 1000, vrate + arate, "matroska", tuple(streams))
+
+
+def test_plan_disabled_without_flag():
+    assert vidconv.plan_streams(Path("a.mkv"), PRESETS["av1"], Config(), _probe()) is None
+
+
+def test_plan_copies_matching_video_and_opus_audio():
+    cfg = Config(passthrough=True)
+    plan = vidconv.plan_streams(Path("a.mp4"), PRESETS["av1"], cfg, _probe())
+    assert (plan.video, plan.audio, plan.skip) == ("copy", "copy", False)
+    # Same container and nothing to encode: nothing to gain
+    plan = vidconv.plan_streams(Path("a.mkv"), PRESETS["av1"], cfg, _probe())
+    assert plan.skip
+
+
+def test_plan_encodes_when_over_budget_or_oversized():
+    cfg = Config(passthrough=True)
+    plan = vidconv.plan_streams(
+        Path("a.mkv"), PRESETS["av1"], cfg, _probe(vrate=40_000_000, acodec="aac")
+    )
+    assert (plan.video, plan.audio) == ("encode", "encode")
+    plan = vidconv.plan_streams(
+        Path("a.mkv"), PRESETS["av1"], cfg, _probe(w=3840, h=2160)
+    )
+    assert plan.video == "encode"
+    plan = vidconv.plan_streams(Path("a.mkv"), PRESETS["av1"], cfg, _probe("h264"))
+    assert plan.video == "encode"
+
+
+def test_plan_copies_only_the_presets_codec():
+    cfg = Config(passthrough=True)
+    # An efficient source in another codec would end up mislabelled
+    for name, codec in (("av1", "hevc"), ("h265", "av1"), ("x264", "hevc"), ("vp9", "av1")):
+        plan = vidconv.plan_streams(Path("a.mkv"), PRESETS[name], cfg, _probe(codec))
+        assert plan.video == "encode", name
+    for name, codec in (("h265", "hevc"), ("vp9", "vp9")):
+        plan = vidconv.plan_streams(Path("a.mkv"), PRESETS[name], cfg, _probe(codec))
+        assert plan.video == "copy", name
+
+
+def test_plan_opus_preset():
+    cfg = Config(passthrough=True, audio_bitrate="128k")
+    plan = vidconv.plan_streams(Path("a.ogg"), PRESETS["opus"], cfg, _probe(None))
+    assert (plan.video, plan.audio, plan.skip) == (None, "copy", False)
+    plan = vidconv.plan_streams(Path("a.opus"), PRESETS["opus"], cfg, _probe(None))
+    assert plan.skip
+    plan = vidconv.plan_streams(
+        Path("a.opus"), PRESETS["opus"], cfg, _probe(None, arate=256_000)
+    )
+    assert plan.audio == "encode"
+
+
+def test_build_params_copy_video():
+    plan = vidconv.StreamPlan(video="copy", audio="encode")
+    params = vidconv.build_params(PRESETS["av1"], Config(), plan)
+    assert "-vf" not in params
+    assert params[params.index("-c:v") + 1] == "copy"
+    assert "-crf" not in params and "-svtav1-params" not in params
+    assert params[params.index("-c:a") + 1] == "libopus"
+
+
+def test_build_params_copy_audio():
+    plan = vidconv.StreamPlan(video="encode", audio="copy")
+    params = vidconv.build_params(PRESETS["av1"], Config(), plan)
+    assert params[params.index("-c:a") + 1] == "copy"
+    assert "-b:a" not in params and "-ac" not in params
+    assert "-vf" in params and "libsvtav1" in params
+
+
+def test_stats_merge_decisions():
+    a, b = vidconv.Stats(), vidconv.Stats(processed=1)
+    b.decisions["video: copy"] += 1
+    a.merge(b)
+    a.merge(b)
+    assert a.processed == 2
+    assert a.decisions["video: copy"] == 2
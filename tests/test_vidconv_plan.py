@@ -0,0 +1,109 @@
+import json
+from pathlib import Path
+
+import vidconv
+
+AV1 = vidconv.PRESETS["av1"]
+
+
+def test_plan_detects_collisions_and_existing(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "taken.mkv").touch()
+    pairs = [
+        (Path("a.mp4"), out / "a.mkv"),
+        (Path("a.mov"), out / "a.mkv"),
+        (Path("taken.mp4"), out / "taken.mkv"),
+        (Path("same.mkv"), Path("same.mkv")),
+    ]
+    plan = vidconv.plan_outputs(pairs, vidconv.Config())
+    assert [i.action for i in plan] == ["encode", "collision", "skip", "skip"]
+    assert plan[1].reason == "same output as a.mp4"
+    stats = vidconv.plan_stats(plan)
+    assert (stats.skipped, stats.failed) == (2, 1)
+    overwrite = vidconv.plan_outputs(pairs[2:3], vidconv.Config(skip_existing=False))
+    assert overwrite[0].action == "encode"
+
+
+def test_output_index_lists_each_dir_once(tmp_path, monkeypatch):
+    (tmp_path / "a").touch()
+    index = vidconv.OutputIndex()
+    calls = []
+    real = vidconv.os.scandir
+    monkeypatch.setattr(vidconv.os, "scandir", lambda d: calls.append(d) or real(d))
+    assert index.exists(tmp_path / "a")
+    assert not index.exists(tmp_path / "b")
+    index.add(tmp_path / "b")
+    assert index.exists(tmp_path / "b")
+    assert not index.exists(tmp_path / "missing" / "c")
+    assert len(calls) == 2
+
+
+def test_dry_run_is_plan_only(tmp_path, monkeypatch, make_files):
+    src, files = make_files(["a.mp4", "x/b.mp4"])
+    monkeypatch.setattr(
+        vidconv, "probe_file", lambda *a: (_ for _ in ()).throw(AssertionError)
+    )
+    out = tmp_path / "out"
+    plan_file = tmp_path / "plan.json"
+    cfg = vidconv.Config(dry_run=True, plan_out=plan_file)
+    stats = vidconv.run_batch(
+        files, AV1, cfg, vidconv.Log(quiet=True), out, src, 1
+    )
+    assert stats.processed == 0 and not out.exists()
+    doc = vidconv.read_plan(plan_file)
+    assert doc["preset"] == "av1" and doc["src_root"] == str(src)
+    assert [Path(i["output"]).relative_to(out).parent.as_posix() for i in doc["items"]] == [
+        ".",
+        "x",
+    ]
+
+
+def test_run_from_plan_uses_planned_outputs(tmp_path, monkeypatch, make_files):
+    _, files = make_files(["a.mp4", "b.mp4"])
+    out = tmp_path / "elsewhere" / "deep"
+    pairs = [(f, out / f"{f.stem}.custom.mkv") for f in files]
+    plan_file = tmp_path / "plan.json"
+    vidconv.write_plan(plan_file, vidconv.plan_outputs(pairs, vidconv.Config()), AV1, None, None)
+    items = json.loads(plan_file.read_text())["items"]
+
+    def fake_convert(inp, out, *args, **kwargs):
+        out.write_bytes(b"y")
+        return vidconv.RunResult(True)
+
+    monkeypatch.setattr(vidconv, "convert", fake_convert)
+    loaded = [(Path(i["input"]), Path(i["output"])) for i in items]
+    stats = vidconv.run_batch(
+        [], AV1, vidconv.Config(probe_cache=None), vidconv.Log(quiet=True), out, None, 2, loaded
+    )
+    assert stats.processed == 2
+    assert sorted(p.name for p in out.glob("*.mkv")) == ["a.custom.mkv", "b.custom.mkv"]
+
+
+def test_plain_run_streams_discovery_into_encodes(tmp_path, monkeypatch, make_files):
+    src, files = make_files(["a.mp4", "b.mp4", "x/c.mp4", "d.mov"])
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "b.av1-crf26.mkv").touch()
+    found, seen = [], []
+
+    def discover():
+        for f in files:
+            found.append(f)
+            yield f
+        # Same output as d.mov
+        found.append(src / "d.mp4")
+        yield src / "d.mp4"
+
+    def fake_convert(inp, out, *args, **kwargs):
+        seen.append(len(found))
+        out.write_bytes(b"y")
+        return vidconv.RunResult(True)
+
+    monkeypatch.setattr(vidconv, "convert", fake_convert)
+    cfg = vidconv.Config(probe_cache=None)
+    stats = vidconv.run_batch(discover(), AV1, cfg, vidconv.Log(quiet=True), out, src, 1)
+    assert (stats.processed, stats.skipped, stats.failed) == (3, 1, 1)
+    # The first encode ran before discovery had finished
+    assert seen[0] < len(files) + 1
+    assert (out / "x" / "c.av1-crf26.mkv").exists()
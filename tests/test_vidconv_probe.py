@@ -0,0 +1,95 @@
+import os
+
+import vidconv
+
+FFPROBE = {
+    "format": {
+        "duration": "5400.5",
+        "size": "1000",
+        "bit_rate": "4000000",
+        "format_name": "matroska,webm",
+    },
+    "streams": [
+        {
+            "index": 0,
+            "codec_type": "video",
+            "codec_name": "hevc",
+            "width": 3840,
+            "height": 1600,
+            "avg_frame_rate": "24000/1001",
+            "pix_fmt": "yuv420p10le",
+        },
+        {
+            "index": 1,
+            "codec_type": "audio",
+            "codec_name": "opus",
+            "channels": 6,
+            "tags": {"BPS": "256000"},
+        },
+        {
+            "index": 2,
+            "codec_type": "video",
+            "codec_name": "mjpeg",
+            "disposition": {"attached_pic": 1},
+        },
+    ],
+}
+
+
+def test_parse_probe():
+    pr = vidconv.parse_probe(FFPROBE)
+    assert pr.duration == 5400.5
+    assert pr.video.codec == "hevc"
+    assert pr.pixels == 3840 * 1600
+    assert round(pr.video.fps, 3) == 23.976
+    assert [a.bit_rate for a in pr.audio] == [256000]
+    assert pr.streams[2].kind == "image"
+    assert pr.describe().endswith("1:30:00")
+
+
+def test_parse_probe_missing_fields():
+    pr = vidconv.parse_probe({"streams": [{"codec_type": "audio"}]})
+    assert pr.duration == 0.0
+    assert pr.video is None
+    assert pr.audio[0].channels == 0
+
+
+def test_probe_cache_invalidation(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(vidconv, "has", lambda cmd: True)
+    monkeypatch.setattr(
+        vidconv, "run_ffprobe", lambda p: calls.append(p) or FFPROBE
+    )
+    src = tmp_path / "a.mkv"
+    src.write_bytes(b"x" * 10)
+    cache = vidconv.ProbeCache(tmp_path / "probe.sqlite")
+
+    assert vidconv.probe_file(src, cache).video.codec == "hevc"
+    assert vidconv.probe_file(src, cache).video.codec == "hevc"
+    assert len(calls) == 1
+
+    src.write_bytes(b"x" * 20)
+    vidconv.probe_file(src, cache)
+    assert len(calls) == 2
+    cache.close()
+
+    # A fresh connection sees the persisted row
+    cache = vidconv.ProbeCache(tmp_path / "probe.sqlite")
+    assert cache.get(src.resolve(), os.stat(src)) is not None
+    cache.close()
+
+
+def test_prefetch_probes_keeps_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(vidconv, "has", lambda cmd: True)
+    monkeypatch.setattr(vidconv, "run_ffprobe", lambda p: FFPROBE)
+    files = []
+    for i in range(10):
+        f = tmp_path / f"{i}.mkv"
+        f.write_bytes(b"x")
+        files.append(f)
+    cache = vidconv.ProbeCache(tmp_path / "probe.sqlite")
+    out = list(vidconv.prefetch_probes(iter(files), cache, 3))
+    cache.close()
+    assert [f for f, _ in out] == files
+    assert all(pr is not None for _, pr in out)
+    assert next(iter(vidconv.prefetch_probes(files, None, 3))) == (files[0], None)
@@ -0,0 +1,87 @@
+import sys
+from pathlib import Path
+
+import vidconv
+
+
+def test_progress_seconds():
+    assert vidconv._progress_seconds({"out_time_us": "1500000"}) == 1.5
+    assert vidconv._progress_seconds({"out_time_ms": "2000000"}) == 2.0
+    assert vidconv._progress_seconds({"out_time_us": "N/A"}) == 0.0
+    assert vidconv._progress_seconds({"out_time_us": "-5"}) == 0.0
+
+
+def test_progress_aggregates_workers_and_chunks():
+    p = vidconv.Progress(tty=False)
+    try:
+        for _ in range(3):
+            p.add(100.0)
+        p.finish(100.0)
+        with p.task("a.mkv", 100.0) as a, p.task("b.mkv", 100.0) as b:
+            a({"out_time_us": "25000000", "fps": "30", "speed": "1.5x"}, 0)
+            a({"out_time_us": "25000000", "fps": "30", "speed": "1.5x"}, 1)
+            b({"out_time_us": "10000000", "fps": "N/A", "speed": "N/A"}, 0)
+            lines = p.lines()
+            assert len(lines) == 3
+            assert "50.0%" in lines[0] and "60.0fps" in lines[0]
+            assert "3.00x" in lines[-1]
+            # 100s done + 50s + 10s in flight out of 300s
+            assert "0:02:40/0:05:00+" in lines[-1]
+        assert len(p.lines()) == 1
+    finally:
+        p.close()
+
+
+def test_skipped_files_leave_the_rate_alone():
+    p = vidconv.Progress(tty=False)
+    try:
+        rt = vidconv.Runtime(progress=p)
+        probe = vidconv.Probe(100.0, 1000, 0, "matroska", [])
+        for _ in range(3):
+            vidconv._queued(rt, probe)
+        skipped = vidconv.Stats(skipped=1)
+        reused = vidconv.Stats(processed=1)
+        reused.decisions["reused: hardlink"] += 1
+        vidconv._finished(rt, Path("a"), probe, skipped)
+        vidconv._finished(rt, Path("b"), probe, reused)
+        # Only the one file that still needs encoding is left, none done
+        assert (p.total_seconds, p.done_seconds, p.files_done) == (100.0, 0.0, 2)
+        vidconv._finished(rt, Path("c"), probe, vidconv.Stats(processed=1))
+        assert (p.total_seconds, p.done_seconds) == (100.0, 100.0)
+    finally:
+        p.close()
+
+
+def test_run_cmd_parses_progress_blocks():
+    script = (
+        "print('frame=1\\nout_time_us=1000000\\nprogress=continue');"
+        "print('frame=2\\nout_time_us=2000000\\nprogress=end')"
+    )
+    seen = []
+    ok = vidconv.run_cmd(
+        [sys.executable, "-c", script], True, on_progress=lambda f: seen.append(f)
+    )
+    assert ok
+    assert [f["out_time_us"] for f in seen] == ["1000000", "2000000"]
+    assert seen[-1]["progress"] == "end"
+
+
+def test_run_cmd_reports_failure():
+    assert not vidconv.run_cmd([sys.executable, "-c", "raise SystemExit(3)"], True)
+
+
+def test_log_routes_through_live_dashboard(capsys):
+    class Live:
+        def __init__(self):
+            self.lines = []
+
+        def write(self, text, file):
+            self.lines.append(text)
+
+    log = vidconv.Log()
+    log.color = False
+    log.live = Live()
+    log.info("hello")
+    log.err("boom")
+    assert log.live.lines == ["hello", "✗ boom"]
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,124 @@
+import errno
+import json
+
+import pytest
+import vidconv
+
+
+def test_copy_fast_falls_back_to_sendfile(tmp_path, monkeypatch):
+    src = tmp_path / "src.bin"
+    data = bytes(range(256)) * 5000
+    src.write_bytes(data)
+    assert vidconv.copy_fast(src, tmp_path / "a.bin") == len(data)
+    assert (tmp_path / "a.bin").read_bytes() == data
+
+    def cross_device(*a):
+        raise OSError(errno.EXDEV, "cross-device")
+
+    monkeypatch.setattr(vidconv.os, "copy_file_range", cross_device)
+    monkeypatch.setattr(vidconv, "COPY_CHUNK", 4096)
+    assert vidconv.copy_fast(src, tmp_path / "b.bin") == len(data)
+    assert (tmp_path / "b.bin").read_bytes() == data
+
+
+def test_stager_budget_and_release(tmp_path):
+    big, small = tmp_path / "big.mkv", tmp_path / "small.mkv"
+    big.write_bytes(b"b" * 2000)
+    small.write_bytes(b"s" * 600)
+    stager = vidconv.Stager(tmp_path / "scratch", 1000, vidconv.Log(quiet=True))
+    try:
+        stager.prefetch(big)
+        stager.prefetch(small)
+        stager._staged[small].result()  # let the copy land before the "job" starts
+        assert stager.acquire(big) == big  # larger than the whole budget
+        staged = stager.acquire(small)
+        assert staged.parent == stager.dir and staged.read_bytes() == small.read_bytes()
+        assert stager.used == 600
+        stager.release(small)
+        stager.release(big)
+        assert stager.used == 0 and not staged.exists()
+    finally:
+        stager.close()
+    assert not stager.dir.exists()
+
+
+def test_unstaged_job_reads_source(tmp_path):
+    f = tmp_path / "a.mkv"
+    f.write_bytes(b"x")
+    stager = vidconv.Stager(tmp_path / "scratch", 10, vidconv.Log(quiet=True))
+    try:
+        assert stager.acquire(f) == f
+        stager.release(f)
+    finally:
+        stager.close()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_batch_encodes_from_scratch(tmp_path, monkeypatch, jobs):
+    src = tmp_path / "nas"
+    src.mkdir()
+    files = []
+    for n in ("a", "b", "c"):
+        f = src / f"{n}.mp4"
+        f.write_bytes(n.encode() * 100)
+        files.append(f)
+    scratch = tmp_path / "ssd"
+    seen = []
+
+    def fake_convert(inp, out, *args, **kwargs):
+        seen.append((inp, out))
+        out.write_bytes(inp.read_bytes()[:10])
+        return vidconv.RunResult(True)
+
+    monkeypatch.setattr(vidconv, "convert", fake_convert)
+    out = tmp_path / "out"
+    cfg = vidconv.Config(scratch=scratch, probe_cache=None)
+    stats = vidconv.run_batch(
+        files, vidconv.PRESETS["av1"], cfg, vidconv.Log(quiet=True), out, src, jobs
+    )
+    assert stats.processed == 3
+    # Every input after the first was prefetched; all outputs went via scratch
+    assert all(o.is_relative_to(scratch) for _, o in seen)
+    assert sum(i.is_relative_to(scratch) for i, _ in seen) >= 2
+    assert sorted(p.name for p in out.glob("*.mkv")) == [
+        "a.av1-crf26.mkv",
+        "b.av1-crf26.mkv",
+        "c.av1-crf26.mkv",
+    ]
+    assert (out / "b.av1-crf26.mkv").read_bytes() == b"b" * 10
+    assert list(scratch.iterdir()) == []
+    journal = (out / vidconv.JOURNAL_NAME).read_text().splitlines()
+    assert sum(json.loads(line)["state"] == "done" for line in journal) == 3
+
+
+def test_failed_move_counts_as_failed(tmp_path, monkeypatch):
+    src = tmp_path / "nas"
+    src.mkdir()
+    files = []
+    for n in ("a", "b"):
+        f = src / f"{n}.mp4"
+        f.write_bytes(n.encode() * 100)
+        files.append(f)
+
+    def fake_convert(inp, out, *args, **kwargs):
+        out.write_bytes(b"o" * 10)
+        return vidconv.RunResult(True)
+
+    real_move = vidconv.shutil.move
+
+    def flaky_move(a, b):
+        if "b.av1" in str(b):
+            raise OSError(28, "No space left on device")
+        return real_move(a, b)
+
+    monkeypatch.setattr(vidconv, "convert", fake_convert)
+    monkeypatch.setattr(vidconv.shutil, "move", flaky_move)
+    out = tmp_path / "out"
+    cfg = vidconv.Config(scratch=tmp_path / "ssd", probe_cache=None)
+    stats = vidconv.run_batch(
+        files, vidconv.PRESETS["av1"], cfg, vidconv.Log(quiet=True), out, src, 1
+    )
+    assert (stats.processed, stats.failed) == (1, 1)
+    assert stats.output_bytes == 10 and stats.input_bytes == 100
+    assert stats.failures == [f"{files[1]}: output move failed"]
+    assert [p.name for p in out.glob("*.mkv")] == ["a.av1-crf26.mkv"]
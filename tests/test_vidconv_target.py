@@ -0,0 +1,106 @@
+from pathlib import Path
+
+import vidconv
+
+
+def _probe(duration=600.0):
+    return vidconv.Probe(duration, 1000, 0, "matroska", [])
+
+
+def test_sample_points_spread_and_short_clip():
+    assert vidconv.sample_points(600.0, 3, 4.0) == [98.0, 298.0, 498.0]
+    assert vidconv.sample_points(10.0, 3, 4.0) == [0.0]
+
+
+def test_search_crf_finds_highest_passing(monkeypatch):
+    calls = []
+
+    def fake_score(inp, preset, cfg, start, work, metric, video="v:0"):
+        calls.append((cfg.crf, start))
+        return 1.0 - cfg.crf / 1000  # crf 30 -> 0.970
+
+    monkeypatch.setattr(vidconv, "sample_score", fake_score)
+    cfg = vidconv.Config(crf_range=(18, 45), samples=2)
+    found = vidconv.search_crf(
+        Path("in.mkv"), vidconv.PRESETS["av1"], cfg, _probe(), "ssim", 0.97
+    )
+    assert found["crf"] == 30
+    assert all(found["scores"][c] >= 0.97 for c in found["scores"] if c <= 30)
+    # Every probed CRF encoded both samples
+    assert len(calls) == 2 * len(found["scores"])
+
+
+def test_search_crf_falls_back_to_min_and_aborts_on_failure(monkeypatch):
+    monkeypatch.setattr(vidconv, "sample_score", lambda *a: 0.5)
+    cfg = vidconv.Config(crf_range=(20, 30))
+    found = vidconv.search_crf(
+        Path("in.mkv"), vidconv.PRESETS["av1"], cfg, _probe(), "ssim", 0.99
+    )
+    assert found["crf"] == 20
+    monkeypatch.setattr(vidconv, "sample_score", lambda *a: None)
+    assert (
+        vidconv.search_crf(
+            Path("in.mkv"), vidconv.PRESETS["av1"], cfg, _probe(), "ssim", 0.99
+        )
+        is None
+    )
+
+
+def test_target_crf_cached_per_input(tmp_path, monkeypatch):
+    inp = tmp_path / "a.mkv"
+    inp.write_bytes(b"x")
+    runs = []
+
+    def fake_search(*a):
+        runs.append(a)
+        return {"crf": 33, "scores": {"33": 0.98}}
+
+    monkeypatch.setattr(vidconv, "search_crf", fake_search)
+    cache = vidconv.ProbeCache(tmp_path / "c.sqlite")
+    rt = vidconv.Runtime(probes=cache)
+    cfg = vidconv.Config(target_ssim=0.98)
+    log = vidconv.Log(quiet=True)
+    preset = vidconv.PRESETS["av1"]
+    assert vidconv.target_crf(inp, preset, cfg, log, _probe(), rt) == 33
+    assert vidconv.target_crf(inp, preset, cfg, log, _probe(), rt) == 33
+    assert len(runs) == 1
+    # A different target is a different analysis
+    other = vidconv.Config(target_ssim=0.99)
+    vidconv.target_crf(inp, preset, other, log, _probe(), rt)
+    assert len(runs) == 2
+    cache.close()
+
+
+def test_target_crf_skipped_without_target_or_probe():
+    log = vidconv.Log(quiet=True)
+    preset = vidconv.PRESETS["av1"]
+    assert vidconv.target_crf(Path("a"), preset, vidconv.Config(), log, _probe()) is None
+    cfg = vidconv.Config(target_psnr=42.0)
+    assert vidconv.target_crf(Path("a"), preset, cfg, log, None) is None
+    assert (
+        vidconv.target_crf(Path("a"), vidconv.PRESETS["opus"], cfg, log, _probe())
+        is None
+    )
+
+
+def test_out_path_named_by_target():
+    cfg = vidconv.Config(target_ssim=0.98)
+    out = vidconv.gen_out_path(
+        Path("/v/a.mp4"), vidconv.PRESETS["av1"], cfg, None, None
+    )
+    assert "ssim0.98" in out.name and "crf" not in out.name
+
+
+def test_sample_encode_maps_exactly_one_video_stream(tmp_path, monkeypatch):
+    seen = []
+
+    def fake_ffmpeg(inp, out, params, *a, **k):
+        seen.append(params)
+        return vidconv.RunResult(False)
+
+    monkeypatch.setattr(vidconv, "run_ffmpeg", fake_ffmpeg)
+    cfg = vidconv.Config()
+    assert vidconv.sample_score(Path("in.mkv"), vidconv.PRESETS["av1"], cfg, 0.0, tmp_path, "ssim", "1") is None
+    (params,) = seen
+    maps = [params[i + 1] for i, v in enumerate(params) if v == "-map"]
+    assert maps == ["0:1"]
@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+import vidconv
+
+Config = vidconv.Config
+PRESETS = vidconv.PRESETS
+
+
+def _opt(params, key):
+    return params[params.index(key) + 1]
+
+
+def test_parse_jobs():
+    assert vidconv.parse_jobs("auto") == 0
+    assert vidconv.parse_jobs("4") == 4
+    for bad in ("0", "many"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            vidconv.parse_jobs(bad)
+
+
+def test_auto_jobs():
+    assert vidconv.auto_jobs(PRESETS["av1"], 64) == 8
+    assert vidconv.auto_jobs(PRESETS["av1"], 4) == 1
+    assert vidconv.auto_jobs(PRESETS["opus"], 64) == 64
+
+
+def test_no_thread_params_by_default():
+    for name in ("av1", "vp9", "h265", "x264"):
+        params = vidconv.build_params(PRESETS[name], Config())
+        assert "-threads" not in params
+        assert ":lp=" not in " ".join(params)
+        assert ":pools=" not in " ".join(params)
+
+
+def test_thread_params_per_preset():
+    cfg = Config(threads=8)
+    assert _opt(vidconv.build_params(PRESETS["av1"], cfg), "-svtav1-params").endswith(
+        ":lp=8"
+    )
+    assert (
+        _opt(vidconv.build_params(PRESETS["h265"], cfg), "-x265-params")
+        == "log-level=error:pools=8"
+    )
+    vp9 = vidconv.build_params(PRESETS["vp9"], cfg)
+    assert (_opt(vp9, "-threads"), _opt(vp9, "-tile-columns")) == ("8", "3")
+    assert _opt(vidconv.build_params(PRESETS["x264"], cfg), "-threads") == "8"
+
+
+def test_cpu_pool_slots_are_disjoint():
+    pool = vidconv.CpuPool(list(range(8)), 4)
+    with pool.slot() as a, pool.slot() as b:
+        assert len(a) == 2 and not a & b
+
+
+@pytest.mark.parametrize("taskset", [True, False])
+def test_run_cmd_pins_child_without_preexec(monkeypatch, taskset):
+    cpu = max(os.sched_getaffinity(0))
+    if not taskset:
+        monkeypatch.setattr(vidconv, "has", lambda tool: False)
+    elif not vidconv.has("taskset"):
+        pytest.skip("taskset not installed")
+    script = "import os, sys, time; time.sleep(0.2); print(sorted(os.sched_getaffinity(0)), file=sys.stderr)"
+    cmd = [sys.executable, "-c", script]
+    res = vidconv.run_cmd(cmd, True, frozenset({cpu}))
+    assert res.stderr.strip() == f"[{cpu}]" and res.tool == Path(sys.executable).name
+    res = asyncio.run(vidconv.run_cmd_async(cmd, True, frozenset({cpu})))
+    assert res.stderr.strip() == f"[{cpu}]"
+
+
+def test_cpu_pool_waits_off_the_event_loop():
+    pool = vidconv.CpuPool(list(range(2)), 1)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        async def hold():
+            async with pool.slot_async() as cpus:
+                await asyncio.sleep(0.2)
+                return cpus
+
+        ticker = asyncio.create_task(tick())
+        first = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        got = await asyncio.gather(first, hold())
+        ticker.cancel()
+        return ticks, got
+
+    ticks, (a, b) = asyncio.run(run())
+    # The loop kept running while a job waited for the only slot, and the
+    # cancelled waiter gave back the slot it was handed
+    assert ticks > 20 and a == b == frozenset({0, 1})
+    with pool.slot() as cpus:
+        assert cpus == a
@@ -0,0 +1,90 @@
+import json
+import os
+from pathlib import Path
+
+import vidconv
+
+
+def _tree(root):
+    for rel in ["a.mkv", "b.txt", "x/c.MP4", "x/y/d.webm", ".hidden/e.mkv", "x/.f.part.mkv"]:
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(b"x" * len(rel))
+    (root / "link").symlink_to(root / "x", target_is_directory=True)
+    (root / "alias.mkv").symlink_to(root / "a.mkv")
+
+
+def test_scan_tree_matches_walk_and_carries_stat(tmp_path):
+    _tree(tmp_path)
+    root = tmp_path.resolve()
+    walk = vidconv.WalkStats()
+    found = list(vidconv.scan_tree(root, vidconv.VIDEO_EXTS, workers=3, stats=walk))
+    names = sorted(str(p.relative_to(root)) for p in found)
+    assert names == ["a.mkv", "alias.mkv", "x/c.MP4", "x/y/d.webm"]
+    assert len(walk) == 4
+    for p in found:
+        # Plain paths; the stat rides alongside rather than on a Path subclass
+        assert type(p) is type(Path())
+        st, canonical = walk.get(p)
+        assert st.st_size == os.stat(p).st_size == vidconv.path_stat(p, walk).st_size
+        assert canonical == (p.name != "alias.mkv")
+        assert vidconv.real_path(p, walk) == p.resolve()
+        walk.forget(p)
+    assert len(walk) == 0
+
+
+def test_scans_keep_their_stats_apart(tmp_path):
+    (tmp_path / "a.mkv").write_bytes(b"x")
+    first, second = vidconv.WalkStats(), vidconv.WalkStats()
+    (f,) = vidconv.scan_tree(tmp_path, vidconv.VIDEO_EXTS, stats=first)
+    assert list(vidconv.scan_tree(tmp_path, vidconv.VIDEO_EXTS, stats=second)) == [f]
+    first.forget(f)
+    assert first.get(f) is None and second.get(f)
+    # Without a collector nothing is kept at all
+    assert list(vidconv.scan_tree(tmp_path, vidconv.VIDEO_EXTS)) == [f]
+
+
+def test_scan_tree_empty_and_early_close(tmp_path):
+    assert list(vidconv.scan_tree(tmp_path, vidconv.VIDEO_EXTS)) == []
+    for i in range(50):
+        d = tmp_path / f"d{i}"
+        d.mkdir()
+        (d / "v.mkv").touch()
+    it = vidconv.scan_tree(tmp_path, vidconv.VIDEO_EXTS)
+    assert next(it).name == "v.mkv"
+    it.close()
+
+
+def test_probe_reuses_walker_stat(tmp_path, monkeypatch):
+    (tmp_path / "a.mkv").write_bytes(b"x")
+    walk = vidconv.WalkStats()
+    (f,) = vidconv.scan_tree(tmp_path.resolve(), vidconv.VIDEO_EXTS, stats=walk)
+    monkeypatch.setattr(
+        vidconv.Path, "stat", lambda *a, **k: (_ for _ in ()).throw(AssertionError)
+    )
+    assert vidconv.path_stat(f, walk).st_size == 1
+    assert vidconv.job_cost(f, None, walk) == 1.0
+
+
+def test_start_output_recreates_a_removed_directory(tmp_path):
+    out = tmp_path / "out" / "sub" / "a.mkv"
+    vidconv._ensure_dir(out.parent)
+    out.parent.rmdir()
+    src = tmp_path / "a.mp4"
+    src.write_bytes(b"x")
+    cfg = vidconv.Config()
+    vidconv.start_output(src, out, cfg, vidconv.Log(quiet=True))
+    assert out.parent.is_dir()
+
+
+def test_bench_walk_small_tree(tmp_path):
+    out = tmp_path / "walk.json"
+    root = tmp_path / "tree"
+    assert vidconv.bench_main(
+        ["walk", "--files", "250", "--per-dir", "40", "--root", str(root), "--json", str(out)]
+    ) == 0
+    rows = json.loads(out.read_text())
+    # 3 of the 4 synthetic extensions are video
+    counts = {r["method"]: r["files"] for r in rows}
+    assert counts["scandir"] == counts["os.walk+stat"] == 188
+    assert (root / ".complete").exists()
@@ -0,0 +1,119 @@
+import os
+import queue
+import threading
+import time
+
+import vidconv
+
+
+def _watch(root, settle=0.3, exclude=None):
+    got = queue.Queue()
+    w = vidconv.Watcher(root, vidconv.VIDEO_EXTS, exclude=exclude, settle=settle)
+
+    def run():
+        for p in w:
+            got.put((p, time.monotonic()))
+
+    threading.Thread(target=run, daemon=True).start()
+    return got
+
+
+def _drain(got, count, wait=3.0):
+    out = []
+    deadline = time.monotonic() + wait
+    while len(out) < count and (left := deadline - time.monotonic()) > 0:
+        try:
+            out.append(got.get(timeout=left))
+        except queue.Empty:
+            break
+    return out
+
+
+def test_watch_picks_up_existing_closed_and_moved_files(tmp_path):
+    (tmp_path / "old.mkv").write_bytes(b"x")
+    out = tmp_path / "out"
+    out.mkdir()
+    got = _watch(tmp_path, exclude=out)
+    time.sleep(0.1)
+    (tmp_path / "new.mp4").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_bytes(b"x")
+    (tmp_path / ".new.part.mkv").write_bytes(b"x")
+    (out / "encoded.mkv").write_bytes(b"x")
+    staged = tmp_path.parent / f"{tmp_path.name}-staging"
+    (staged / "sub").mkdir(parents=True)
+    (staged / "sub" / "deep.webm").write_bytes(b"x")
+    os.rename(staged, tmp_path / "moved")
+    names = sorted(p.name for p, _ in _drain(got, 3))
+    assert names == ["deep.webm", "new.mp4", "old.mkv"]
+
+
+def test_growing_file_waits_until_stable(tmp_path):
+    got = _watch(tmp_path, settle=0.4)
+    time.sleep(0.1)
+    f = tmp_path / "rec.mkv"
+    start = time.monotonic()
+    for _ in range(4):
+        with f.open("ab") as fh:
+            fh.write(b"x" * 100)
+        time.sleep(0.2)
+    ((p, when),) = _drain(got, 1)
+    assert p == f
+    assert got.empty()
+    # Yielded only after the last write settled, not after the first close
+    assert when - start >= 0.6 + 0.4 - 0.05
+
+
+def test_inotify_rejects_missing_dir(tmp_path):
+    ino = vidconv.Inotify()
+    try:
+        ino.add(tmp_path / "missing")
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError("expected FileNotFoundError")
+    finally:
+        ino.close()
+
+
+def test_feeder_serves_concurrent_pulls_after_exhaustion():
+    feeder = vidconv.Feeder(iter([1, 2]))
+    futs = [feeder.pull() for _ in range(5)]
+    assert [f.result(timeout=2) for f in futs] == [1, 2, None, None, None]
+    assert feeder.exhausted
+
+
+def test_seen_entries_leave_with_the_file(tmp_path):
+    got = queue.Queue()
+    w = vidconv.Watcher(tmp_path, vidconv.VIDEO_EXTS, settle=0.2)
+    threading.Thread(target=lambda: [got.put(p) for p in w], daemon=True).start()
+    time.sleep(0.1)
+    (tmp_path / "sub").mkdir()
+    for name in ("a.mkv", "b.mkv", "sub/c.mkv"):
+        (tmp_path / name).write_bytes(b"x")
+    assert len(_drain(got, 3)) == 3
+    assert len(w.seen) == 3
+    w.done(tmp_path / "a.mkv")
+    (tmp_path / "b.mkv").unlink()
+    os.rename(tmp_path / "sub", tmp_path.parent / f"{tmp_path.name}-gone")
+    deadline = time.monotonic() + 2
+    while w.seen and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert w.seen == {}
+
+
+def test_run_watch_releases_finished_files(tmp_path, monkeypatch):
+    calls = {}
+
+    def fake_execute(files, *args, **kwargs):
+        calls.update(kwargs)
+        return vidconv.Stats()
+
+    monkeypatch.setattr(vidconv, "execute", fake_execute)
+    w = vidconv.Watcher(tmp_path, vidconv.VIDEO_EXTS)
+    vidconv.run_watch(w, vidconv.PRESETS["av1"], vidconv.Config(), vidconv.Log(quiet=True), None, tmp_path, 1)
+    p = tmp_path / "a.mkv"
+    w.seen[p] = (1, 1)
+    rt = vidconv.Runtime(done=calls["done"])
+    vidconv._finished(rt, p, None)
+    assert p not in w.seen
+    w.ino.close()